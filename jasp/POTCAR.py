@@ -1,9 +1,338 @@
 '''
 Module to parse POTCAR files
+
+The information we need from a POTCAR (the git-style hash of the file,
+ZVAL, ENMAX, ENMIN and TITEL) is read once per process and cached,
+keyed on the path, modification time and size of the file. Compressed
+POTCAR.Z and POTCAR.gz files are uncompressed in-process.
+
+Finding a POTCAR means probing for the file in each directory of
+VASP_PP_PATH, which is slow when the library is on a network file
+system. build_potcar_index (or the jasppotcars command) walks the
+library once and stores the information of every POTCAR in the file
+JASPRC['potcar.index']. When that index exists for the current
+VASP_PP_PATH, POTCARs are found with a dictionary lookup, and their
+information is taken from the index instead of reading the files.
+Rebuild the index when the library changes.
 '''
 
+import gzip
+import json
+import os
 import re
-from subprocess import Popen, PIPE
+import thread
+from hashlib import sha1
+from StringIO import StringIO
+from jasprc import JASPRC
+
+# abspath: ((mtime, size), info dictionary)
+_potcar_info_cache = {}
+
+# the directories of a POTCAR library
+POTCAR_LIBRARIES = ['potpaw', 'potpaw_PBE', 'potpaw_GGA']
+
+# index file: (mtime, index) of the last index read
+_potcar_index_cache = {}
+
+
+def uncompress_Z(data):
+    '''Return the uncompressed data of a file made by compress(1).
+
+    compress writes LZW codes of 9 to maxbits bits, least significant
+    bit first, in groups of eight codes. When the code size changes, or
+    the table is cleared, the rest of the current group is padding.
+    '''
+    if data[:2] != '\x1f\x9d':
+        raise IOError('Not a compressed (.Z) file')
+
+    flags = ord(data[2])
+    maxbits = flags & 0x1f
+    block_mode = flags & 0x80
+    if not 9 <= maxbits <= 16:
+        raise IOError('Unsupported .Z file with {0} bits'.format(maxbits))
+    maxmaxcode = 1 << maxbits
+
+    # two extra bytes so we can always read three bytes for a code
+    buf = bytearray(data[3:]) + bytearray(2)
+    nbits = (len(buf) - 2) * 8
+
+    table = [chr(i) for i in range(256)] + ['']
+    free_ent = 257 if block_mode else 256
+    n_bits = 9
+    maxcode = (1 << n_bits) - 1
+    pos = group_start = 0
+    prev = None
+    out = []
+
+    while pos + n_bits <= nbits:
+        if free_ent > maxcode:
+            # skip to the end of the group, and use bigger codes
+            group = n_bits * 8
+            pos += -(pos - group_start) % group
+            group_start = pos
+            n_bits += 1
+            if n_bits == maxbits:
+                maxcode = maxmaxcode
+            else:
+                maxcode = (1 << n_bits) - 1
+            continue
+
+        i = pos >> 3
+        code = ((buf[i] | buf[i + 1] << 8 | buf[i + 2] << 16)
+                >> (pos & 7)) & ((1 << n_bits) - 1)
+        pos += n_bits
+
+        if prev is None:
+            if code >= 256:
+                raise IOError('Corrupt .Z file')
+            out.append(table[code])
+            prev = code
+            continue
+
+        if code == 256 and block_mode:
+            table = table[:257]
+            free_ent = 257
+            group = n_bits * 8
+            pos += -(pos - group_start) % group
+            group_start = pos
+            n_bits = 9
+            maxcode = (1 << n_bits) - 1
+            prev = None
+            continue
+
+        if code < free_ent:
+            entry = table[code]
+        elif code == free_ent:
+            entry = table[prev] + table[prev][0]
+        else:
+            raise IOError('Corrupt .Z file')
+        out.append(entry)
+
+        if free_ent < maxmaxcode:
+            table.append(table[prev] + entry[0])
+            free_ent += 1
+        prev = code
+
+    return ''.join(out)
+
+
+def read_potcar_file(potcar):
+    '''Return (data, text) of the file potcar.
+
+    data is the contents of the file, and text is the uncompressed
+    contents for .Z and .gz files.
+    '''
+    with open(potcar, 'rb') as f:
+        data = f.read()
+
+    if potcar.endswith('.Z'):
+        try:
+            text = uncompress_Z(data)
+        except (IOError, IndexError), e:
+            raise Exception('Cannot read POTCAR.Z:\n\n{0}'.format(e))
+    elif potcar.endswith('.gz'):
+        text = gzip.GzipFile(fileobj=StringIO(data)).read()
+    else:
+        text = data
+    return data, text
+
+
+def _search(pattern, text):
+    m = re.search(pattern, text)
+    if m is None:
+        return None
+    return m.group(1)
+
+
+def get_potcar_info(potcar):
+    '''Return a dictionary of information about the potcar file.
+
+    The keys are hash (the sha1 hash git would give the file), ZVAL,
+    ENMAX, ENMIN and TITEL. For a POTCAR of several elements, the
+    values are from the first one. The result is cached until the file
+    changes.
+    '''
+    key = os.path.abspath(potcar)
+    st = os.stat(potcar)
+    stamp = (st.st_mtime, st.st_size)
+
+    cached = _potcar_info_cache.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    index = get_potcar_index()
+    if index is not None:
+        info = index['paths'].get(key)
+        if info is not None and (info['mtime'], info['size']) == stamp:
+            _potcar_info_cache[key] = (stamp, info)
+            return info
+
+    data, text = read_potcar_file(potcar)
+
+    # get sha1 hashes similar to the way git does it
+    # http://stackoverflow.com/questions/552659/assigning-git-sha1s-without-git
+    # git hash-object foo.txt  will generate a command-line hash
+    s = sha1()
+    s.update("blob %u\0" % len(data))
+    s.update(data)
+
+    info = {'hash': s.hexdigest(),
+            'TITEL': _search('TITEL\s*=\s*(.*\S)', text)}
+
+    for name, pattern in [('ZVAL', 'ZVAL   =\s*([0-9]*\.?[0-9]*)'),
+                          ('ENMAX', 'ENMAX\s*=\s*([0-9]+.[0-9]+);'),
+                          ('ENMIN', 'ENMIN\s*=\s*([0-9]+.[0-9]+)\s+eV')]:
+        value = _search(pattern, text)
+        info[name] = None if value is None else float(value)
+
+    _potcar_info_cache[key] = (stamp, info)
+    return info
+
+
+def get_pppaths():
+    '''Return the list of directories in VASP_PP_PATH.'''
+    if 'VASP_PP_PATH' in os.environ:
+        return os.environ['VASP_PP_PATH'].split(':')
+    return []
+
+
+def get_potcar_index_file():
+    '''Return the path of the index file, or None if there is none.'''
+    fname = JASPRC.get('potcar.index', 'None')
+    if fname in [None, 'None']:
+        return None
+    return os.path.expanduser(fname)
+
+
+def build_potcar_index(pppaths=None, fname=None):
+    '''Walk the POTCAR libraries in pppaths and write an index to fname.
+
+    pppaths defaults to the directories in VASP_PP_PATH, and fname to
+    JASPRC['potcar.index']. The index is a dictionary with the keys:
+
+    VASP_PP_PATH: the VASP_PP_PATH it was built for
+    potcars: {name: path} where name is e.g. potpaw_PBE/Fe_pv/POTCAR,
+             and path is the POTCAR (or POTCAR.Z) found for it first.
+    paths: {abspath: info} where info is the get_potcar_info dictionary,
+           with the symbol, setup, size and mtime of the file.
+
+    Returns the index.
+    '''
+    if pppaths is None:
+        pppaths = get_pppaths()
+    if fname is None:
+        fname = get_potcar_index_file()
+    if fname is None:
+        raise Exception("JASPRC['potcar.index'] is not set")
+
+    potcars, paths = {}, {}
+    for pppath in pppaths:
+        for library in POTCAR_LIBRARIES:
+            libdir = os.path.join(pppath, library)
+            if not os.path.isdir(libdir):
+                continue
+            for setup in sorted(os.listdir(libdir)):
+                name = '/'.join([library, setup, 'POTCAR'])
+                if name in potcars:
+                    # an earlier path in VASP_PP_PATH wins
+                    continue
+                files = os.listdir(os.path.join(libdir, setup)) \
+                    if os.path.isdir(os.path.join(libdir, setup)) else []
+                for potcar in ['POTCAR', 'POTCAR.Z']:
+                    if potcar in files:
+                        break
+                else:
+                    continue
+
+                path = os.path.join(libdir, setup, potcar)
+                st = os.stat(path)
+                info = dict(get_potcar_info(path))
+                m = re.match('([A-Z][a-z]?)(.*)', setup)
+                info['symbol'] = m.group(1) if m else setup
+                info['setup'] = m.group(2) if m else ''
+                info['size'] = st.st_size
+                info['mtime'] = st.st_mtime
+
+                potcars[name] = path
+                paths[os.path.abspath(path)] = info
+
+    index = {'VASP_PP_PATH': ':'.join(pppaths),
+             'potcars': potcars,
+             'paths': paths}
+
+    tmpfile = '{0}.{1}.{2}'.format(fname, os.getpid(), thread.get_ident())
+    with open(tmpfile, 'w') as f:
+        json.dump(index, f)
+    os.rename(tmpfile, fname)
+    _potcar_index_cache.clear()
+    return index
+
+
+def get_potcar_index():
+    '''Return the POTCAR index for the current VASP_PP_PATH.
+
+    Returns None if there is no index file, or if it was built for a
+    different VASP_PP_PATH.
+    '''
+    fname = get_potcar_index_file()
+    if fname is None:
+        return None
+    try:
+        mtime = os.stat(fname).st_mtime
+    except OSError:
+        return None
+
+    cached = _potcar_index_cache.get(fname)
+    if cached is not None and cached[0] == mtime:
+        index = cached[1]
+    else:
+        try:
+            with open(fname) as f:
+                index = json.load(f)
+        except (IOError, ValueError):
+            return None
+        # json gives us unicode, but the rest of jasp uses str
+        index['potcars'] = dict((str(k), str(v))
+                                for k, v in index['potcars'].items())
+        paths = {}
+        for path, info in index['paths'].items():
+            info = dict((str(k), v) for k, v in info.items())
+            for key in ['hash', 'TITEL', 'symbol', 'setup']:
+                if info[key] is not None:
+                    info[key] = str(info[key])
+            paths[str(path)] = info
+        index['paths'] = paths
+        _potcar_index_cache[fname] = (mtime, index)
+
+    if index['VASP_PP_PATH'] != ':'.join(get_pppaths()):
+        return None
+    return index
+
+
+def find_potcar(name, pppaths=None):
+    '''Return the path to the POTCAR name, e.g. potpaw_PBE/Fe/POTCAR.
+
+    The POTCAR is looked up in the index if there is one. If it is not
+    there, or the file in the index is gone, we look for name, or
+    name.Z, in each directory of pppaths (default VASP_PP_PATH).
+    Returns None if it is not found.
+    '''
+    if pppaths is None:
+        pppaths = get_pppaths()
+        index = get_potcar_index()
+        if index is not None:
+            filename = index['potcars'].get(name)
+            if filename is not None and os.path.exists(filename):
+                return filename
+
+    for path in pppaths:
+        filename = os.path.join(path, name)
+        if os.path.isfile(filename) or os.path.islink(filename):
+            return filename
+        elif os.path.isfile(filename + '.Z') or os.path.islink(filename + '.Z'):
+            return filename + '.Z'
+    return None
+
 
 def get_ZVAL(potcar):
     '''
@@ -11,42 +340,17 @@ def get_ZVAL(potcar):
     parse this line:
        POMASS =  106.420; ZVAL   =   10.000    mass and valenz
     '''
-    # First check if it is a .Z type file
-    if potcar.endswith('.Z'):
-        cmdlist = ['zcat', potcar]
-        p = Popen(cmdlist, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        out, err = p.communicate()
-        if out == '' or err != '':
-            raise Exception('Cannot read POTCAR.Z:\n\n{0}'.format(err))
-
-        lines = out.split('\n')
-    
-    else:
-        with open(potcar, 'r') as f:
-            lines = f.readlines()
-        
-    for line in lines:
-        if 'ZVAL' in line:
-            m = re.search('ZVAL   =\s*([0-9]*\.?[0-9]*)', line)
-            return float(m.group(1))
-    return
+    return get_potcar_info(potcar)['ZVAL']
 
 
 def get_ENMAX(potcar):
     ''' Return ENMAX from the potcar file.'''
-    with open(potcar) as f:
-        for line in f:
-            if 'ENMAX' in line:
-                m = re.search('ENMAX\s*=\s*(?P<ENMAX>[0-9]+.[0-9]+);', line)
-                return float(m.groupdict()['ENMAX'])
+    return get_potcar_info(potcar)['ENMAX']
+
 
 def get_ENMIN(potcar):
     ''' Return ENMIN from the potcar file.'''
-    with open(potcar) as f:
-        for line in f:
-            if 'ENMIN' in line:
-                m = re.search('ENMIN\s*=\s*(?P<ENMIN>[0-9]+.[0-9]+)\s+eV', line)
-                return float(m.groupdict()['ENMIN'])
+    return get_potcar_info(potcar)['ENMIN']
 
 
 def get_special_setups(potcar='POTCAR'):
@@ -1,59 +1,44 @@
 #!/usr/bin/env python
 import os
+import sys
 from jasp.jasprc import JASPRC
+from jasp.scheduler import detect_scheduler
 
 # this command works for both serial and MPI
 serial_vasp = JASPRC['vasp.executable.serial']
 parallel_vasp = JASPRC['vasp.executable.parallel']
 
-if 'PBS_NODEFILE' in os.environ:
-    # we are in the queue. determine if we should run serial or parallel
-    NPROCS = len(open(os.environ['PBS_NODEFILE']).readlines())
+scheduler = detect_scheduler()
 
-    if NPROCS == 1:
-        # no question. running in serial.
-        exitcode = os.system(serial_vasp)
-    else:
-        if (JASPRC['queue.nodes'] > 1
-            or (JASPRC['queue.nodes'] == 1 and
-                JASPRC['multiprocessing.cores_per_process'] is 'None')):
-            # vanilla MPI run. multiprocessing does not work on more
-            # than one node, and you must specify in JASPRC to use it
-            
-            parcmd = 'mpirun -np %i %s' % (NPROCS, parallel_vasp)
-            
-            exitcode = os.system(parcmd)
-        else:
-            # we need to run an MPI job on cores_per_process
-            if JASPRC['multiprocessing.cores_per_process'] == 1:                
-                exitcode = os.system(serial_vasp)
-            elif JASPRC['multiprocessing.cores_per_process'] > 1:
-                NPROCS = JASPRC['multiprocessing.cores_per_process']
-                
-                parcmd = 'mpirun -np %i %s' % (NPROCS, parallel_vasp)
-                exitcode = os.system(parcmd)
+if 'JASP_FARM_HOSTS' in os.environ:
+    # a task of a task farm runs on the hosts the farm gave it
+    from jasp.taskfarm import get_task_command
+    hostfile = os.environ['JASP_FARM_HOSTS']
+    with open(hostfile) as f:
+        slots = f.read().split()
+    exitcode = os.system(get_task_command(slots, hostfile))
 
-elif 'PE_HOSTFILE' in os.environ:
+elif scheduler is not None and scheduler.get_nodes():
     # we are in the queue. determine if we should run serial or parallel
-    # NPROCS = len(open(os.environ['PBS_NODEFILE']).readlines())
-    NPROCS = int(os.environ['NSLOTS'])
-    NODES = int(os.environ['NHOSTS'])
+    nodes = scheduler.get_nodes()
+    NPROCS = len(nodes)
+    NODES = len(set(nodes))
 
     if NPROCS == 1:
-        # no question. running in serial.        
+        # no question. running in serial.
         exitcode = os.system(serial_vasp)
     else:
         if (NODES > 1
             or (NODES == 1 and
                 JASPRC['multiprocessing.cores_per_process'] == 'None')):
             # vanilla MPI run. multiprocessing does not work on more
-            # than one node, and you must specify in JASPRC to use it        
+            # than one node, and you must specify in JASPRC to use it
             parcmd = 'mpirun -np %i %s' % (NPROCS, parallel_vasp)
             exitcode = os.system(parcmd)
 
         else:
             # we need to run an MPI job on cores_per_process
-            if JASPRC['multiprocessing.cores_per_process'] == 1:                
+            if JASPRC['multiprocessing.cores_per_process'] == 1:
                 exitcode = os.system(serial_vasp)
             elif JASPRC['multiprocessing.cores_per_process'] > 1:
                 NPROCS = JASPRC['multiprocessing.cores_per_process']
@@ -65,4 +50,24 @@ else:
     # probably running at cmd line, in serial.
     exitcode = os.system(serial_vasp)
 
+# the walltime model learns from every finished calculation
+try:
+    from jasp.walltime import add_walltime_records
+    add_walltime_records(['.'])
+except Exception as e:
+    print 'could not record the walltime: {0}'.format(e)
+
+# fix what went wrong and resubmit, if we know how
+if scheduler is not None and JASPRC['recovery.auto']:
+    from jasp.recovery import recover
+    jobid = None
+    if os.path.exists('jobid'):
+        with open('jobid') as f:
+            jobid = f.readline().strip()
+    recover(jobid)
+
+# the task farm reads the exit code of vasp
+if os.WIFEXITED(exitcode):
+    sys.exit(os.WEXITSTATUS(exitcode))
+sys.exit(1)
 # end
@@ -1,110 +1,274 @@
-'''This module provides a class function decorator to cache the results
+'''This module provides a function decorator to cache the results
 
-for functions. I have found that parsing the files to get energy,
-forces, stresses, etc... is slow when you have to loop through hundreds
-or thousands of files. So, we are going to try caching the results.
+of the functions that read the output files. I have found that parsing
+the files to get energy, forces, stresses, etc... is slow when you have
+to loop through hundreds or thousands of files. So, we cache the
+results.
 
+The cache is stored in each calculation directory, in the .jasp-cache
+directory. Each entry is an npz file whose name is a hash of the
+function name and the inode, size and mtime of OUTCAR and vasprun.xml,
+so an entry is never used after the output files change. Stale entries
+for a function are deleted when a new one is written.
 
-It is not clear this will work as all the reading seems to be done in
-restart_load. If that is true, memoizing these functions will have no
-effect. There needs to be a redesign to only get data when you want it,
-e.g. lazy evaluation.
+Optionally, results are also stored in one SQLite database shared by
+all directories and processes, set by JASPRC['cache.db']. This is
+useful for directories we cannot write to, e.g. on read-only project
+shares. The database is kept below JASPRC['cache.db.size'] bytes by
+deleting the least recently used entries. A hit only writes its access
+time if the stored one is more than JASPRC['cache.db.touch'] seconds
+old, so most reads do not take the write lock of the database.
 
-the key might be caching the read functions
-
-def read_outcar(self):
-# Spin polarized calculation?
-file = open('OUTCAR', 'r')
-lines = file.readlines()
-file.close()
-for line in lines:
-if line.rfind('ISPIN') > -1:
-if int(line.split()[2])==2:
-self.spinpol = True
-else:
-self.spinpol = None
-self.energy_free, self.energy_zero = self.read_energy()
-self.forces = self.read_forces(self.atoms)
-self.dipole = self.read_dipole()
-self.fermi = self.read_fermi()
-self.stress = self.read_stress()
-self.nbands = self.read_nbands()
-self.read_ldau()
-p=self.int_params
-q=self.list_params
-if self.spinpol:
-self.magnetic_moment = self.read_magnetic_moment()
-if p['lorbit']>=10 or (p['lorbit']!=None and q['rwigs']):
-self.magnetic_moments = self.read_magnetic_moments(self.atoms)
-else:
-self.magnetic_moments = None
-self.set(nbands=self.nbands)
-
-read_outcar does not return anything, so it cannot be cached. It sets
-lots of attributes. the get functions return these attributes, they do
-not read the files.
-
-this function itself should have the spin-polarized reading factored out
-so that a read_spinpol function returns
-
-self.spinpol = self.read_spinpol()
-
-then we could cache:
-self.read_spinpol
-self.read_energy
-self.read_forces
-self.read_fermi
-self.read_stress
-self.read_nbands
-self.read_magnetic_moment
-self.read_magnetic_moments
-
-Figure out what to do with self.read_ldau() which seems to set state,
-not return value
-
-which ought to avoid reading outcar again
-
-Alternatively, I could monkey patch the restart_load function, and all
-the get functions.
+The read functions used by read_outcar (read_energy, read_forces,
+read_dipole, read_fermi, read_stress, read_nbands, read_spinpol and the
+magnetic moments) are cached when this module is imported. Set
+JASPRC['cache.results'] = False to turn the cache off.
 '''
 
-
 from functools import wraps
+from hashlib import sha1
+from StringIO import StringIO
+import glob
 import os
-import pickle
+import sqlite3
+import thread
+import time
+import numpy as np
 from jasp import *
 
+import logging
+log = logging.getLogger('Jasp')
 
-def persistent_memoize(func):
-    '''function decorator to provide a persistent cache mechanism for jasp'''
-    if os.path.exists('CACHE'):
-        with open('CACHE') as f:
-            cache = pickle.load(f)
-        else:
-            cache = {}
+CACHE_DIR = '.jasp-cache'
+
+# the files the cached functions read their results from
+CACHE_OUTPUTS = ['OUTCAR', 'vasprun.xml']
+
+
+def output_fingerprint(directory='.'):
+    '''Return a list of (inode, size, mtime) of each file in CACHE_OUTPUTS.
+
+    Files that do not exist are None.
+    '''
+    fingerprint = []
+    for fname in CACHE_OUTPUTS:
+        try:
+            st = os.stat(os.path.join(directory, fname))
+            fingerprint.append((st.st_ino, st.st_size, st.st_mtime))
+        except OSError:
+            fingerprint.append(None)
+    return fingerprint
+
+
+def _cache_file(name, fingerprint, directory='.'):
+    '''Return the path to the cache entry of name for fingerprint.'''
+    key = sha1(repr((name, fingerprint))).hexdigest()
+    return os.path.join(directory, CACHE_DIR,
+                        '{0}-{1}.npz'.format(name, key))
+
+
+def _pack(value):
+    '''Return value as the bytes of an npz file.'''
+    if value is None:
+        data = {'none': True}
+    elif isinstance(value, tuple):
+        data = {'value': np.array(value), 'tuple': True}
+    elif isinstance(value, list):
+        data = {'value': np.array(value), 'list': True}
+    else:
+        data = {'value': np.asarray(value)}
+
+    f = StringIO()
+    np.savez(f, **data)
+    return f.getvalue()
+
+
+def _unpack(packed):
+    '''Return the value stored by _pack in the bytes packed.'''
+    data = np.load(StringIO(packed))
+    if 'none' in data.files:
+        return None
+    value = data['value']
+    if 'tuple' in data.files:
+        return tuple(value.tolist())
+    elif 'list' in data.files:
+        return value.tolist()
+    elif value.ndim == 0:
+        return value.item()
+    return value
+
+
+def read_cache(name, fingerprint, directory='.'):
+    '''Return (True, value) of the cache entry, or (False, None).'''
+    path = _cache_file(name, fingerprint, directory)
+    try:
+        with open(path, 'rb') as f:
+            return True, _unpack(f.read())
+    except (IOError, OSError, ValueError, KeyError):
+        return False, None
+
+
+def write_cache(name, fingerprint, value, directory='.'):
+    '''Store value as the cache entry of name for fingerprint.
+
+    Entries of name for other fingerprints are deleted. If the
+    directory is not writable nothing is stored.
+    '''
+    path = _cache_file(name, fingerprint, directory)
+    cachedir = os.path.dirname(path)
+
+    tmpfile = '{0}.{1}.{2}'.format(path, os.getpid(), thread.get_ident())
+    try:
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+
+        for stale in glob.glob(os.path.join(cachedir,
+                                            '{0}-*.npz'.format(name))):
+            os.unlink(stale)
+
+        with open(tmpfile, 'wb') as f:
+            f.write(_pack(value))
+        os.rename(tmpfile, path)
+    except (IOError, OSError):
+        if os.path.exists(tmpfile):
+            os.unlink(tmpfile)
+
+
+# (pid, thread, path): connection to the cache database. sqlite
+# connections must not be shared with forked processes or threads.
+_cache_db_connections = {}
+
+
+def get_cache_db():
+    '''Return a connection to the database in JASPRC['cache.db'].
+
+    Returns None if no database is configured.
+    '''
+    path = JASPRC.get('cache.db', 'None')
+    if path in [None, 'None']:
+        return None
+    path = os.path.expanduser(path)
+
+    key = (os.getpid(), thread.get_ident(), path)
+    if key not in _cache_db_connections:
+        timeout = float(JASPRC.get('cache.db.timeout', 30))
+        con = sqlite3.connect(path, timeout=timeout)
+        # WAL lets many processes read while one writes
+        con.execute('PRAGMA journal_mode=WAL')
+        con.execute('PRAGMA busy_timeout={0:d}'.format(int(timeout * 1000)))
+        con.execute('''CREATE TABLE IF NOT EXISTS results
+                       (vaspdir TEXT,
+                        name TEXT,
+                        fingerprint TEXT,
+                        value BLOB,
+                        size INTEGER,
+                        accessed REAL,
+                        PRIMARY KEY (vaspdir, name))''')
+        con.execute('''CREATE INDEX IF NOT EXISTS results_accessed
+                       ON results (accessed)''')
+        con.commit()
+        _cache_db_connections[key] = con
+    return _cache_db_connections[key]
+
+
+def read_cache_db(name, fingerprint, directory='.'):
+    '''Return (True, value) of the database entry, or (False, None).'''
+    try:
+        con = get_cache_db()
+        if con is None:
+            return False, None
+        vaspdir = os.path.abspath(directory)
+        row = con.execute('''SELECT value, accessed FROM results
+                             WHERE vaspdir = ? AND name = ?
+                             AND fingerprint = ?''',
+                          (vaspdir, name, repr(fingerprint))).fetchone()
+        con.commit()  # ends the read transaction
+        if row is None:
+            return False, None
+        now = time.time()
+        if now - row[1] > float(JASPRC.get('cache.db.touch', 3600)):
+            with con:
+                con.execute('''UPDATE results SET accessed = ?
+                               WHERE vaspdir = ? AND name = ?''',
+                            (now, vaspdir, name))
+        return True, _unpack(str(row[0]))
+    except (sqlite3.Error, ValueError, KeyError), e:
+        log.debug('cache database read failed: {0}'.format(e))
+        return False, None
+
+
+def write_cache_db(name, fingerprint, value, directory='.'):
+    '''Store value in the database and evict old entries if needed.
+
+    The least recently used entries are deleted until the total size
+    of the values is below JASPRC['cache.db.size'] bytes.
+    '''
+    try:
+        con = get_cache_db()
+        if con is None:
+            return
+        packed = _pack(value)
+        budget = int(float(JASPRC.get('cache.db.size', 1e9)))
+        with con:
+            con.execute('''INSERT OR REPLACE INTO results
+                           VALUES (?, ?, ?, ?, ?, ?)''',
+                        (os.path.abspath(directory), name,
+                         repr(fingerprint), sqlite3.Binary(packed),
+                         len(packed), time.time()))
+
+            total = con.execute('SELECT SUM(size) FROM results').fetchone()[0]
+            if total > budget:
+                rows = con.execute('''SELECT rowid, size FROM results
+                                      ORDER BY accessed''')
+                evict = []
+                for rowid, size in rows:
+                    if total <= budget:
+                        break
+                    evict.append((rowid,))
+                    total -= size
+                con.executemany('DELETE FROM results WHERE rowid = ?',
+                                evict)
+    except sqlite3.Error, e:
+        log.debug('cache database write failed: {0}'.format(e))
+
+
+def directory_cache(func):
+    '''function decorator to cache the results of func in the vasp directory.
+
+    func should be a method of the calculator that reads its result
+    from the output files in calc.directory. Positional
+    arguments are not part of the key, since they are only used to
+    know the number of atoms. Calls with keyword arguments, e.g.
+    read_forces(all=True), are not cached.
+    '''
+    name = func.__name__
 
     @wraps(func)
-    def wrapper(*args, **kwargs):
-        # dictionaries are not hashable, so we use the pickle string
-        # as the key.
-        key = pickle.dumps((args, kwargs))
-
-        if key not in cache:
-            cache[key] = func(*args, **kwargs)
-            with open('CACHE', 'wb') as f:
-                pickle.dump(cache, f)
-        return cache[key]
-    return wrapper
+    def wrapper(self, *args, **kwargs):
+        if kwargs or not JASPRC.get('cache.results', True):
+            return func(self, *args, **kwargs)
 
+        directory = self.directory
+        fingerprint = output_fingerprint(directory)
+        found, value = read_cache(name, fingerprint, directory)
+        if found:
+            return value
 
-# Vasp.get_potential_energy = persistent_memoize(Vasp.get_potential_energy)
-# Vasp.get_forces = persistent_memoize(Vasp.get_forces)
-# Vasp.get_stress = persistent_memoize(Vasp.get_stress)
+        found, value = read_cache_db(name, fingerprint, directory)
+        if found:
+            write_cache(name, fingerprint, value, directory)
+            return value
+
+        value = func(self, *args, **kwargs)
+        write_cache(name, fingerprint, value, directory)
+        write_cache_db(name, fingerprint, value, directory)
+        return value
+    return wrapper
 
 
 def read_spinpol(self):
     'read OUTCAR and return if calculation was spin-polarized'
-    with open('OUTCAR') as f:
+    with open(os.path.join(self.directory, 'OUTCAR')) as f:
         for line in f:
             if line.rfind('ISPIN') > -1:
                 if int(line.split()[2]) == 2:
@@ -114,17 +278,19 @@ def read_spinpol(self):
     # we must not have found ISPIN
     return None
 
-Vasp.read_spinpol = persistent_memoize(read_spinpol)
-Vasp.read_energy = persistent_memoize(Vasp.read_energy)
-Vasp.read_forces = persistent_memoize(Vasp.read_forces)
-Vasp.read_dipole = persistent_memoize(Vasp.read_dipole)
-Vasp.read_fermi = persistent_memoize(Vasp.read_fermi)
-Vasp.read_stress = persistent_memoize(Vasp.read_stress)
-Vasp.read_nbands = persistent_memoize(Vasp.read_nbands)
+Vasp.read_spinpol = directory_cache(read_spinpol)
+Vasp.read_energy = directory_cache(Vasp.read_energy)
+Vasp.read_forces = directory_cache(Vasp.read_forces)
+Vasp.read_dipole = directory_cache(Vasp.read_dipole)
+Vasp.read_fermi = directory_cache(Vasp.read_fermi)
+Vasp.read_stress = directory_cache(Vasp.read_stress)
+Vasp.read_nbands = directory_cache(Vasp.read_nbands)
+Vasp.read_magnetic_moment = directory_cache(Vasp.read_magnetic_moment)
+Vasp.read_magnetic_moments = directory_cache(Vasp.read_magnetic_moments)
 
 
 def read_outcar(self):
-    'monkey-patched version for jasp so that memoized functions can be used.'
+    'monkey-patched version for jasp so that cached functions can be used.'
     # Spin polarized calculation?
     self.spinpol = self.read_spinpol()
     self.energy_free, self.energy_zero = self.read_energy()
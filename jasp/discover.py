@@ -0,0 +1,154 @@
+'''Find calculation directories in a tree quickly.
+
+isavaspdir made four os.path.exists calls per directory and read the
+INCAR of NEB directories, and jasp.py -r, get_jasp_dirs and the web
+indexes each walked the tree with os.walk one directory at a time. On
+NFS every one of those calls is a round trip to the server.
+
+Here each directory is listed once, with scandir when it is installed
+(python 3.5 has it in os, pip install scandir on python 2), and
+classified from the names in the listing. Directories are listed in a
+pool of threads (JASPRC['discover.threads']), so many round trips are
+in flight at once, and calculation directories are yielded as soon as
+they are found.
+
+>>> for path in iter_calculation_dirs('~/projects'):
+...     print path
+
+Directories starting with . are not entered, and symlinks to
+directories are not followed, like os.walk.
+'''
+
+import os
+import Queue
+from multiprocessing.pool import ThreadPool
+from jasprc import JASPRC
+from outcar import read_outcar_tail
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+import logging
+log = logging.getLogger('Jasp')
+
+VASP_FILES = ['POSCAR', 'INCAR', 'KPOINTS', 'POTCAR']
+NEB_FILES = ['INCAR', 'KPOINTS', 'POTCAR']
+
+
+def list_directory(path):
+    '''Return (names, subdirectories) of path from one listing.
+
+    Returns empty lists if path cannot be read.
+    '''
+    names, subdirs = [], []
+    try:
+        if scandir is not None:
+            for entry in scandir(path):
+                names.append(entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+        else:
+            for name in os.listdir(path):
+                names.append(name)
+                full = os.path.join(path, name)
+                if os.path.isdir(full) and not os.path.islink(full):
+                    subdirs.append(name)
+    except OSError as e:
+        log.debug('cannot list {0}: {1}'.format(path, e))
+    return names, subdirs
+
+
+def classify_listing(path, names):
+    '''Return 'vasp', 'neb' or None for a directory with the set names.
+
+    An NEB directory has no POSCAR, but has the image directories 00
+    and 01.
+    '''
+    if all(f in names for f in VASP_FILES):
+        return 'vasp'
+    elif (all(f in names for f in NEB_FILES)
+          and '00' in names and '01' in names):
+        return 'neb'
+    return None
+
+
+def outcar_finished(path):
+    '''Return True if the OUTCAR in path has the timing banner at its end.'''
+    outcar = os.path.join(path, 'OUTCAR')
+    if not os.path.exists(outcar):
+        return False
+    return any('General timing and accounting informations for this job:'
+               in line for line in read_outcar_tail(30, outcar))
+
+
+def parallel_walk(roots, visit, threads=None):
+    '''Yield (path, result) for the directories under roots, in threads.
+
+    visit(path) returns (result, subdirectories), and is called in a
+    pool of threads for each directory, starting with roots. Only the
+    subdirectories it returns are visited, except the ones starting
+    with a dot. Paths are absolute, and come in the order they are
+    visited.
+    '''
+    if isinstance(roots, basestring):
+        roots = [roots]
+    if threads is None:
+        threads = int(JASPRC.get('discover.threads', 16))
+
+    results = Queue.Queue()
+
+    def _visit(path):
+        try:
+            result, subdirs = visit(path)
+            results.put((path, result, subdirs, None))
+        except Exception as e:
+            results.put((path, None, [], e))
+
+    pool = ThreadPool(max(1, threads))
+    try:
+        pending = 0
+        for root in roots:
+            root = os.path.abspath(os.path.expanduser(root))
+            pool.apply_async(_visit, (root,))
+            pending += 1
+
+        while pending:
+            path, result, subdirs, error = results.get()
+            pending -= 1
+            if error is not None:
+                raise error
+            for d in subdirs:
+                if not d.startswith('.'):
+                    pool.apply_async(_visit, (os.path.join(path, d),))
+                    pending += 1
+            yield path, result
+    finally:
+        # also when the caller stops early
+        pool.terminate()
+
+
+def iter_calculation_dirs(roots, threads=None, classify=classify_listing,
+                          finished=False):
+    '''Yield the calculation directories under roots as they are found.
+
+    roots is a directory or a list of them, and they are included.
+    classify(path, names) decides if path is a calculation from the set
+    of names in it. With finished only calculations with a finished
+    OUTCAR are yielded. The order is not that of os.walk. Paths are
+    absolute.
+    '''
+    def visit(path):
+        names, subdirs = list_directory(path)
+        found = classify(path, set(names))
+        if found and finished:
+            found = outcar_finished(path)
+        return found, subdirs
+
+    for path, found in parallel_walk(roots, visit, threads):
+        if found:
+            yield path
@@ -21,14 +21,11 @@ def get_elastic_moduli(self):
     '''
     self.calculate()
 
-    with open('OUTCAR') as f:
-        lines = f.readlines()
-
     TEM = []
-    for i, line in enumerate(lines):
-        if line.startswith(' TOTAL ELASTIC MODULI (kBar)'):
-            j = i + 3
-            data = lines[j:j+6]
+    for offset in get_outcar_offsets('elastic_moduli'):
+        lines = read_outcar_lines(offset, 9)
+        if lines[0].startswith(' TOTAL ELASTIC MODULI (kBar)'):
+            data = lines[3:9]
             break
 
     for line in data:
@@ -20,6 +20,18 @@ from ase.calculators.vasp import *
 
 # internal imports
 from jasprc import *          # configuration data
+from workdir import *         # calculators read in threads
+from outcar import *          # section index of OUTCAR
+from scheduler import *       # scheduler backends and queue status
+from taskfarm import *        # many calculations in one job
+from jasp_status import *     # state of many directories at once
+from workflow import *        # graphs of dependent calculations
+from memory import *          # memory estimates
+from walltime import *        # walltime predictions
+from parallel import *        # KPAR, NCORE and NSIM for the cores
+from recovery import *        # fixes for failed calculations
+from discover import *        # finding calculation directories
+from jasp_index import *      # persistent index of calculations
 
 # jasp metadata, including atoms tags and  constraints
 from metadata import *
@@ -33,7 +45,9 @@ from jasp_atoms import *      # some extensions to ase.Atoms for jasp
 from jasp_exceptions import *  # exception definitions
 from jasp_kpts import *       # extended read/write KPOINTS
 from jasp_extensions import *  # extensions to vasp.py
+from jasp_restart import *    # lazy restart of finished calculations
 from read_vasprun import *    # monkey patched functions to get data from xml
+from cache import *           # per-directory cache of read results
 from POTCAR import *          # code to read POTCAR
 from volumetric_data import *  # CHG and LOCPOT parsing
 
@@ -56,8 +70,8 @@ log.addHandler(handler)
 
 # * Utility functions
 # ** Calculation is ok
-def calculation_is_ok(jobid=None):
-    '''Returns bool if calculation appears ok.
+def calculation_is_ok(jobid=None, directory='.'):
+    '''Returns bool if calculation in directory appears ok.
 
     That means:
     1. There is a CONTCAR with contents
@@ -65,11 +79,12 @@ def calculation_is_ok(jobid=None):
     '''
     # find job output file
     output = ['\n']
-    output += ['Vasp calculation from \n {0}\n'.format(os.getcwd())]    
+    output += ['Vasp calculation from \n {0}\n'.format(
+        os.path.abspath(directory))]
     if jobid is not None:
-        for f in os.listdir('.'):
+        for f in os.listdir(directory):
             if '.o{0}'.format(jobid) in f:
-                with open(f) as outputfile:
+                with open(os.path.join(directory, f)) as outputfile:
                     output += ['joboutput file: {0}'.format(jobid),
                               '\n' + '=' * 66 + '\n',
                               '{0}:\n'.format(f)]
@@ -77,31 +92,32 @@ def calculation_is_ok(jobid=None):
                     output += ['=' * 66,
                                '\n']
 
-    with open('INCAR') as f:
+    with open(os.path.join(directory, 'INCAR')) as f:
         if 'SPRING' in f.read():
             print 'Apparently an NEB calculation. Check it your self.'
             return True
 
-    with open('CONTCAR') as f:
+    with open(os.path.join(directory, 'CONTCAR')) as f:
         content = f.read()
 
     if not len(content) > 0:
-        os.unlink('CONTCAR')
-        if os.path.exists('jobid'):
-            os.unlink('jobid')
+        os.unlink(os.path.join(directory, 'CONTCAR'))
+        if os.path.exists(os.path.join(directory, 'jobid')):
+            os.unlink(os.path.join(directory, 'jobid'))
         raise VaspNotFinished('CONTCAR appears empty. It has been '
                               'deleted. Please run your script again')
 
-    with open('OUTCAR') as f:
-        lines = f.readlines()
+    # only the end of the OUTCAR matters here
+    lines = read_outcar_tail(20, os.path.join(directory, 'OUTCAR'))
 
-    if 'Voluntary context switches' not in lines[-1]:
+    if not lines or 'Voluntary context switches' not in lines[-1]:
         try:
             if 'ZBRENT: fatal error in bracketing' in output[-5]:
-                message = ['Zbrent Error in: \n {0} \n'.format(os.getcwd()),
+                message = ['Zbrent Error in: \n {0} \n'.format(
+                               os.path.abspath(directory)),
                            'OUTCAR has been deleted.\n', 
                            'Please run your script again to restart from CONTCAR']
-                os.unlink('OUTCAR')
+                os.unlink(os.path.join(directory, 'OUTCAR'))
                 raise VaspZbrentError(''.join(message))
         except IndexError:
             pass            
@@ -150,12 +166,47 @@ read. we only care if the number or types of atoms changed.
                                                          a2.get_chemical_symbols()))
 
 
+# ** State of a directory
+def jasp_state(files, directory='.'):
+    '''Return the state of directory for Jasp.
+
+    files is the directory_snapshot of the directory. The queue is only
+    asked if there is a jobid file. The states are
+
+    empty        no INCAR
+    initialized  input files, but no job has been run
+    queued       the job is in the queue, or running
+    stopped      the job left a CONTCAR but no OUTCAR. It is restarted
+                 from the CONTCAR
+    finished     the job is done, and this is the first time we look at it
+    done         the job was done long ago, and the jobid is deleted
+    unknown      none of these
+    '''
+    if 'INCAR' not in files:
+        return 'empty'
+    elif 'jobid' not in files and 'CONTCAR' not in files:
+        return 'initialized'
+    elif 'jobid' in files:
+        with open(os.path.join(directory, 'jobid')) as f:
+            jobid = f.readline().strip()
+        # SGE does not have jobstate == 'C'
+        if get_job_state(jobid) not in [None, 'C']:
+            return 'queued'
+        elif 'OUTCAR' not in files and 'CONTCAR' in files:
+            return 'stopped'
+        return 'finished'
+    elif all(f in files for f in ['CONTCAR', 'OUTCAR', 'vasprun.xml']):
+        return 'done'
+    return 'unknown'
+
+
 def Jasp(debug=None,
          restart=None,
          output_template='vasp',
          track_output=False,
          atoms=None,
          supress_err=False,
+         directory='.',
          **kwargs):
     '''wrapper function to create a Vasp calculator. The only purpose
     of this function is to enable atoms as a keyword argument, and to
@@ -168,37 +219,43 @@ def Jasp(debug=None,
 
     **kwargs is the same as ase.calculators.vasp.
 
-    you must be in the directory where vasp will be run.
+    directory is where vasp will be run. All the files are read and
+    written there, so Jasp can be used in threads, see workdir.py.
 
     '''
 
     if debug is not None:
         log.setLevel(debug)
 
-    log.debug('Jasp called in %s', os.getcwd())
+    directory = os.path.abspath(directory)
+    log.debug('Jasp called in %s', directory)
     log.debug('kwargs = %s', kwargs)
+
+    # one listing of the directory, instead of checking each file
+    files = directory_snapshot(directory)
+    state = None if 'spring' in kwargs else jasp_state(files, directory)
+    log.debug('state = %s', state)
+
     # special initialization NEB case
     if 'spring' in kwargs:
         log.debug('Entering NEB setup')
         try:
-            calc = read_neb_calculator()
+            calc = read_neb_calculator(directory)
             calc.set(**kwargs)
         except:
             calc = neb_initialize(atoms, kwargs)
 # ** Empty directory starting from scratch
     # empty vasp dir. start from scratch
-    elif (not os.path.exists('INCAR')):
+    elif state == 'empty':
         calc = Vasp(restart, output_template, track_output)
+        calc.directory = directory
 
         if atoms is not None:
             atoms.calc = calc
         log.debug('empty vasp dir. start from scratch')
 
 # ** initialized directory, but no job has been run
-    elif (not os.path.exists('jobid')
-          and os.path.exists('INCAR')
-          # but no output files
-          and not os.path.exists('CONTCAR')):
+    elif state == 'initialized':
         log.debug('initialized directory, but no job has been run')
 
         # this is kind of a weird case. There are input files, but
@@ -208,12 +265,13 @@ def Jasp(debug=None,
         # e.g. no CONTCAR exists, then we cannot restart the
         # calculation. we have to build it up.
         calc = Vasp(restart, output_template, track_output)
+        calc.directory = directory
 
         # Try to read sorting file
-        if os.path.isfile('ase-sort.dat'):
+        if 'ase-sort.dat' in files:
             calc.sort = []
             calc.resort = []
-            file = open('ase-sort.dat', 'r')
+            file = open(os.path.join(directory, 'ase-sort.dat'), 'r')
             lines = file.readlines()
             file.close()
             for line in lines:
@@ -223,7 +281,7 @@ def Jasp(debug=None,
         calc.read_incar()
         calc.read_potcar()  # sets xc
         if calc.int_params.get('images', None) is not None:
-            calc = read_neb_calculator()
+            calc = read_neb_calculator(directory)
 
         try:
             calc.read_kpoints()
@@ -234,7 +292,8 @@ def Jasp(debug=None,
         if atoms is not None:
             import ase.io
             try:
-                atoms0 = ase.io.read('POSCAR', format='vasp')[calc.resort]
+                atoms0 = ase.io.read(os.path.join(directory, 'POSCAR'),
+                                     format='vasp')[calc.resort]
                 compatible_atoms_p(atoms0, atoms)
                 atoms.calc = calc
             except IOError:
@@ -243,15 +302,14 @@ def Jasp(debug=None,
         else:
             import ase.io
             try:
-                atoms = ase.io.read('POSCAR')
+                atoms = ase.io.read(os.path.join(directory, 'POSCAR'))
                 atoms.set_calculator(calc)
             except IOError:
                 # no POSCAR found
                 pass
 
 # ** job created, and in queue, but not running
-    elif (os.path.exists('jobid')
-          and job_in_queue(None)):
+    elif state == 'queued':
         '''this case is slightly tricky because you cannot restart if
         there is no contcar or outcar. here is a modified version of
         the restart_load function that avoids this problem.
@@ -259,28 +317,31 @@ def Jasp(debug=None,
         log.debug('job created, and in queue, but not running. tricky case')
 
         self = Vasp(restart, output_template, track_output)
+        self.directory = directory
 
         self.read_incar()
 
         if self.int_params.get('images', None) is not None:
-            calc = read_neb_calculator()
+            calc = read_neb_calculator(directory)
         else:
             import ase.io
             # Try to read sorting file
-            if os.path.isfile('ase-sort.dat'):
+            if 'ase-sort.dat' in files:
                 self.sort = []
                 self.resort = []
-                file = open('ase-sort.dat', 'r')
+                file = open(os.path.join(directory, 'ase-sort.dat'), 'r')
                 lines = file.readlines()
                 file.close()
                 for line in lines:
                     data = line.split()
                     self.sort.append(int(data[0]))
                     self.resort.append(int(data[1]))
-                patoms = ase.io.read('POSCAR', format='vasp')[self.resort]
+                patoms = ase.io.read(os.path.join(directory, 'POSCAR'),
+                                     format='vasp')[self.resort]
             else:
-                log.debug('you are in %s', os.getcwd())
-                patoms = ase.io.read('POSCAR', format='vasp')
+                log.debug('you are in %s', directory)
+                patoms = ase.io.read(os.path.join(directory, 'POSCAR'),
+                                     format='vasp')
                 self.sort = range(len(atoms))
                 self.resort = range(len(atoms))
 
@@ -302,17 +363,17 @@ def Jasp(debug=None,
         calc.vasp_queued = True
 
 # ** job created, and in queue, and running
-    elif (os.path.exists('jobid')
-          and job_in_queue(None)):
+    elif state == 'queued':
         log.debug('job created, and in queue, and running')
         calc = Vasp(restart, output_template, track_output)
+        calc.directory = directory
         calc.read_incar()
         if calc.int_params.get('images', None) is not None:
             log.debug('reading neb calculator')
-            calc = read_neb_calculator()
+            calc = read_neb_calculator(directory)
 
         else:
-            calc = Vasp(restart=True)  # automatically loads results
+            calc = restart_calculator(directory)
 
         if atoms is not None:
             compatible_atoms_p(calc.get_atoms(), atoms)
@@ -321,32 +382,34 @@ def Jasp(debug=None,
     # job went through a couple of iteratures, produced an updated CONTCAR
     # but did not finish for whatever reason. We want to restart this
     # calculation but from the CONTCAR
-    elif (os.path.exists('jobid')
-          and not job_in_queue(None)
-          and not os.path.exists('OUTCAR')
-          and os.path.exists('CONTCAR')):
+    elif state == 'stopped':
 
         self = Vasp(restart, output_template, track_output)
+        self.directory = directory
         self.read_incar()
 
         import ase.io
         # Try to read sorting file
-        if os.path.isfile('ase-sort.dat'):
+        if 'ase-sort.dat' in files:
             self.sort = []
             self.resort = []
-            file = open('ase-sort.dat', 'r')
+            file = open(os.path.join(directory, 'ase-sort.dat'), 'r')
             lines = file.readlines()
             file.close()
             for line in lines:
                 data = line.split()
                 self.sort.append(int(data[0]))
                 self.resort.append(int(data[1]))
-            patoms = ase.io.read('POSCAR', format='vasp')[self.resort]
-            new_atoms = ase.io.read('CONTCAR', format='vasp')
+            patoms = ase.io.read(os.path.join(directory, 'POSCAR'),
+                                 format='vasp')[self.resort]
+            new_atoms = ase.io.read(os.path.join(directory, 'CONTCAR'),
+                                    format='vasp')
         else:
-            log.debug('you are in %s', os.getcwd())
-            patoms = ase.io.read('POSCAR', format='vasp')
-            new_atoms = ase.io.read('CONTCAR', format='vasp')
+            log.debug('you are in %s', directory)
+            patoms = ase.io.read(os.path.join(directory, 'POSCAR'),
+                                 format='vasp')
+            new_atoms = ase.io.read(os.path.join(directory, 'CONTCAR'),
+                                    format='vasp')
             self.sort = range(len(atoms))
             self.resort = range(len(atoms))
 
@@ -372,29 +435,29 @@ def Jasp(debug=None,
         calc = self
         
 # ** job is created, not in queue, not running. finished and first time we are looking at it
-    elif (os.path.exists('jobid')
-          and not job_in_queue(None)):
+    elif state == 'finished':
         log.debug('job is created, not in queue, not running.'
                   'finished and first time we are looking at it')
 
-        with open('jobid') as f:
+        with open(os.path.join(directory, 'jobid')) as f:
             jobid = f.readline().split('.')[0]
 
-        if calculation_is_ok(jobid):
+        if calculation_is_ok(jobid, directory):
             pass
 
         # delete the jobid file, since it is done
-        os.unlink('jobid')
+        os.unlink(os.path.join(directory, 'jobid'))
 
         calc = Vasp(restart, output_template, track_output)
+        calc.directory = directory
         calc.read_incar()
 
         if calc.int_params.get('images', None) is not None:
             log.debug('reading neb calculator')
-            calc = read_neb_calculator()
+            calc = read_neb_calculator(directory)
         else:
             try:
-                calc = Vasp(restart=True)  # automatically loads results
+                calc = restart_calculator(directory)
             finally:
                 pass
                 
@@ -413,15 +476,12 @@ def Jasp(debug=None,
                 hook(calc)
 
 # ** job done long ago, jobid deleted, not running, and the output files all exist
-    elif (not os.path.exists('jobid')
-          and os.path.exists('CONTCAR')
-          and os.path.exists('OUTCAR')
-          and os.path.exists('vasprun.xml')):
+    elif state == 'done':
         log.debug('job was at least started, jobid deleted,'
                   'no running, and the output files all exist')
-        if calculation_is_ok():
+        if calculation_is_ok(directory=directory):
             log.debug('calculation seems ok.')
-            calc = Vasp(restart=True)
+            calc = restart_calculator(directory)
 
             calc.read_incar()
             log.debug('list params = {}', calc.list_params)
@@ -433,10 +493,13 @@ def Jasp(debug=None,
             atoms.calc = calc
     else:
         raise VaspUnknownState('I do not recognize the state of this'
-                               'directory {0}'.format(os.getcwd()))
+                               'directory {0}'.format(directory))
+
+    # absolute, so it does not depend on the working directory
+    calc.directory = directory
 
 # ** Done with special cases
-    if os.path.exists('METADATA'):
+    if 'METADATA' in files:
         calc.read_metadata()
 
     # save initial params to check for changes later
@@ -453,9 +516,10 @@ def Jasp(debug=None,
     log.debug('String_params = {}', calc.string_params)
     calc.kwargs = kwargs
     calc.set(**kwargs)
+    apply_recovery_overrides(calc, kwargs, directory)
 
     # create a METADATA file if it does not exist and we are not an NEB.
-    if ((not os.path.exists('METADATA'))
+    if (('METADATA' not in files)
          and calc.int_params.get('images', None) is None):
          calc.create_metadata()
 
@@ -468,8 +532,9 @@ def Jasp(debug=None,
 # ** check for luse_vdw, and make link to the required kernel if
     # using vdw.
     if calc.bool_params.get('luse_vdw', False):
-        if not os.path.exists('vdw_kernel.bindat'):
-            os.symlink(JASPRC['vdw_kernel.bindat'], 'vdw_kernel.bindat')
+        if 'vdw_kernel.bindat' not in files:
+            os.symlink(JASPRC['vdw_kernel.bindat'],
+                       os.path.join(directory, 'vdw_kernel.bindat'))
 
     return calc
 
@@ -510,6 +575,9 @@ class jasp:
 
     On entering, automatically change to working vasp directory, and
     on exit, automatically change back to original working directory.
+    In a thread other than the main thread the directory is not
+    changed, because it belongs to the whole process. Use
+    calc.directory there, see workdir.py.
 
     Note: You do not want to raise exceptions here! it makes code
     using this really hard to write because you have to catch
@@ -525,6 +593,8 @@ class jasp:
 
         self.cwd = os.getcwd()  # directory we were in when jasp created
         self.vaspdir = os.path.expanduser(vaspdir)
+        # os.path.join keeps an absolute vaspdir
+        self.directory = os.path.join(self.cwd, self.vaspdir)
 
         self.kwargs = kwargs  # this does not include the vaspdir variable
         self.supress_err = supress_err
@@ -549,15 +619,16 @@ class jasp:
                 do something.
         '''
         # make directory if it doesn't already exist
-        if not os.path.isdir(self.vaspdir):
-            os.makedirs(self.vaspdir)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
 
         # now change to new working dir
-        os.chdir(self.vaspdir)
+        if in_main_thread():
+            os.chdir(self.directory)
 
         # and get the new calculator
         try:
-            calc = Jasp(**self.kwargs)
+            calc = Jasp(directory=self.directory, **self.kwargs)
             calc.vaspdir = self.vaspdir   # vasp directory
             calc.cwd = self.cwd   # directory we came from
             return calc
@@ -569,7 +640,8 @@ class jasp:
         '''
         on exit, change back to the original directory.
         '''
-        os.chdir(self.cwd)
+        if in_main_thread():
+            os.chdir(self.cwd)
         return False  # allows exception to propagate out
 
     
@@ -578,27 +650,10 @@ def isavaspdir(path):
 
     A VASP dir has the vasp files in it. This function is typically used
     when walking a filesystem to identify directories that contain
-    calculation results.
+    calculation results. See iter_calculation_dirs to walk a tree.
     '''
-    # standard vaspdir
-    if (os.path.exists(os.path.join(path, 'POSCAR')) and
-        os.path.exists(os.path.join(path, 'INCAR')) and
-        os.path.exists(os.path.join(path, 'KPOINTS')) and
-        os.path.exists(os.path.join(path, 'POTCAR'))):
-        return True
-    # NEB vaspdir
-    elif (os.path.exists(os.path.join(path, 'INCAR')) and
-          os.path.exists(os.path.join(path, 'KPOINTS')) and
-          os.path.exists(os.path.join(path, 'POTCAR'))):
-
-        incar = open(os.path.join(path, 'INCAR')).read()
-        if 'IMAGES' in incar:
-            return True
-        else:
-            return False
-
-    else:
-        return False
+    names, subdirs = list_directory(path)
+    return classify_listing(path, set(names)) is not None
 
 if __name__ == '__main__':
     ''' make the module a script!
@@ -636,12 +691,11 @@ if __name__ == '__main__':
                         pass
         else:
             # recurse through each arg
-            for (path, dirs, files) in os.walk(arg):
-                if isavaspdir(path):
-                    with jasp(path) as calc:
-                        try:
-                            print '{0:40s} {1}'.format(path[-40:],
-                                                       calc.calculate())
-                        except (VaspSubmitted, VaspQueued), e:
-                            print e
-                            pass
+            for path in iter_calculation_dirs(arg):
+                with jasp(path) as calc:
+                    try:
+                        print '{0:40s} {1}'.format(path[-40:],
+                                                   calc.calculate())
+                    except (VaspSubmitted, VaspQueued), e:
+                        print e
+                        pass
@@ -6,6 +6,32 @@ import matplotlib.pyplot as plt
 from ase.dft import DOS
 
 
+def get_bandstructure_workflow(self,
+                               kpts_path=None,
+                               kpts_nintersections=10):
+    """Return the Workflow of the band structure calculations.
+
+    This calculation is the scf step. The bands step is a non-self
+    consistent calculation in the bandstructure directory that starts
+    from its CHGCAR when it is finished.
+    """
+    cwd = self.directory
+    wf = Workflow(os.path.join(cwd, 'bandstructure.workflow'))
+    wf.add_calculation('scf', self)
+    wf.add('bands', os.path.join(cwd, 'bandstructure'),
+           parents=['scf'], clone_from='scf',
+           kpts=[k[1] for k in kpts_path],
+           kpts_nintersections=kpts_nintersections,
+           reciprocal=True,
+           nsw=0,  # no ionic updates required
+           isif=None,
+           ibrion=None,
+           icharg=11)
+    return wf
+
+Vasp.get_bandstructure_workflow = get_bandstructure_workflow
+
+
 def get_bandstructure(self,
                       kpts_path=None,
                       kpts_nintersections=10):
@@ -33,37 +59,31 @@ def get_bandstructure(self,
 
     returns (npoints, band_energies, fighandle)
 
+    The self-consistent calculation and the non-selfconsistent one in
+    the bandstructure directory are submitted together as a workflow,
+    see get_bandstructure_workflow. Until both are finished this raises
+    VaspRunning.
     """
 
     kpts = [k[1] for k in kpts_path]
     labels = [k[0] for k in kpts_path]
 
+    wf = self.get_bandstructure_workflow(kpts_path, kpts_nintersections)
+    if not wf.done():
+        wf.submit()
+        log.info('The band structure calculations are running')
+        raise VaspRunning
+
     dos = DOS(self, width=0.2)
     d = dos.get_dos()
     e = dos.get_energies()
 
     ef = self.get_fermi_level()
 
-    # run in non-selfconsistent directory
-    cwd = os.getcwd()
-    base, end = os.path.split(cwd)
-    wd = cwd + '/bandstructure'
-    self.clone(wd)
-
-    with jasp(wd,
-              kpts=kpts,
-              kpts_nintersections=kpts_nintersections,
-              reciprocal=True,
-              nsw=0,  # no ionic updates required
-              isif=None,
-              ibrion=None,
-              debug=logging.DEBUG,
-              icharg=11) as calc:
-
-        calc.calculate()
+    with jasp(wf.steps['bands'].directory) as calc:
 
         fig = plt.figure()
-        with open('EIGENVAL') as f:
+        with open(os.path.join(calc.directory, 'EIGENVAL')) as f:
             line1 = f.readline()
             line2 = f.readline()
             line3 = f.readline()
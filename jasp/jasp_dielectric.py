@@ -15,15 +15,13 @@ def get_born_charges(self, return_tensor=False):
     self.calculate()
     numAtoms = len(self.get_atoms())
 
-    with open('OUTCAR') as f:
-        lines = f.readlines()
-
     data = []
     tensors = []
     scalars = []
-    for i, line in enumerate(lines):
-        if line.startswith(' BORN EFFECTIVE CHARGES (including'):
-            j = i + 2
+    for offset in get_outcar_offsets('born_charges'):
+        lines = read_outcar_lines(offset, 3 + 4 * numAtoms)
+        if lines[0].startswith(' BORN EFFECTIVE CHARGES (including'):
+            j = 2
             for ion in range(0, numAtoms):
                 data.append(lines[j+1:j+4])
                 j += 4
@@ -57,14 +55,11 @@ def get_dielectric_tensor(self):
     '''
     self.calculate()
 
-    with open('OUTCAR') as f:
-        lines = f.readlines()
-
     tensor = []
-    for i, line in enumerate(lines):
-        if line.startswith(' MACROSCOPIC STATIC DIELECTRIC TENSOR (including'):
-            j = i + 2
-            data = lines[j:j+3]
+    for offset in get_outcar_offsets('dielectric_tensor'):
+        lines = read_outcar_lines(offset, 5)
+        if lines[0].startswith(' MACROSCOPIC STATIC DIELECTRIC TENSOR (including'):
+            data = lines[2:5]
             break
 
     for line in data:
@@ -90,14 +85,11 @@ def get_piezoelectric_tensor(self, units='C/m2'):
     else:
         raise Exception('Units currently not provided')
 
-    with open('OUTCAR') as f:
-        lines = f.readlines()
-
     tensor = []
-    for i, line in enumerate(lines):
-        if line.startswith(compString):
-            j = i + 3
-            data = lines[j:j+3]
+    for offset in get_outcar_offsets('piezoelectric_tensor'):
+        lines = read_outcar_lines(offset, 6)
+        if lines[0].startswith(compString):
+            data = lines[3:6]
             break
 
     for line in data:
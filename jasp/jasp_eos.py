@@ -8,6 +8,131 @@ from ase.utils.eos import EquationOfState
 import matplotlib.pyplot as plt
 from ase.units import GPa
 
+# volume factors of the calculations in step 1 and 2
+STEP1_FACTORS = [-0.15, -0.07, 0.0, 0.07, 0.15]
+STEP2_FACTORS = [-0.09, -0.06, -0.03, 0.0, 0.03, 0.06, 0.09]
+
+# the equations of state in the statistical analysis of step 2
+EOS = ['sjeos',
+       'taylor',
+       'murnaghan',
+       'birch',
+       'birchmurnaghan',
+       'pouriertarantola',
+       'vinet']
+
+
+def read_volumes_energies(steps):
+    '''Return the volumes and energies of the workflow steps.'''
+    volumes, energies = [], []
+    for step in steps:
+        with jasp(step.directory) as calc:
+            atoms = calc.get_atoms()
+            volumes.append(atoms.get_volume())
+            energies.append(atoms.get_potential_energy())
+    return volumes, energies
+
+
+def fit_eos(volumes, energies):
+    '''Fit all the EOS forms. Returns lists of volumes, energies and
+    bulk moduli in GPa of the ones that could be fitted.'''
+    from ase.units import kJ
+    Vs, Es, Bs = [], [], []
+    for label in EOS:
+        eos = EquationOfState(volumes, energies, eos=label)
+        try:
+            v, e, B = eos.fit()
+            Vs += [v]
+            Es += [e]
+            Bs += [B / kJ * 1.0e24]  # GPa
+        except:
+            with open('error', 'w') as f:
+                f.write('Error fitting the '
+                        'equation of state {0}'.format(label))
+    return Vs, Es, Bs
+
+
+def scale_volume(atoms, parents, factor):
+    '''workflow update: scale the volume of atoms by 1 + factor.'''
+    atoms.set_volume(atoms.get_volume() * (1 + factor))
+
+
+def eos_volume(atoms, parents, factor):
+    '''workflow update: set the volume of atoms to 1 + factor times the
+    minimum of the equation of state of the parents.'''
+    v0, e0, B = EquationOfState(*read_volumes_energies(parents)).fit()
+    atoms.set_volume(v0 * (1 + factor))
+
+
+def eos_average_volume(atoms, parents):
+    '''workflow update: set the volume of atoms to the average minimum
+    of all the EOS forms fitted to the parents.'''
+    Vs, Es, Bs = fit_eos(*read_volumes_energies(parents))
+    atoms.set_volume(np.mean(Vs))
+
+
+def get_eos_workflow(self, static=False):
+    '''Return the Workflow of the equation of state calculations.
+
+    Step 2 is cloned from the lowest energy calculation of step 1, at
+    volumes around the minimum of the step 1 equation of state. The
+    calculations of step 1 and of step 2 are each one job array. Step 3
+    is cloned from the lowest energy calculation of step 2 at the
+    average volume of all the step 2 equations of state.
+    '''
+    cwd = self.directory
+    wf = Workflow(os.path.join(cwd, 'eos.workflow'))
+    wf.add_calculation('initial', self)
+
+    # step 1 - relax ions and shape
+    step1 = []
+    for i, f in enumerate(STEP1_FACTORS):
+        name = 'step-1/f-{0}'.format(i)
+        wf.add(name, os.path.join(cwd, name),
+               parents=['initial'], clone_from='initial',
+               update=scale_volume, update_args={'factor': f},
+               array='step-1',
+               isif=4,
+               ibrion=2,
+               ediffg=-0.05, ediff=1e-6,
+               nsw=50)
+        step1.append(name)
+
+    # step 2 - relax ions and shape with improved minimum estimate
+    step2 = []
+    for i, f in enumerate(STEP2_FACTORS):
+        name = 'step-2/f-{0}'.format(i)
+        wf.add(name, os.path.join(cwd, name),
+               parents=step1, clone_from=lowest_energy,
+               update=eos_volume, update_args={'factor': f},
+               array='step-2',
+               isif=4,
+               ibrion=1,
+               nsw=50)
+        step2.append(name)
+
+    # step 3 - relax volume, shape and internal degrees of freedom
+    wf.add('step-3', os.path.join(cwd, 'step-3'),
+           parents=step2, clone_from=lowest_energy,
+           update=eos_average_volume,
+           isif=3,
+           ibrion=1,
+           prec='high',
+           nsw=50)
+
+    # the final step with ismear=-5 for the accurate energy
+    if static:
+        wf.add('step-4', os.path.join(cwd, 'step-4'),
+               parents=['step-3'], clone_from='step-3',
+               isif=None, ibrion=None, nsw=None,
+               icharg=2,  # do not reuse charge
+               istart=1,
+               prec='high',
+               ismear=-5)
+    return wf
+
+Vasp.get_eos_workflow = get_eos_workflow
+
 
 def get_eos(self, static=False):
     '''calculate the equation of state for the attached atoms.
@@ -18,18 +143,25 @@ def get_eos(self, static=False):
 
     if static is True, then run a final static calculation at high
     precision, with ismear=-5.
+
+    All the steps are submitted at once, see get_eos_workflow. Until
+    they are finished this raises VaspRunning.
     '''
 
+    cwd = self.directory
+
     # this returns if the data exists.
-    if os.path.exists('eos.json'):
-        with open('eos.json') as f:
+    if os.path.exists(os.path.join(cwd, 'eos.json')):
+        with open(os.path.join(cwd, 'eos.json')) as f:
             return json.loads(f.read())
 
-    # we need an initial calculation to get us going.
-    self.calculate()
+    wf = self.get_eos_workflow(static)
+    if not wf.done():
+        wf.submit()
+        log.info('The equation of state calculations are running')
+        raise VaspRunning
 
-    cwd = os.getcwd()
-    data = {'cwd': os.getcwd()}  # dictionary to store results in
+    data = {'cwd': cwd}  # dictionary to store results in
 
     org = []  # list of strings to make the org-file report
     org += ['#+STARTUP: showeverything']
@@ -38,50 +170,27 @@ def get_eos(self, static=False):
     org += ['',
             '[[shell:jaspsum -p {0}][view initial guess]]'.format(cwd)]
 
-    with open('eos.org', 'w') as f:
+    with open(os.path.join(cwd, 'eos.org'), 'w') as f:
         f.write('\n'.join(org))
 
-    atoms = self.get_atoms()
-    original_atoms = atoms.copy()  # save for comparison later.
-    v_init = atoms.get_volume()
-
     # ############################################################
     # ## Step 1
     # ############################################################
     org += ['* step 1 - relax ions and shape']
-    volumes1, energies1 = [], []
-    ready = True
-    factors = [-0.15, -0.07, 0.0, 0.07, 0.15]
-    for i, f in enumerate(factors):
-        wd = cwd + '/step-1/f-{0}'.format(i)
-        self.clone(wd)
-
-        with jasp(wd,
-                  isif=4,
-                  ibrion=2,
-                  ediffg=-0.05, ediff=1e-6,
-                  nsw=50,
-                  atoms=atoms) as calc:
-            try:
-                # add org-link to calculation
-                org += ['[[shell:jaspsum {0}][{0}]]'.format(wd)]
-
-                atoms.set_volume(v_init * (1 + f))
-                volumes1.append(atoms.get_volume())
-                energies1.append(atoms.get_potential_energy())
-                calc.strip()
-
-            except (VaspSubmitted, VaspQueued):
-                ready = False
-
-    if not ready:
-        log.info('Step 1 is still running')
-        raise VaspRunning
+    steps = [wf.steps['step-1/f-{0}'.format(i)]
+             for i in range(len(STEP1_FACTORS))]
+    for step in steps:
+        # add org-link to calculation
+        org += ['[[shell:jaspsum {0}][{0}]]'.format(step.directory)]
+    volumes1, energies1 = read_volumes_energies(steps)
+    for step in steps:
+        with jasp(step.directory) as calc:
+            calc.strip()
 
     data['step1'] = {}
     data['step1']['volumes'] = volumes1
     data['step1']['energies'] = energies1
-    with open('eos.json', 'w') as f:
+    with open(os.path.join(cwd, 'eos.json'), 'w') as f:
         f.write(json.dumps(data))
 
     # create an org-table of the data.
@@ -93,7 +202,7 @@ def get_eos(self, static=False):
         org += ['|{0}|{1}|'.format(v, e)]
     org += ['']
 
-    with open('eos.org', 'w') as f:
+    with open(os.path.join(cwd, 'eos.org'), 'w') as f:
         f.write('\n'.join(org))
 
     eos1 = EquationOfState(volumes1, energies1)
@@ -101,11 +210,11 @@ def get_eos(self, static=False):
     try:
         v1, e1, B1 = eos1.fit()
     except:
-        with open('error', 'w') as f:
+        with open(os.path.join(cwd, 'error'), 'w') as f:
             f.write('Error fitting the equation of state')
 
     data['step1']['eos'] = (v1, e1, B1)
-    with open('eos.json', 'w') as f:
+    with open(os.path.join(cwd, 'eos.json'), 'w') as f:
         f.write(json.dumps(data))
 
     # create a plot
@@ -117,7 +226,7 @@ def get_eos(self, static=False):
               (e1, v1, B1 / GPa))
 
     plt.text(eos1.v0, max(eos1.e), 'EOS: %s' % eos1.eos_string)
-    f.savefig('eos-step1.png')
+    f.savefig(os.path.join(cwd, 'eos-step1.png'))
 
     org += ['[[./eos-step1.png]]',
             '']
@@ -128,49 +237,27 @@ def get_eos(self, static=False):
         log.warn('Your minimum energy is at an endpoint.'
                  'This indicates something is wrong.')
 
-    with open('eos.org', 'w') as f:
+    with open(os.path.join(cwd, 'eos.org'), 'w') as f:
         f.write('\n'.join(org))
     # ########################################################
     # #  STEP 2
     # ########################################################
     # step 2 - isif=4, ibrion=1. now we allow the shape of each cell to
     # change, and we use the best guess from step 1 for minimum volume.
-    ready = True
-    volumes2, energies2 = [], []
-    factors = [-0.09, -0.06, -0.03, 0.0, 0.03, 0.06, 0.09]
-
     org += ['* step 2 - relax ions and shape with improved minimum estimate']
 
-    for i, f in enumerate(factors):
-        wd = cwd + '/step-2/f-{0}'.format(i)
-
-        # clone closest result from above.
-        with jasp('step-1/f-{0}'.format(min_energy_index)) as calc:
-            calc.clone(wd)
-
-        with jasp(wd,
-                  isif=4,
-                  ibrion=1,
-                  nsw=50) as calc:
-            try:
-                atoms = calc.get_atoms()
-                atoms.set_volume(v1 * (1 + f))
-
-                volumes2 += [atoms.get_volume()]
-                energies2 += [atoms.get_potential_energy()]
-                calc.strip()
-            except (VaspSubmitted, VaspQueued):
-                ready = False
-
-    if not ready:
-        log.info('Step 2 is still running')
-        raise VaspRunning
+    steps = [wf.steps['step-2/f-{0}'.format(i)]
+             for i in range(len(STEP2_FACTORS))]
+    volumes2, energies2 = read_volumes_energies(steps)
+    for step in steps:
+        with jasp(step.directory) as calc:
+            calc.strip()
 
     # update org and json files.
     data['step2'] = {}
     data['step2']['volumes'] = volumes2
     data['step2']['energies'] = energies2
-    with open('eos.json', 'w') as f:
+    with open(os.path.join(cwd, 'eos.json'), 'w') as f:
         f.write(json.dumps(data))
 
     # create an org-table of the data.
@@ -182,18 +269,18 @@ def get_eos(self, static=False):
         org += ['|{0}|{1}|'.format(v, e)]
     org += ['']
 
-    with open('eos.org', 'w') as f:
+    with open(os.path.join(cwd, 'eos.org'), 'w') as f:
         f.write('\n'.join(org))
 
     eos2 = EquationOfState(volumes2, energies2)
     try:
         v2, e2, B2 = eos2.fit()
     except:
-        with open('error', 'w') as f:
+        with open(os.path.join(cwd, 'error'), 'w') as f:
             f.write('Error fitting the equation of state')
 
     data['step2']['eos'] = (v2, e2, B2)
-    with open('eos.json', 'w') as f:
+    with open(os.path.join(cwd, 'eos.json'), 'w') as f:
         f.write(json.dumps(data))
 
     f = eos2.plot(show=False)
@@ -204,36 +291,16 @@ def get_eos(self, static=False):
               (e2, v2, B2 / GPa))
 
     plt.text(eos2.v0, max(eos2.e), 'EOS: %s' % eos2.eos_string)
-    f.savefig('eos-step2.png')
+    f.savefig(os.path.join(cwd, 'eos-step2.png'))
 
     org += [
         '[[./eos-step2.png]]',
         '']
-    with open('eos.org', 'w') as f:
+    with open(os.path.join(cwd, 'eos.org'), 'w') as f:
         f.write('\n'.join(org))
 
     # statistical analysis of the equation of state
-    EOS = ['sjeos',
-           'taylor',
-           'murnaghan',
-           'birch',
-           'birchmurnaghan',
-           'pouriertarantola',
-           'vinet']
-
-    from ase.units import kJ
-    Vs, Es, Bs = [], [], []
-    for label in EOS:
-        eos = EquationOfState(volumes2, energies2, eos=label)
-        try:
-            v, e, B = eos.fit()
-            Vs += [v]
-            Es += [e]
-            Bs += [B / kJ * 1.0e24]  # GPa
-        except:
-            with open('error', 'w') as f:
-                f.write('Error fitting the '
-                        'equation of state {0}'.format(label))
+    Vs, Es, Bs = fit_eos(volumes2, energies2)
 
     avgV = np.mean(Vs)
     stdV = np.std(Vs)
@@ -263,10 +330,10 @@ Volume = {avgV:1.3f} \pm {Vconf:1.3f} \AA^3 at the 95% confidence level
 B = {avgB:1.0f} \pm {Bconf:1.0f} GPa at the 95% confidence level
 '''.format(**locals())]
 
-    with open('eos.org', 'w') as f:
+    with open(os.path.join(cwd, 'eos.org'), 'w') as f:
         f.write('\n'.join(org))
 
-    with open('eos.json', 'w') as f:
+    with open(os.path.join(cwd, 'eos.json'), 'w') as f:
         f.write(json.dumps(data))
 
     # step 3 should be isif = 3 where we let the volume change too
@@ -274,19 +341,10 @@ B = {avgB:1.0f} \pm {Bconf:1.0f} GPa at the 95% confidence level
 
     org += ['* step 3 - relax volume']
     emin_ind = np.argmin(energies2)
-    log.info('Minimum energy found in factor={0}.'.format(factors[emin_ind]))
-
-    with jasp('step-2/f-{0}'.format(emin_ind)) as calc:
-        calc.clone('step-3')
+    log.info('Minimum energy found in factor={0}.'.format(
+        STEP2_FACTORS[emin_ind]))
 
-    with jasp('step-3',
-              isif=3,  # vol, shape and internal degrees of freedom
-              ibrion=1,
-              prec='high',
-              nsw=50) as calc:
-        atoms = calc.get_atoms()
-        atoms.set_volume(avgV)
-        calc.calculate()
+    with jasp('step-3') as calc:
         calc.strip()
 
         org += [str(calc)]
@@ -296,25 +354,17 @@ B = {avgB:1.0f} \pm {Bconf:1.0f} GPa at the 95% confidence level
         data['step3']['potential_energy'] = atoms.get_potential_energy()
         data['step3']['volume'] = atoms.get_volume()
 
-    with open('eos.org', 'w') as f:
+    with open(os.path.join(cwd, 'eos.org'), 'w') as f:
         f.write('\n'.join(org))
 
-    with open('eos.json', 'w') as f:
+    with open(os.path.join(cwd, 'eos.json'), 'w') as f:
         f.write(json.dumps(data))
 
     # now the final step with ismear=-5 for the accurate energy. This
     # is recommended by the VASP manual. We only do this if you
     # specify static=True as an argument
     if static:
-        with jasp('step-3') as calc:
-            calc.clone('step-4')
-        with jasp('step-4',
-                  isif=None, ibrion=None, nsw=None,
-                  icharg=2,  # do not reuse charge
-                  istart=1,
-                  prec='high',
-                  ismear=-5) as calc:
-            calc.calculate()
+        with jasp('step-4') as calc:
             atoms = calc.get_atoms()
 
             data['step4'] = {}
@@ -324,11 +374,11 @@ B = {avgB:1.0f} \pm {Bconf:1.0f} GPa at the 95% confidence level
                     str(calc)]
 
     # final write out
-    with open('eos.org', 'w') as f:
+    with open(os.path.join(cwd, 'eos.org'), 'w') as f:
         f.write('\n'.join(org))
 
     # dump data to a json file
-    with open('eos.json', 'w') as f:
+    with open(os.path.join(cwd, 'eos.json'), 'w') as f:
         f.write(json.dumps(data))
 
     return data
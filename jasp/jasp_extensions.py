@@ -1,6 +1,13 @@
 from jasp import *
+from POTCAR import get_potcar_info, find_potcar
+import glob
+import shutil
 import uuid
 import textwrap
+import pipes
+from subprocess import call
+import ase.io
+from ase.io.vasp import write_vasp
 
 # http://cms.mpi.univie.ac.at/vasp/vasp/Files_used_VASP.html
 vaspfiles = ['INCAR', 'STOPCAR', 'stout', 'POTCAR',
@@ -28,52 +35,48 @@ def clone(self, newdir, extra_files=None):
     else:
         newdirpath = os.path.join(self.cwd, newdir)
 
-    import shutil
     if not os.path.isdir(newdirpath):
         os.makedirs(newdirpath)
     for vf in vaspfiles+extra_files:
-
+        src = os.path.join(self.directory, vf)
         if (not os.path.exists(os.path.join(newdirpath, vf))
-            and os.path.exists(vf)):
-            shutil.copy(vf, newdirpath)
+            and os.path.exists(src)):
+            shutil.copy(src, newdirpath)
 
     # if we are an neb calculation we need to copy the image
     # directories
     if hasattr(self, 'neb'):
-        import glob
-        for imagedir in glob.glob('0[0-9]'):
-            dst = os.path.join(newdirpath, imagedir)
+        for imagedir in glob.glob(os.path.join(self.directory, '0[0-9]')):
+            dst = os.path.join(newdirpath, os.path.basename(imagedir))
             if not os.path.exists(dst):
                 shutil.copytree(imagedir, dst)
 
-    # update metadata. remember we are in the vaspdir
+    # update metadata
     d = {}
     d['uuid'] = str(uuid.uuid1())
     d['cloned on'] = time.ctime(time.time())
 
-    os.chdir(self.cwd)
-
     from jasp import jasp
-    with jasp(newdir) as calc:
+    with jasp(newdirpath) as calc:
         if hasattr(calc, 'metadata'):
             calc.metadata.update(d)
             calc.write_metadata()
 
-    os.chdir(self.vaspdir)
-
 Vasp.clone = clone
 
 
 def archive(self, archive='vasp', extra_files=[], append=False):
     '''
-    Create an archive file (.tar.gz) of the vasp files in the current
-    directory.  This is a way to save intermediate results.
+    Create an archive file (.tar.gz) of the vasp files in the
+    directory of the calculator.  This is a way to save intermediate
+    results. A relative archive is in that directory too.
     '''
 
     import tarfile
 
     if not archive.endswith('.tar.gz'):
         archive = archive + '.tar.gz'
+    archive = os.path.join(self.directory, archive)
 
     if not append and os.path.exists(archive):
         # we do not overwrite existing archives except to append
@@ -85,22 +88,20 @@ def archive(self, archive='vasp', extra_files=[], append=False):
 
     f = tarfile.open(archive, mode)
     for vf in vaspfiles + extra_files:
-        if os.path.exists(vf):
-            f.add(vf)
+        if os.path.exists(os.path.join(self.directory, vf)):
+            f.add(os.path.join(self.directory, vf), arcname=vf)
 
     # if we are an neb calculation we need to copy the image
     # directories
     if hasattr(self, 'neb'):
-        import glob
-        for imagedir in glob.glob('0[0-9]'):
-            f.add(imagedir)
+        for imagedir in glob.glob(os.path.join(self.directory, '0[0-9]')):
+            f.add(imagedir, arcname=os.path.basename(imagedir))
     f.close()
 
 Vasp.archive = archive
 
 
 def get_pseudopotentials(self):
-    from os.path import join, isfile, islink
     ''' this is almost the exact code from the original initialize
     function, but all it does is get the pseudpotentials paths, and
     the git-hash for each one
@@ -168,27 +169,16 @@ def get_pseudopotentials(self):
         xc = '_gga/'
     elif p['xc'] == 'PBE':
         xc = '_pbe/'
-    if 'VASP_PP_PATH' in os.environ:
-        pppaths = os.environ['VASP_PP_PATH'].split(':')
-    else:
-        pppaths = []
     self.ppp_list = []
     # Setting the pseudopotentials, first special setups and
-    # then according to symbols
+    # then according to symbols. find_potcar uses the POTCAR index if
+    # there is one, so we do not have to probe each path.
     for m in special_setups:
         name = 'potpaw'+xc.upper() + p['setups'][str(m)] + '/POTCAR'
-        found = False
-        for path in pppaths:
-            filename = join(path, name)
-            if isfile(filename) or islink(filename):
-                found = True
-                self.ppp_list.append(filename)
-                break
-            elif isfile(filename + '.Z') or islink(filename + '.Z'):
-                found = True
-                self.ppp_list.append(filename+'.Z')
-                break
-        if not found:
+        filename = find_potcar(name)
+        if filename is not None:
+            self.ppp_list.append(filename)
+        else:
             log.debug('Looked for %s' % name)
             print 'Looked for %s' % name
             raise RuntimeError('No pseudopotential for %s:%s!' % (symbol,
@@ -199,19 +189,10 @@ def get_pseudopotentials(self):
         except (TypeError, KeyError):
             name = 'potpaw' + xc.upper() + symbol
         name += '/POTCAR'
-        found = False
-        for path in pppaths:
-            filename = join(path, name)
-
-            if isfile(filename) or islink(filename):
-                found = True
-                self.ppp_list.append(filename)
-                break
-            elif isfile(filename + '.Z') or islink(filename + '.Z'):
-                found = True
-                self.ppp_list.append(filename+'.Z')
-                break
-        if not found:
+        filename = find_potcar(name)
+        if filename is not None:
+            self.ppp_list.append(filename)
+        else:
             print '''Looking for %s
                 The pseudopotentials are expected to be in:
                 LDA:  $VASP_PP_PATH/potpaw/
@@ -223,19 +204,8 @@ def get_pseudopotentials(self):
                                                                   name))
             raise RuntimeError('No pseudopotential for %s!' % symbol)
 
-        # get sha1 hashes similar to the way git does it
-        # http://stackoverflow.com/questions/552659/assigning-git-sha1s-without-git
-        # git hash-object foo.txt  will generate a command-line hash
-        hashes = []
-        for ppp in self.ppp_list:
-            f = open(ppp, 'r')
-            data = f.read()
-            f.close()
-
-            s = sha1()
-            s.update("blob %u\0" % len(data))
-            s.update(data)
-            hashes.append(s.hexdigest())
+    # the hashes are cached, so this does not read the POTCARs again
+    hashes = [get_potcar_info(ppp)['hash'] for ppp in self.ppp_list]
 
     stripped_paths = [ppp.split(os.environ['VASP_PP_PATH'])[1]
                       for ppp in self.ppp_list]
@@ -284,42 +254,25 @@ Vasp.register_post_run_hook = staticmethod(register_post_run_hook)
 
 
 def job_in_queue(self):
-    ''' return True or False if the directory has a job in the queue'''
-    if not os.path.exists('jobid'):
+    ''' return True or False if the directory has a job in the queue
+
+    The state of the job is taken from a snapshot of the whole queue,
+    see scheduler.py.
+    '''
+    fname = os.path.join(getattr(self, 'directory', '.'), 'jobid')
+    if not os.path.exists(fname):
         return False
     else:
         # get the jobid
-        jobid = open('jobid').readline().strip()
-        if JASPRC['scheduler']=='PBS':
-            # see if jobid is in queue
-            jobids_in_queue = commands.getoutput('qselect').split('\n')
-            if jobid in jobids_in_queue:
-                # get details on specific jobid
-                status, output = commands.getstatusoutput('qstat %s' % jobid)
-                if status == 0:
-                    lines = output.split('\n')
-                    fields = lines[2].split()
-                    job_status = fields[4]
-                    if job_status == 'C':
-                        return False
-                    else:
-                        return True
-            else:
-                return False
-
-        if JASPRC['scheduler']=='SGE':
-            # SGE qselect does not print a list of jobids, so we have to improvise
-            jobids_in_queue = commands.getoutput("qstat | awk '{ print $1; }'").split('\n')[2:]
-            if jobid in jobids_in_queue:
-                # SGE apparently does not have jobstate == 'C', lets still get status and output for now
-                status, output = commands.getstatusoutput('qstat | grep {0}'.format(jobid))
-
-                if status == 0:
-                    fields = output.split()
-                    job_status = fields[4]                    
-                    return True
-            else:
-                return False
+        jobid = open(fname).readline().strip()
+        job_status = get_job_state(jobid)
+        if job_status is None:
+            return False
+        # SGE does not have jobstate == 'C'
+        elif job_status == 'C':
+            return False
+        else:
+            return True
 Vasp.job_in_queue = job_in_queue
 
 
@@ -424,7 +377,31 @@ def calculation_required(self, atoms, quantities):
     return False
 Vasp.calculation_required = calculation_required
 
-original_calculate = Vasp.calculate
+def vasp_calculate(self, atoms):
+    '''calculate of ase, with the files in self.directory.'''
+    self.initialize(atoms)
+
+    # Write input
+    write_vasp(os.path.join(self.directory, 'POSCAR'),
+               self.atoms_sorted,
+               symbol_count=self.symbol_count)
+    self.write_incar(atoms)
+    self.write_potcar()
+    self.write_kpoints()
+    self.write_sort_file()
+
+    # Execute VASP
+    self.run()
+    # Read output
+    atoms_sorted = ase.io.read(os.path.join(self.directory, 'CONTCAR'),
+                               format='vasp')
+    if self.int_params['ibrion'] > -1 and self.int_params['nsw'] > 0:
+        # Update atomic positions and unit cell with the ones read
+        # from CONTCAR.
+        atoms.positions = atoms_sorted[self.resort].positions
+        atoms.cell = atoms_sorted.cell
+    self.converged = self.read_convergence()
+    self.set_results(atoms)
 
 
 def calculate(self, atoms=None):
@@ -435,12 +412,20 @@ def calculate(self, atoms=None):
 
     I also made it possible to not give an atoms here, since there
     should be one on the calculator.
+
+    In JASPRC['mode'] = 'run' with JASPRC['run.cores'] set, calling
+    calc.calculate() starts the calculation in the background and
+    returns a RunHandle. Use wait or as_completed to wait for it.
     '''
+    # only a bare calc.calculate() returns a RunHandle. The getters,
+    # e.g. get_potential_energy, call calculate(atoms), and get
+    # VaspSubmitted as before, so they do not read a running job.
+    return_handle = atoms is None
     if hasattr(self, 'vasp_queued'):
-        raise VaspQueued('Queued', os.getcwd())
+        raise VaspQueued('Queued', self.directory)
 
     if hasattr(self, 'vasp_running'):
-        raise VaspRunning('Running', os.getcwd())
+        raise VaspRunning('Running', self.directory)
 
     if atoms is None:
         atoms = self.get_atoms()
@@ -457,7 +442,13 @@ def calculate(self, atoms=None):
                             '''we should not be running!''')
 
     # finally run the original function
-    original_calculate(self, atoms)
+    try:
+        vasp_calculate(self, atoms)
+    except VaspSubmitted, e:
+        pool = get_run_pool()
+        if return_handle and pool is not None and e.jobid in pool.jobs:
+            return RunHandle(pool, e.jobid, self.directory)
+        raise
 
 Vasp.calculate = calculate
 
@@ -476,18 +467,30 @@ def run(self):
 
     # if we are in the queue and jasp is called or if we want to use
     # mode='run' , we should just run the job. First, we consider how.
-    if 'PBS_O_WORKDIR' in os.environ or JASPRC['mode'] == 'run':
+    scheduler = detect_scheduler()
+    pool = get_run_pool()
+    if scheduler is None and JASPRC['mode'] == 'run' and pool is not None:
+        # run in the background with the other calculations
+        cores = int(JASPRC['run.cores_per_job'])
+        set_parallelization(self, cores, cores)
+        jobid = pool.submit(run_pool_script(self.directory), self.directory,
+                            cwd=self.directory)
+        with open(os.path.join(self.directory, 'jobid'), 'w') as f:
+            f.write(jobid)
+        raise VaspSubmitted(jobid)
+
+    if scheduler is not None or JASPRC['mode'] == 'run':
         log.info('In the queue. determining how to run')
-        if 'PBS_NODEFILE' in os.environ:
+        if scheduler is not None and scheduler.get_nodes():
             # we are in the queue. determine if we should run serial
             # or parallel
-            NPROCS = len(open(os.environ['PBS_NODEFILE']).readlines())
+            NPROCS = len(scheduler.get_nodes())
             log.debug('Found {0} PROCS'.format(NPROCS))
             if NPROCS == 1:
                 # no question. running in serial.
                 vaspcmd = JASPRC['vasp.executable.serial']
                 log.debug('NPROCS = 1. running in serial')
-                exitcode = os.system(vaspcmd)
+                exitcode = call(vaspcmd, shell=True, cwd=self.directory)
                 return exitcode
             else:
                 # vanilla MPI run. multiprocessing does not work on more
@@ -506,90 +509,58 @@ def run(self):
                     print 'MPI NPROCS = ', NPROCS
                     vaspcmd = JASPRC['vasp.executable.parallel']
                     parcmd = 'mpirun -np %i %s' % (NPROCS, vaspcmd)
-                    exitcode = os.system(parcmd)
+                    exitcode = call(parcmd, shell=True, cwd=self.directory)
                     return exitcode
                 else:
                     # we need to run an MPI job on cores_per_process
                     if JASPRC['multiprocessing.cores_per_process'] == 1:
                         log.debug('running single core multiprocessing job')
                         vaspcmd = JASPRC['vasp.executable.serial']
-                        exitcode = os.system(vaspcmd)
+                        exitcode = call(vaspcmd,
+                                        shell=True, cwd=self.directory)
                     elif JASPRC['multiprocessing.cores_per_process'] > 1:
                         log.debug('running mpi multiprocessing job')
                         NPROCS = JASPRC['multiprocessing.cores_per_process']
 
                         vaspcmd = JASPRC['vasp.executable.parallel']
                         parcmd = 'mpirun -np %i %s' % (NPROCS, vaspcmd)
-                        exitcode = os.system(parcmd)
+                        exitcode = call(parcmd, shell=True, cwd=self.directory)
                         return exitcode
         else:
             # probably running at cmd line, in serial.
             vaspcmd = JASPRC['vasp.executable.serial']
-            exitcode = os.system(vaspcmd)
+            exitcode = call(vaspcmd, shell=True, cwd=self.directory)
             return exitcode
         # end
 
     # if you get here, a job is getting submitted
-    script = '#!/bin/{0}\n'.format(JASPRC['queue.shell'])
-    script += 'module load {0}\n'.format(JASPRC['module'])
-    script +='''cd {self.cwd}  # this is the current working directory
-cd {self.vaspdir}  # this is the vasp directory
+    array = current_job_array()
+    if array is not None:
+        # a task farm runs each directory on some of the cores of the job
+        ncores = array.get_ncores()
+        set_parallelization(self, ncores)
+        # submitted with the rest of the array at the end of the block
+        array.add(self.directory, try_predict_walltime(self, ncores))
+        log.info('{0} will be submitted in a job array'.format(self.vaspdir))
+        # the array has no jobid until it is submitted
+        raise VaspSubmitted(None)
+
+    set_parallelization(self)
+
+    directory = pipes.quote(self.directory)
+    script = job_script('''cd {directory}  # this is the vasp directory
 runjasp.py   # this is the vasp command
-#end'''.format(**locals())
-
-
-    if JASPRC['scheduler'] == 'PBS':
-        jobname = self.vaspdir
-        log.debug('{0} will be the jobname.'.format(jobname))
-        log.debug('-l nodes={0}:ppn={1}'.format(JASPRC['queue.nodes'],
-                                                JASPRC['queue.ppn']))
-
-        cmdlist = ['{0}'.format(JASPRC['queue.command'])]
-        cmdlist += [option for option in JASPRC['queue.options'].split()]
-        cmdlist += ['-N', '{0}'.format(jobname),
-                    '-l walltime={0}'.format(JASPRC['queue.walltime']),
-                    '-l nodes={0}:ppn={1}'.format(JASPRC['queue.nodes'],
-                                                  JASPRC['queue.ppn']),
-                    '-l mem={0}'.format(JASPRC['queue.mem'])]
-
-    elif JASPRC['scheduler'] == 'SGE':
-        jobname = (self.vaspdir).replace('/','|') # SGE does not allow '/' in job names
-        log.debug('{0} will be the jobname.'.format(jobname))        
-        f = open('qscript','w')
-        f.write(script)
-        f.close()
-        log.debug('-pe {0} {1}'.format(JASPRC['queue.pe'],
-                                       JASPRC['queue.nprocs']))
-        log.debug('-q {0}'.format(JASPRC['queue.q']))
-
-        cmdlist = ['{0}'.format(JASPRC['queue.command'])]
-        cmdlist += [option for option in JASPRC['queue.options'].split()]
-        cmdlist += ['-N', '{0}'.format(jobname),
-                    '-q {0}'.format(JASPRC['queue.q']),
-                    '-pe {0} {1}'.format(JASPRC['queue.pe'], JASPRC['queue.nprocs'])
-                    #'-l mem_free={0}'.format(JASPRC['queue.mem'])
-                     ]
-        cmdlist += ['qscript']
-
-    log.debug('{0}'.format(' '.join(cmdlist)))
-    p = Popen(cmdlist,
-              stdin=PIPE, stdout=PIPE, stderr=PIPE)
+#end'''.format(**locals()))
 
     log.debug(script)
+    jobid = get_scheduler().submit(script, self.vaspdir,
+                                   walltime=get_walltime(self))
 
-    out, err = p.communicate(script)
-
-    if out == '' or err != '':
-        raise Exception('something went wrong in qsub:\n\n{0}'.format(err))
-
-    if JASPRC['scheduler'] == 'SGE':    
-        jobid = out.split()[2]
-    else:
-        jobid =  out
-    f = open('jobid', 'w')
+    f = open(os.path.join(self.directory, 'jobid'), 'w')
     f.write(jobid)
     f.close()
-    raise VaspSubmitted(out)
+    add_job_to_snapshot(jobid)
+    raise VaspSubmitted(jobid)
 
 Vasp.run = run
 
@@ -600,7 +571,7 @@ def prepare_input_files(self):
     self.initialize(atoms)
     # Write input
     from ase.io.vasp import write_vasp
-    write_vasp('POSCAR',
+    write_vasp(os.path.join(self.directory, 'POSCAR'),
                self.atoms_sorted,
                symbol_count=self.symbol_count)
     self.write_incar(atoms)
@@ -620,7 +591,7 @@ def pretty_print(self):
         # we have an neb.
         s = []
         s.append(': -----------------------------')
-        s.append('  VASP NEB calculation from %s' % os.getcwd())
+        s.append('  VASP NEB calculation from %s' % self.directory)
         try:
             images, energies = self.get_neb()
             for i, e in enumerate(energies):
@@ -631,7 +602,7 @@ def pretty_print(self):
 
     s = []
     s.append(': -----------------------------')
-    s.append('  VASP calculation from %s' % os.getcwd())
+    s.append('  VASP calculation from %s' % self.directory)
     if hasattr(self, 'converged'):
         s.append('  converged: %s' % self.converged)
 
@@ -769,7 +740,7 @@ def pretty_print(self):
         # no atoms
         pass
 
-    if os.path.exists('INCAR'):
+    if os.path.exists(os.path.join(self.directory, 'INCAR')):
         # print all parameters that are set
         self.read_incar()
         ppp_list = self.get_pseudopotentials()
@@ -823,65 +794,71 @@ def pretty_print(self):
 Vasp.__str__ = pretty_print
 
 #########################################################################
-def vasp_changed_bands(calc):
-    '''Check here if VASP changed nbands.'''
+def vasp_changed_bands(calc, offset=None):
+    '''Check here if VASP changed nbands.
+
+    offset is the byte offset of the line in the OUTCAR saying the
+    bands were changed, e.g. from :func:`scan_outcar_errors`. If it is
+    None, the OUTCAR is scanned for it.
+    '''
     log.debug('Checking if vasp changed nbands')
 
-    if not os.path.exists('OUTCAR'):
+    outcar = os.path.join(calc.directory, 'OUTCAR')
+    if not os.path.exists(outcar):
         return
 
-    with open('OUTCAR') as f:
-        lines = f.readlines()
-        for i, line in enumerate(lines):
-            if 'The number of bands has been changed from the values supplied' in line:
-
-                s = lines[i + 5]  # this is where the new bands are found
-                nbands_cur = calc.nbands
-                nbands_ori, nbands_new = [int(x) for x in
-                                          re.search(r"I found NBANDS\s+ =\s+([0-9]*).*=\s+([0-9]*)", s).groups()]
-                log.debug('Calculator nbands = {0}.\n'
-                          'VASP found {1} nbands.\n'
-                          'Changed to {2} nbands.'.format(nbands_cur,
-                                                          nbands_ori,
-                                                          nbands_new))
-
-                calc.set(nbands=nbands_new)
-                calc.write_incar(calc.get_atoms())
-
-                log.debug('calc.kwargs: {0}'.format(calc.kwargs))
-                if calc.kwargs.get('nbands', None) != nbands_new:
-                    raise VaspWarning('The number of bands was changed by VASP. '
-                                      'This happens sometimes when you run in '
-                                      'parallel. It causes problems with jasp. '
-                                      'I have already updated your INCAR. '
-                                      'You need to change the number of bands '
-                                      'in your script to match what VASP used '
-                                      'to proceed.\n\n '
-                                      + '\n'.join(lines[i - 9: i + 8]))
+    if offset is None:
+        offsets = [o for kind, lineno, o, line in scan_outcar_errors(outcar)
+                   if kind == 'bands changed']
+    else:
+        offsets = [offset]
+
+    for offset in offsets:
+        # we only need the lines around the message
+        lines = read_outcar_lines_before(offset, 9, outcar)
+        i = len(lines)  # the line the bands changed on
+        lines += read_outcar_lines(offset, 8, outcar)
+        s = lines[i + 5]  # this is where the new bands are found
+        nbands_cur = calc.nbands
+        nbands_ori, nbands_new = [int(x) for x in
+                                  re.search(r"I found NBANDS\s+ =\s+([0-9]*).*=\s+([0-9]*)", s).groups()]
+        log.debug('Calculator nbands = {0}.\n'
+                  'VASP found {1} nbands.\n'
+                  'Changed to {2} nbands.'.format(nbands_cur,
+                                                  nbands_ori,
+                                                  nbands_new))
+
+        calc.set(nbands=nbands_new)
+        calc.write_incar(calc.get_atoms())
+
+        log.debug('calc.kwargs: {0}'.format(calc.kwargs))
+        if calc.kwargs.get('nbands', None) != nbands_new:
+            raise VaspWarning('The number of bands was changed by VASP. '
+                              'This happens sometimes when you run in '
+                              'parallel. It causes problems with jasp. '
+                              'I have already updated your INCAR. '
+                              'You need to change the number of bands '
+                              'in your script to match what VASP used '
+                              'to proceed.\n\n '
+                              + '\n'.join(lines))
 
 
 def checkerr_vasp(self):
-    ''' Checks vasp output in OUTCAR for errors. adapted from atat code'''
-    error_strings = ['forrtl: severe',  # seg-fault
-                     'highest band is occupied at some k-points!',
-                     'rrrr',  # I think this is from Warning spelled
-                              # out in ascii art
-                     'cnorm',
-                     'failed',
-                     'non-integer']
-
-    # Check if VASP changed the bands
-    vasp_changed_bands(self)
+    ''' Checks vasp output in OUTCAR for errors. adapted from atat code
 
+    The OUTCAR is scanned once for all the OUTCAR_ERRORS, including the
+    message that VASP changed the number of bands.
+    '''
     errors = []
-    if os.path.exists('OUTCAR'):
-        f = open('OUTCAR')
-        for i, line in enumerate(f):
-            i += 1
-            for es in error_strings:
-                if es in line:
-                    errors.append((i, line))
-        f.close()
+    outcar = os.path.join(self.directory, 'OUTCAR')
+    errorfile = os.path.join(self.directory, 'error')
+    if os.path.exists(outcar):
+        for kind, i, offset, line in scan_outcar_errors(outcar):
+            if kind == 'bands changed':
+                # Check if VASP changed the bands
+                vasp_changed_bands(self, offset)
+            else:
+                errors.append(('{0} ({1})'.format(i, kind), line))
 
         converged = self.read_convergence()
         if not converged:
@@ -895,16 +872,16 @@ def checkerr_vasp(self):
                 errors.append(('Ions/cell Converged', converged))
 
         if len(errors) != 0:
-            f = open('error', 'w')
+            f = open(errorfile, 'w')
             for i, line in errors:
                 f.write('{0}: {1}\n'.format(i, line))
             f.close()
         else:
             # no errors found, lets delete any error file that had existed.
-            if os.path.exists('error'):
-                os.unlink('error')
-        if os.path.exists('error'):
-            with open('error') as f:
+            if os.path.exists(errorfile):
+                os.unlink(errorfile)
+        if os.path.exists(errorfile):
+            with open(errorfile) as f:
                 print 'Errors found:\n', f.read()
     else:
         if not hasattr(self, 'neb'):
@@ -918,6 +895,7 @@ def strip(self, extrafiles=()):
     files_to_remove = ['CHG', 'CHGCAR', 'WAVECAR'] + extrafiles
 
     for f in files_to_remove:
+        f = os.path.join(self.directory, f)
         if os.path.exists(f):
             os.unlink(f)
 
@@ -952,7 +930,7 @@ def get_valence_electrons(self):
 
     Calculated from the POTCAR file.
     '''
-    if not os.path.exists('POTCAR'):
+    if not os.path.exists(os.path.join(self.directory, 'POTCAR')):
         self.initialize(self.get_atoms())
         self.write_potcar()
     default_electrons = self.get_default_number_of_electrons()
@@ -975,16 +953,12 @@ def get_elapsed_time(self):
     import re
     regexp = re.compile('Elapsed time \(sec\):\s*(?P<time>[0-9]*\.[0-9]*)')
 
-    with open('OUTCAR') as f:
-        lines = f.readlines()
-
-    m = re.search(regexp, lines[-8])
-
-    time = m.groupdict().get('time', None)
-    if time is not None:
-        return float(time)
-    else:
-        return None
+    # the elapsed time is printed at the end of the OUTCAR
+    for line in read_outcar_tail(8, os.path.join(self.directory, 'OUTCAR')):
+        m = re.search(regexp, line)
+        if m:
+            return float(m.groupdict()['time'])
+    return None
 Vasp.get_elapsed_time = get_elapsed_time
 
 old_read_ldau = Vasp.read_ldau
@@ -1030,15 +1004,17 @@ def get_nearest_neighbor_table(self):
     returns a list of atom indices and the connecting neighbors. The
     list is not sorted according to self.sorted or self.resorted.
     """
-    with open('OUTCAR') as f:
-        lines = f.readlines()
-
-    for i, line in enumerate(lines):
-        if 'nearest neighbor table' in line:
+    outcar = os.path.join(self.directory, 'OUTCAR')
+    offsets = get_outcar_offsets('nearest_neighbor_table', outcar)
+    # the table ends at a blank line or the LATTYP line, but we do not
+    # know in advance how long it is.
+    lines = []
+    for line in iter_outcar_lines(offsets[0], outcar):
+        lines.append(line)
+        if len(lines) > 1 and ('LATTYP' in line or line.strip() == ''):
             break
 
-    # i contains index of line
-    i += 1  # first line of the table
+    i = 1  # first line of the table
 
     # sometimes there is carriover to the next line.
     line_counter = 0
@@ -1099,20 +1075,13 @@ def get_energy_components(self, outputType=0):
     '''
     # self.calculate()
 
-    with open('OUTCAR') as f:
-        lines = f.readlines()
-
-    lineNumbers = []
-    for i, line in enumerate(lines):
-        # note: this is tricky, the exact string to search for is not
-        # the last energy line in OUTCAR, there are space differences
-        # ...  USER BEWARE: Be careful with this function ... may be
-        # buggy depending on inputs
-        if line.startswith('  free energy    TOTEN  ='):
-            lineNumbers.append(i)
-
-    lastLine = lineNumbers[-1]
-    data = lines[lastLine - 10:lastLine]
+    # note: this is tricky, the exact string to search for is not
+    # the last energy line in OUTCAR, there are space differences
+    # ...  USER BEWARE: Be careful with this function ... may be
+    # buggy depending on inputs
+    outcar = os.path.join(self.directory, 'OUTCAR')
+    lastLine = get_outcar_offsets('energy', outcar)[-1]
+    data = read_outcar_lines_before(lastLine, 10, outcar)
     energies = []
 
     alphaZ = float(data[0].split()[-1])
@@ -1179,14 +1148,12 @@ def get_beefens(self, n=-1):
 
     see http://suncat.slac.stanford.edu/facility/software/functional/
     '''
-    beefens = []
-    with open('OUTCAR') as f:
-        lines = f.readlines()
-        for i, line in enumerate(lines):
-            if 'BEEFens' in line:
-                nsamples = int(re.search('(\d+)', line).groups()[0])
-                beefens.append([float(x) for x in lines[i + 1: i + nsamples]])
-    return np.array(beefens[n])
+    outcar = os.path.join(self.directory, 'OUTCAR')
+    offset = get_outcar_offsets('beefens', outcar)[n]
+    line = read_outcar_lines(offset, 1, outcar)[0]
+    nsamples = int(re.search('(\d+)', line).groups()[0])
+    lines = read_outcar_lines(offset, nsamples, outcar)
+    return np.array([float(x) for x in lines[1:]])
 
 Vasp.get_beefens = get_beefens
 
@@ -1200,20 +1167,16 @@ def get_orbital_occupations(self):
     '''
 
     # this finds the last entry of occupations. Sometimes, this is printed multiple times in the OUTCAR.
-    with open('OUTCAR', 'r') as f:
-        lines = f.readlines()
-        start = None
-        for i,line in enumerate(lines):
-            if line.startswith(" total charge "):
-                start = i
-
-    if not i:
+    outcar = os.path.join(self.directory, 'OUTCAR')
+    offsets = get_outcar_offsets('occupations', outcar)
+    if not offsets:
         raise Exception('Occupations not found')
 
     atoms = self.get_atoms()
+    lines = read_outcar_lines(offsets[-1], 4 + len(atoms), outcar)
     occupations = []
     for j in range(len(atoms)):
-        line = lines[start + 4 + j]
+        line = lines[4 + j]
         fields = line.split()
         s, p, d, tot = [float(x) for x in fields[1:]]
         occupations.append(np.array((s, p, d, tot)))
@@ -1224,7 +1187,7 @@ Vasp.get_orbital_occupations = get_orbital_occupations
 def get_number_of_ionic_steps(self):
     "Returns number of ionic steps from the OUTCAR."
     nsteps = None
-    for line in open('OUTCAR'):
+    for line in open(os.path.join(self.directory, 'OUTCAR')):
         # find the last iteration number
         if line.find('- Iteration') != -1:
             nsteps = int(line.split('(')[0].split()[-1].strip())
@@ -1239,56 +1202,66 @@ def get_required_memory(self):
     Code retrieves memory estimate based on the following priority:
     1) METADATA
     2) existing OUTCAR
-    3) run diagnostic calculation
+    3) estimate from the memory model, see memory.py
+    4) run diagnostic calculation
 
-    The final method determines the memory requirements from
-    KPOINT calculations run locally before submission to the queue
+    The last method determines the memory requirements from
+    KPOINT calculations run locally before submission to the queue. It
+    is only used if the model cannot make an estimate, or if
+    JASPRC['memory.probe'] is True.
     '''
     import json
+    outcar = os.path.join(self.directory, 'OUTCAR')
+    metadata = os.path.join(self.directory, 'METADATA')
 
     def get_memory():
         ''' Retrieves the recommended memory from the OUTCAR
         '''
 
-        if os.path.exists('OUTCAR'):
-            with open('OUTCAR') as f:
-                lines = f.readlines()
-        else:
+        if not os.path.exists(outcar):
             return None
 
-        for line in lines:
-
-            # There can be multiple instances of this,
-            # but they all seem to be identical
-            if 'memory' in line:
-
-                # Read the memory usage
-                required_mem = float(line.split()[-2]) / 1e6
-                return required_mem
+        params = add_memory_record(outcar)
+        if params is None:
+            return None
+        # kB to GB
+        return params['memory'] / 1e6
 
     # Attempt to get the recommended memory from METADATA
     # JASP automatically generates a METADATA file when
     # run, so there should be no instances where it does not exist
-    with open('METADATA', 'r') as f:
+    with open(metadata, 'r') as f:
         data = json.load(f)
 
     try:
         memory = data['recommended.memory']
     except(KeyError):
         # Check if an OUTCAR exists from a previous run
-        if os.path.exists('OUTCAR'):
+        if os.path.exists(outcar):
             memory = get_memory()
 
             # Write the recommended memory to the METADATA file
-            with open('METADATA', 'r+') as f:
+            with open(metadata, 'r+') as f:
 
                 data = json.load(f)
                 data['recommended.memory'] = memory
                 f.seek(0)
                 json.dump(data, f)
 
-        # If no OUTCAR exists, we run a 'dummy' calculation
         else:
+            # an estimate is not written to METADATA, so we read the
+            # OUTCAR when there is one
+            memory = None
+            if not JASPRC.get('memory.probe', False):
+                try:
+                    memory = (estimate_memory(self) / 1e6
+                              * float(JASPRC.get('memory.safety', 1.2)))
+                except Exception, e:
+                    log.warning('memory estimate failed: {0}. Running '
+                                'vasp to get it.'.format(e))
+
+        # If no OUTCAR exists, we run a 'dummy' calculation
+        if memory is None and not os.path.exists(outcar):
             original_ialgo = self.int_params.get('ialgo')
             self.int_params['ialgo'] = -1
 
@@ -1297,7 +1270,7 @@ def get_required_memory(self):
             self.initialize(atoms)
 
             from ase.io.vasp import write_vasp
-            write_vasp('POSCAR',
+            write_vasp(os.path.join(self.directory, 'POSCAR'),
                        self.atoms_sorted,
                        symbol_count=self.symbol_count)
             self.write_incar(atoms)
@@ -1312,7 +1285,7 @@ def get_required_memory(self):
             # We only need the memory estimate, so we can greatly
             # accelerate the process by terminating after we have it
             process = Popen(JASPRC['vasp.executable.serial'],
-                            stdout=PIPE)
+                            stdout=PIPE, cwd=self.directory)
 
             from threading import Timer
             timer = Timer(20.0, kill)
@@ -1334,7 +1307,7 @@ def get_required_memory(self):
             self.write_incar(atoms)
 
             # Write the recommended memory to the METADATA file
-            with open('METADATA', 'r+') as f:
+            with open(metadata, 'r+') as f:
 
                 data = json.load(f)
                 data['recommended.memory'] = memory
@@ -1347,7 +1320,7 @@ def get_required_memory(self):
                      'vasprun.xml', 'OUTCAR', 'WAVECAR', 'XDATCAR']
 
             for f in files:
-                os.unlink(f)
+                os.unlink(os.path.join(self.directory, f))
 
     # Each node will require the memory read from the OUTCAR
     nodes = JASPRC['queue.nodes']
@@ -1370,7 +1343,8 @@ def chgsum(self):
     Uses the chgsum.pl utility to sum over the AECCAR0 and AECCAR2 files
     '''
     cmdlist = ['chgsum.pl', 'AECCAR0', 'AECCAR2']
-    p = Popen(cmdlist, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+    p = Popen(cmdlist, stdin=PIPE, stdout=PIPE, stderr=PIPE,
+              cwd=self.directory)
     out, err = p.communicate()
     if out == '' or err != '':
         raise Exception('Cannot perform chgsum:\n\n{0}'.format(err))
@@ -1392,7 +1366,7 @@ def bader(self, cmd=None, ref=False, verbose=False, overwrite=False):
     Requires the bader.pl (and chgsum.pl) script to be in the system PATH
     '''
 
-    if 'ACF.dat' in os.listdir('./') and not overwrite:
+    if 'ACF.dat' in os.listdir(self.directory) and not overwrite:
         self._get_calculated_charges()
         return
 
@@ -1411,7 +1385,8 @@ def bader(self, cmd=None, ref=False, verbose=False, overwrite=False):
     elif type(cmd) is list:
         cmdlist = cmd
 
-    p = Popen(cmdlist, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+    p = Popen(cmdlist, stdin=PIPE, stdout=PIPE, stderr=PIPE,
+              cwd=self.directory)
     out, err = p.communicate()
     if out == '' or err != '':
         raise Exception('Cannot perform Bader:\n\n{0}'.format(err))
@@ -1438,7 +1413,7 @@ def _get_calculated_charges(self,
 
     if isinstance(fileobj, str):
         try:
-            fileobj = open(fileobj)
+            fileobj = open(os.path.join(self.directory, fileobj))
             f_open = True
         except(IOError):
             return None
@@ -0,0 +1,282 @@
+'''A persistent index of the calculation directories in a tree.
+
+Tools that list our calculations walked the whole project tree every
+time. The index is an SQLite database (JASPRC['index.db']) with one row
+per calculation: its state (see jasp_status), jobid, the uuid from
+METADATA, the formula and number of atoms from the POSCAR, the energy
+from the OSZICAR, and the mtimes of the output files. Listing the
+calculations is one query.
+
+>>> refresh_index('~/projects')  # after calculations change
+>>> for row in list_calculations('~/projects', state='finished-ok'):
+...     print row['vaspdir'], row['energy']
+
+Refresh the index with jaspindex refresh, e.g. from cron, and let
+tools like the web pages in jasp/www only query it, so a page view does
+not walk the tree. Only the directories discover.classify_listing
+recognizes as vasp or NEB calculations are in the index. A directory
+with an INCAR but no POSCAR, KPOINTS or POTCAR is not.
+
+refresh_index only lists directories whose mtime changed since the
+last refresh. Other directories are stat'ed, and the subdirectories
+and classification stored for them are used. A calculation is read
+again when its directory or its output files changed, or when it was
+queued or running, since the queue can change without the files
+changing.
+'''
+
+import json
+import os
+import sqlite3
+import thread
+import time
+from multiprocessing.pool import ThreadPool
+from jasprc import JASPRC
+from outcar import read_outcar_tail
+from discover import list_directory, classify_listing, parallel_walk
+from jasp_status import status
+
+import logging
+log = logging.getLogger('Jasp')
+
+# files whose mtimes decide if a calculation is read again
+INDEX_OUTPUTS = ['OUTCAR', 'OSZICAR', 'CONTCAR', 'jobid']
+
+# states of calculations that are read again on every refresh
+INDEX_VOLATILE_STATES = ['queued', 'running']
+
+INDEX_COLUMNS = ['vaspdir', 'state', 'jobid', 'uuid', 'formula', 'natoms',
+                 'energy', 'outputs', 'updated']
+
+# (pid, thread, path): connection to the index. sqlite connections must
+# not be shared with forked processes or threads.
+_index_connections = {}
+
+
+def get_index_db(path=None):
+    '''Return a connection to the index in path or JASPRC['index.db'].'''
+    if path is None:
+        path = JASPRC['index.db']
+    path = os.path.expanduser(path)
+
+    key = (os.getpid(), thread.get_ident(), path)
+    if key not in _index_connections:
+        con = sqlite3.connect(path, timeout=30)
+        con.row_factory = sqlite3.Row
+        con.execute('PRAGMA journal_mode=WAL')
+        con.execute('''CREATE TABLE IF NOT EXISTS directories
+                       (path TEXT PRIMARY KEY,
+                        mtime REAL,
+                        subdirs TEXT,
+                        calculation INTEGER)''')
+        con.execute('''CREATE TABLE IF NOT EXISTS calculations
+                       (vaspdir TEXT PRIMARY KEY,
+                        state TEXT,
+                        jobid TEXT,
+                        uuid TEXT,
+                        formula TEXT,
+                        natoms INTEGER,
+                        energy REAL,
+                        outputs TEXT,
+                        updated REAL)''')
+        con.execute('''CREATE INDEX IF NOT EXISTS calculations_state
+                       ON calculations (state)''')
+        con.commit()
+        _index_connections[key] = con
+    return _index_connections[key]
+
+
+def _under(root, column='path'):
+    '''Return the SQL condition and arguments for column under root.
+
+    The range uses the primary key index, unlike LIKE.
+    '''
+    root = os.path.abspath(os.path.expanduser(root)).rstrip('/')
+    return ('({0} = ? OR ({0} > ? AND {0} < ?))'.format(column),
+            (root, root + '/', root + '0'))  # '0' comes after '/'
+
+
+def output_mtimes(vaspdir):
+    '''Return the mtimes of INDEX_OUTPUTS in vaspdir, None if missing.'''
+    mtimes = []
+    for fname in INDEX_OUTPUTS:
+        try:
+            mtimes.append(os.stat(os.path.join(vaspdir, fname)).st_mtime)
+        except OSError:
+            mtimes.append(None)
+    return mtimes
+
+
+def read_poscar_formula(fname):
+    '''Return (formula, natoms) from the POSCAR fname without ase.
+
+    The symbols are on the first line, as ase writes them, or on the
+    line before the counts in the vasp 5 format.
+    '''
+    with open(fname) as f:
+        lines = [f.readline() for i in range(7)]
+    counts = lines[5].split()
+    symbols = lines[0].split()
+    if not all(c.isdigit() for c in counts):
+        symbols, counts = counts, lines[6].split()
+    counts = [int(c) for c in counts]
+    if len(symbols) != len(counts):
+        return None, sum(counts)
+
+    composition = []  # in order of appearance
+    totals = {}
+    for symbol, count in zip(symbols, counts):
+        if symbol not in totals:
+            composition.append(symbol)
+            totals[symbol] = 0
+        totals[symbol] += count
+    formula = ''.join('{0}{1}'.format(s, totals[s] if totals[s] > 1 else '')
+                      for s in composition)
+    return formula, sum(counts)
+
+
+def read_oszicar_energy(fname):
+    '''Return the last energy (E0) in the OSZICAR fname, or None.'''
+    for line in reversed(read_outcar_tail(20, fname)):
+        if ' F= ' in line:
+            return float(line.split('E0=')[1].split()[0])
+    return None
+
+
+def read_calculation_summary(vaspdir):
+    '''Return (uuid, formula, natoms, energy) of vaspdir from small files.'''
+    uuid = formula = natoms = energy = None
+    try:
+        with open(os.path.join(vaspdir, 'METADATA')) as f:
+            uuid = json.load(f).get('uuid')
+    except (IOError, ValueError):
+        pass
+    for fname in ['CONTCAR', 'POSCAR']:
+        fname = os.path.join(vaspdir, fname)
+        try:
+            if os.path.getsize(fname) > 0:
+                formula, natoms = read_poscar_formula(fname)
+                break
+        except (OSError, IOError, IndexError, ValueError):
+            pass
+    try:
+        energy = read_oszicar_energy(os.path.join(vaspdir, 'OSZICAR'))
+    except (OSError, IOError, IndexError, ValueError):
+        pass
+    return uuid, formula, natoms, energy
+
+
+def refresh_index(roots, threads=None, db=None):
+    '''Update the index for the directories under roots.
+
+    Returns the number of calculations that were read again.
+    '''
+    if isinstance(roots, basestring):
+        roots = [roots]
+    if threads is None:
+        threads = int(JASPRC.get('discover.threads', 16))
+    con = get_index_db(db)
+    nread = 0
+    for root in roots:
+        root = os.path.abspath(os.path.expanduser(root))
+        where, args = _under(root)
+        known = dict((row['path'], (row['mtime'], json.loads(row['subdirs']),
+                                    row['calculation']))
+                     for row in con.execute('SELECT * FROM directories '
+                                            'WHERE ' + where, args))
+        where, args = _under(root, 'vaspdir')
+        indexed = dict((row['vaspdir'], (row['state'], row['outputs']))
+                       for row in con.execute(
+                           'SELECT vaspdir, state, outputs FROM calculations '
+                           'WHERE ' + where, args))
+
+        def visit(path):
+            mtime = os.stat(path).st_mtime
+            old = known.get(path)
+            if old is not None and old[0] == mtime:
+                subdirs, calculation, changed = old[1], old[2], False
+            else:
+                names, subdirs = list_directory(path)
+                calculation = classify_listing(path, set(names)) is not None
+                changed = True
+            outputs = output_mtimes(path) if calculation else None
+            return (mtime, subdirs, calculation, changed, outputs), subdirs
+
+        visited = set()
+        directories = []
+        calculations = {}  # vaspdir: outputs
+        stale = []
+        for path, (mtime, subdirs, calculation, changed,
+                   outputs) in parallel_walk(root, visit, threads):
+            visited.add(path)
+            if changed:
+                directories.append((path, mtime, json.dumps(subdirs),
+                                    int(calculation)))
+            if calculation:
+                calculations[path] = outputs
+                old = indexed.get(path)
+                if (changed or old is None
+                    or old[0] in INDEX_VOLATILE_STATES
+                    or json.loads(old[1]) != outputs):
+                    stale.append(path)
+
+        # read the calculations that changed
+        rows = []
+        if stale:
+            pool = ThreadPool(max(1, min(threads, len(stale))))
+            try:
+                summaries = pool.map(read_calculation_summary, stale)
+                jobids = pool.map(_read_jobid, stale)
+            finally:
+                pool.close()
+            now = time.time()
+            for (vaspdir, state), jobid, summary in zip(status(stale),
+                                                        jobids, summaries):
+                rows.append((vaspdir, state, jobid) + summary
+                            + (json.dumps(calculations[vaspdir]), now))
+        nread += len(rows)
+
+        with con:
+            con.executemany('INSERT OR REPLACE INTO directories '
+                            'VALUES (?, ?, ?, ?)', directories)
+            con.executemany('INSERT OR REPLACE INTO calculations '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            # directories that are gone, or are no longer calculations
+            con.executemany('DELETE FROM directories WHERE path = ?',
+                            [(path,) for path in known
+                             if path not in visited])
+            con.executemany('DELETE FROM calculations WHERE vaspdir = ?',
+                            [(vaspdir,) for vaspdir in indexed
+                             if vaspdir not in calculations])
+        log.debug('indexed {0}: {1} directories, {2} calculations, {3} '
+                  'read'.format(root, len(visited), len(calculations),
+                                len(rows)))
+    return nread
+
+
+def _read_jobid(vaspdir):
+    try:
+        with open(os.path.join(vaspdir, 'jobid')) as f:
+            return f.readline().strip()
+    except IOError:
+        return None
+
+
+def list_calculations(root=None, state=None, db=None):
+    '''Return the rows of the index under root, with state if given.
+
+    Each row can be used like a dictionary with the keys in
+    INDEX_COLUMNS. The index is not refreshed.
+    '''
+    con = get_index_db(db)
+    conditions, args = [], ()
+    if root is not None:
+        where, args = _under(root, 'vaspdir')
+        conditions.append(where)
+    if state is not None:
+        conditions.append('state = ?')
+        args += (state,)
+    sql = 'SELECT * FROM calculations'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    return con.execute(sql + ' ORDER BY vaspdir', args).fetchall()
@@ -48,7 +48,7 @@ def write_kpoints(self, fname='KPOINTS'):
     else:
         MODE = 'c'
 
-    kpoints = open(fname, 'w')
+    kpoints = open(os.path.join(self.directory, fname), 'w')
     # line 1 - comment
     kpoints.write('KPOINTS created by Atomic Simulation Environment\n')
     # line 2 - number of kpts
@@ -100,7 +100,7 @@ Vasp.write_kpoints = write_kpoints
 
 def read_kpoints(self, filename='KPOINTS'):
     '''monkey patch to read all kpoint files'''
-    file = open(filename, 'r')
+    file = open(os.path.join(self.directory, filename), 'r')
     lines = file.readlines()
     file.close()
     # first line is a comment
@@ -198,12 +198,9 @@ def get_neb(self, npi=1):
         self.write_potcar()
         self.write_incar(self.neb_images[0])
         
-        if JASPRC['scheduler'].lower() == 'sge':
-            JASPRC['queue.nprocs'] = npi * self.neb_nimages
-            log.debug('Running on %i processors',JASPRC['queue.nprocs'])
-        elif JASPRC['scheduler'].lower() == 'pbs':
-            JASPRC['queue.nodes'] = npi * self.neb_nimages
-            log.debug('Running on %i nodes',JASPRC['queue.nodes'])
+        # SGE asks for processors, the others for nodes
+        get_scheduler().request_nodes(npi * self.neb_nimages)
+        log.debug('Running on %i nodes', npi * self.neb_nimages)
             
         self.run() # this will raise VaspSubmitted
 
@@ -316,14 +313,16 @@ def plot_neb(self, show=True):
 Vasp.plot_neb = plot_neb
 
 
-def read_neb_calculator():
-    '''Read calculator from the current working directory.
+def read_neb_calculator(directory='.'):
+    '''Read calculator from directory.
 
     Static method that returns a :mod:`jasp.Jasp` calculator.'''
-    log.debug('Entering read_neb_calculator in {0}'.format(os.getcwd()))
+    directory = os.path.abspath(directory)
+    log.debug('Entering read_neb_calculator in {0}'.format(directory))
 
     calc = Vasp()
-    calc.vaspdir = os.getcwd()
+    calc.vaspdir = directory
+    calc.directory = directory
     calc.read_incar()
     calc.read_kpoints()
 
@@ -339,11 +338,10 @@ def read_neb_calculator():
     # We add 2 to include the start and end images
     for i in range(calc.int_params['images'] + 2):
         log.debug('reading neb calculator: 0%i', i)
-        cwd = os.getcwd()
+        imagedir = os.path.join(directory, str(i).zfill(2))
 
-        os.chdir('{0}'.format(str(i).zfill(2)))
-        if os.path.exists('CONTCAR'):
-            f = open('CONTCAR')
+        if os.path.exists(os.path.join(imagedir, 'CONTCAR')):
+            f = open(os.path.join(imagedir, 'CONTCAR'))
             if f.read() == '':
                 log.debug('CONTCAR was empty, vasp probably still running')
                 fname = 'POSCAR'
@@ -352,9 +350,9 @@ def read_neb_calculator():
         else:
             fname = 'POSCAR'
 
-        atoms = read(fname, format='vasp')
+        atoms = read(os.path.join(imagedir, fname), format='vasp')
 
-        f = open('ase-sort.dat')
+        f = open(os.path.join(imagedir, 'ase-sort.dat'))
         sort, resort = [], []
         for line in f:
             s,r = [int(x) for x in line.split()]
@@ -362,14 +360,14 @@ def read_neb_calculator():
             resort.append(r)
 
         images += [atoms[resort]]
-        os.chdir(cwd)
 
     log.debug('len(images) = %i', len(images))
 
-    f = open('00/energy')
+    f = open(os.path.join(directory, '00', 'energy'))
     calc.neb_initial_energy = float(f.readline().strip())
     f.close()
-    f = open('{0}/energy'.format(str(len(images) - 1).zfill(2)))
+    f = open(os.path.join(directory, str(len(images) - 1).zfill(2),
+                          'energy'))
     calc.neb_final_energy = float(f.readline().strip())
     f.close()
 
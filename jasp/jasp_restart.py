@@ -0,0 +1,233 @@
+'''Lazy restart of finished calculations.
+
+Vasp(restart=True) reads the energy, forces, stress, dipole, fermi
+level, nbands, magnetic moments, version, number of iterations, sigma
+and number of electrons from the output files as soon as the
+calculator is created. Most of the time we only want one of
+these, e.g. the energy, so that is a lot of wasted reading.
+
+With JASPRC['restart.lazy'] = True, jasp restarts finished
+calculations without reading the results. Each result is read from the
+output files the first time it is accessed, and stored on the
+calculator after that.
+
+>>> JASPRC['restart.lazy'] = True
+>>> with jasp('some-dir') as calc:
+...     calc.get_atoms().get_potential_energy()  # only reads the energy
+'''
+
+from jasp import *
+import ase.io
+
+import logging
+log = logging.getLogger('Jasp')
+
+
+def _read_energy(self):
+    energy_free, energy_zero = self.read_energy()
+    return {'energy_free': energy_free,
+            'energy_zero': energy_zero}
+
+
+def _read_forces(self):
+    return {'forces': self.read_forces(self.atoms)}
+
+
+def _read_stress(self):
+    return {'stress': self.read_stress()}
+
+
+def _read_dipole(self):
+    return {'dipole': self.read_dipole()}
+
+
+def _read_fermi(self):
+    return {'fermi': self.read_fermi()}
+
+
+def _read_nbands(self):
+    return {'nbands': self.read_nbands()}
+
+
+def _read_magnetic_moment(self):
+    return {'magnetic_moment': self.read_magnetic_moment()}
+
+
+def _read_magnetic_moments(self):
+    p = self.int_params
+    q = self.list_params
+    if p['lorbit'] >= 10 or (p['lorbit'] is not None and q['rwigs']):
+        return {'magnetic_moments': self.read_magnetic_moments(self.atoms)}
+    else:
+        return {'magnetic_moments': None}
+
+def _read_version(self):
+    return {'version': self.read_version()}
+
+
+def _read_number_of_iterations(self):
+    return {'niter': self.read_number_of_iterations()}
+
+
+def _read_electronic_temperature(self):
+    return {'sigma': self.read_electronic_temperature()}
+
+
+def _read_number_of_electrons(self):
+    return {'nelect': self.read_number_of_electrons()}
+
+# attribute: function(calc) returning a dictionary of attributes read
+LAZY_RESULTS = {'energy_free': _read_energy,
+                'energy_zero': _read_energy,
+                'forces': _read_forces,
+                'stress': _read_stress,
+                'dipole': _read_dipole,
+                'fermi': _read_fermi,
+                'nbands': _read_nbands,
+                'magnetic_moment': _read_magnetic_moment,
+                'magnetic_moments': _read_magnetic_moments,
+                'version': _read_version,
+                'niter': _read_number_of_iterations,
+                'sigma': _read_electronic_temperature,
+                'nelect': _read_number_of_electrons}
+
+
+class LazyResult(object):
+    '''Descriptor for a result attribute of the Vasp calculator.
+
+    Values are stored in the instance dictionary like a normal
+    attribute. If there is no value yet and a reader was registered in
+    calc._lazy_results by :func:`lazy_restart_load`, the reader is
+    called on first access.
+    '''
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, calc, cls):
+        if calc is None:
+            return self
+        d = calc.__dict__
+        if self.name not in d:
+            reader = d.get('_lazy_results', {}).get(self.name)
+            if reader is None:
+                raise AttributeError(self.name)
+            log.debug('lazily reading %s', self.name)
+            for key, value in reader(calc).items():
+                d[key] = value
+                d['_lazy_results'].pop(key, None)
+        return d[self.name]
+
+    def __set__(self, calc, value):
+        calc.__dict__[self.name] = value
+        # an explicitly set value replaces the pending read
+        calc.__dict__.get('_lazy_results', {}).pop(self.name, None)
+
+    def __delete__(self, calc):
+        calc.__dict__.pop(self.name, None)
+
+for _name in LAZY_RESULTS:
+    setattr(Vasp, _name, LazyResult(_name))
+
+
+def read_contcar(self):
+    '''Return the atoms in the CONTCAR, in the order of the script.
+
+    Sets the sort and resort of the calculator from ase-sort.dat.
+    '''
+    sortfile = os.path.join(self.directory, 'ase-sort.dat')
+    contcar = os.path.join(self.directory, 'CONTCAR')
+    # Try to read sorting file
+    if os.path.isfile(sortfile):
+        self.sort = []
+        self.resort = []
+        with open(sortfile, 'r') as f:
+            for line in f:
+                data = line.split()
+                self.sort.append(int(data[0]))
+                self.resort.append(int(data[1]))
+        return ase.io.read(contcar, format='vasp')[self.resort]
+    atoms = ase.io.read(contcar, format='vasp')
+    self.sort = range(len(atoms))
+    self.resort = range(len(atoms))
+    return atoms
+
+
+def restart_load(self):
+    '''restart_load of ase, with the files in self.directory.'''
+    atoms = read_contcar(self)
+    self.atoms = atoms.copy()
+    self.read_incar()
+    self.read_outcar()
+    self.set_results(atoms)
+    if not self.float_params['kspacing']:
+        self.read_kpoints()
+    self.read_potcar()
+
+    self.old_input_params = self.input_params.copy()
+    self.converged = self.read_convergence()
+
+Vasp.restart_load = restart_load
+
+
+def lazy_restart_load(self):
+    '''Version of restart_load that does not read the results.
+
+    The atoms and input parameters are read as usual, but the results
+    are only read from the output files when they are first used. The
+    rest of what set_results does is done here.
+    '''
+    atoms = read_contcar(self)
+    self.atoms = atoms.copy()
+    self.positions = atoms.get_positions()
+    self.name = 'vasp'
+
+    self.read_incar()
+    if not self.float_params['kspacing']:
+        self.read_kpoints()
+    self.read_potcar()
+
+    # we take this from the INCAR instead of reading the OUTCAR
+    self.spinpol = self.int_params['ispin'] == 2
+
+    # the LDA+U parameters are compared in calculation_required, so
+    # they cannot wait.
+    if self.bool_params.get('ldau', None):
+        self.read_ldau()
+
+    results = dict(LAZY_RESULTS)
+    if not self.spinpol:
+        del results['magnetic_moment']
+        del results['magnetic_moments']
+
+    for name in results:
+        self.__dict__.pop(name, None)
+    self._lazy_results = results
+
+    self.old_float_params = self.float_params.copy()
+    self.old_exp_params = self.exp_params.copy()
+    self.old_string_params = self.string_params.copy()
+    self.old_int_params = self.int_params.copy()
+    self.old_input_params = self.input_params.copy()
+    self.old_bool_params = self.bool_params.copy()
+    self.old_list_params = self.list_params.copy()
+    self.old_dict_params = self.dict_params.copy()
+    # calculation_required reads this when it is needed
+    self.converged = None
+
+Vasp.lazy_restart_load = lazy_restart_load
+
+
+def restart_calculator(directory='.'):
+    '''Return a calculator restarted from directory.
+
+    The results are read lazily if JASPRC['restart.lazy'] is True.
+    '''
+    calc = Vasp()
+    calc.directory = directory
+    if JASPRC['restart.lazy']:
+        calc.lazy_restart_load()
+    else:
+        # like Vasp(restart=True), which loads the results
+        calc.restart = True
+        calc.restart_load()
+    return calc
@@ -0,0 +1,218 @@
+'''Classify many calculation directories without running jasp in them.
+
+Entering each directory with jasp and catching the exceptions runs the
+whole state machine, with queue queries and OUTCAR parsing, for every
+directory. status only looks at which files exist, the INCAR, and the
+tails of OUTCAR and OSZICAR, in a pool of threads. The queue is asked
+once for all directories.
+
+>>> table = status(dirs)
+>>> print table
+>>> table.select('finished-error')
+
+The states are:
+
+empty           no INCAR
+initialized     input files, but no job has been run
+queued          the job is waiting in the queue
+running         the job is running
+finished-ok     vasp finished and the calculation converged
+finished-error  vasp stopped before the end of the OUTCAR, or left no
+                output
+unconverged     vasp finished, but the electronic or ionic loop did not
+                converge
+'''
+
+import os
+from collections import Counter
+from multiprocessing.pool import ThreadPool
+from jasprc import JASPRC
+from outcar import read_outcar_tail
+from scheduler import get_job_states
+from discover import list_directory
+
+import logging
+log = logging.getLogger('Jasp')
+
+STATES = ['empty', 'initialized', 'queued', 'running',
+          'finished-ok', 'finished-error', 'unconverged']
+
+# scheduler states of a running job. PBS, SGE and slurm. Other states
+# except 'C' are counted as queued.
+RUNNING_STATES = ['R', 'E', 'r', 't', 'Rr', 'CG']
+
+# the files Jasp looks at to decide what to do in a directory
+SNAPSHOT_FILES = ['INCAR', 'jobid', 'CONTCAR', 'OUTCAR', 'vasprun.xml',
+                  'ase-sort.dat', 'METADATA', 'vdw_kernel.bindat']
+
+
+def directory_snapshot(vaspdir='.', names=SNAPSHOT_FILES):
+    '''Return {name: os.stat result} of the files names in vaspdir.
+
+    The directory is listed once, and only the names in the listing are
+    stat'ed. Files that do not exist, or are broken links, are not in
+    the dictionary, so name in snapshot is os.path.exists(name) at the
+    time of the snapshot.
+    '''
+    snapshot = {}
+    listing, subdirs = list_directory(os.path.abspath(vaspdir))
+    for name in set(listing).intersection(names):
+        try:
+            snapshot[name] = os.stat(os.path.join(vaspdir, name))
+        except OSError:
+            pass
+    return snapshot
+
+
+def read_incar_tags(fname='INCAR'):
+    '''Return {TAG: value string} from an INCAR without parsing it all.'''
+    tags = {}
+    with open(fname) as f:
+        for line in f:
+            line = line.split('!')[0].split('#')[0]
+            for statement in line.split(';'):
+                if '=' in statement:
+                    key, val = statement.split('=', 1)
+                    tags[key.strip().upper()] = val.strip()
+    return tags
+
+
+def read_oszicar_convergence(fname, nelm=60, nsw=0, ibrion=-1):
+    '''Return True if the last step in OSZICAR fname converged.
+
+    The electronic loop did not converge if the last ionic step took
+    nelm electronic steps. A relaxation did not converge if it took
+    nsw ionic steps. Only the tail of the file is read.
+    '''
+    lines = read_outcar_tail(nelm + 10, fname)
+    steps = [i for i, line in enumerate(lines) if ' F= ' in line]
+    if not steps:
+        return False
+    last = steps[-1]
+
+    electronic = [line for line in lines[:last]
+                  if line.split() and line.split()[0].endswith(':')]
+    if electronic and int(electronic[-1].split()[1]) >= nelm:
+        return False
+
+    if ibrion in [1, 2, 3] and nsw > 0:
+        if int(lines[last].split()[0]) >= nsw:
+            return False
+    return True
+
+
+def _output_state(vaspdir, incar):
+    '''Return the state of the output files in vaspdir.
+
+    One of initialized, finished-ok, finished-error or unconverged.
+    '''
+    outcar = os.path.join(vaspdir, 'OUTCAR')
+    if not os.path.exists(outcar):
+        return 'initialized'
+
+    lines = read_outcar_tail(20, outcar)
+    if not lines or 'Voluntary context switches' not in lines[-1]:
+        return 'finished-error'
+
+    contcar = os.path.join(vaspdir, 'CONTCAR')
+    if not os.path.exists(contcar) or os.path.getsize(contcar) == 0:
+        return 'finished-error'
+
+    oszicar = os.path.join(vaspdir, 'OSZICAR')
+    if os.path.exists(oszicar):
+        nsw = int(incar.get('NSW', 0))
+        ibrion = int(incar.get('IBRION', -1 if nsw in [0, 1] else 0))
+        if not read_oszicar_convergence(oszicar,
+                                        nelm=int(incar.get('NELM', 60)),
+                                        nsw=nsw, ibrion=ibrion):
+            return 'unconverged'
+    return 'finished-ok'
+
+
+def scan_directory(vaspdir):
+    '''Return (state, jobid) of vaspdir from its files only.
+
+    The state does not take the queue into account. jobid is None if
+    there is no jobid file.
+    '''
+    jobid = None
+    jobfile = os.path.join(vaspdir, 'jobid')
+    if os.path.exists(jobfile):
+        with open(jobfile) as f:
+            jobid = f.readline().strip()
+
+    # a workflow step waiting for its parents has only a jobid
+    if not os.path.exists(os.path.join(vaspdir, 'INCAR')):
+        return 'empty', jobid
+
+    incar = read_incar_tags(os.path.join(vaspdir, 'INCAR'))
+    if 'IMAGES' in incar:
+        # NEB. The output is in the image directories
+        nimages = int(incar['IMAGES'])
+        outdirs = [os.path.join(vaspdir, str(i).zfill(2))
+                   for i in range(1, nimages + 1)]
+    else:
+        outdirs = [vaspdir]
+
+    states = [_output_state(d, incar) for d in outdirs]
+    for state in ['finished-error', 'unconverged', 'initialized']:
+        if state in states:
+            return state, jobid
+    return 'finished-ok', jobid
+
+
+class StatusTable(list):
+    '''A list of (vaspdir, state) tuples that prints as a table.'''
+
+    def counts(self):
+        '''Return {state: number of directories}.'''
+        return dict(Counter(state for vaspdir, state in self))
+
+    def select(self, *states):
+        '''Return the directories in any of states.'''
+        return [vaspdir for vaspdir, state in self if state in states]
+
+    def __str__(self):
+        width = max(len(state) for state in STATES)
+        s = ['{0:{1}s} {2}'.format(state, width, vaspdir)
+             for vaspdir, state in self]
+        counts = self.counts()
+        s += [', '.join('{0} {1}'.format(counts[state], state)
+                        for state in STATES if state in counts)]
+        return '\n'.join(s)
+
+
+def status(dirs, threads=None):
+    '''Return a StatusTable with the state of each directory in dirs.
+
+    The directories are scanned in threads (default
+    JASPRC['status.threads']), and the queue is queried once if any of
+    them has a jobid.
+    '''
+    dirs = list(dirs)
+    if threads is None:
+        threads = int(JASPRC.get('status.threads', 8))
+
+    pool = ThreadPool(max(1, min(threads, len(dirs))))
+    try:
+        scans = pool.map(scan_directory, dirs)
+    finally:
+        pool.close()
+
+    jobs = {}
+    jobids = [jobid for state, jobid in scans if jobid is not None]
+    if jobids:
+        jobs = get_job_states(jobids)
+
+    table = StatusTable()
+    for vaspdir, (state, jobid) in zip(dirs, scans):
+        job_state = jobs.get(jobid)
+        if job_state in RUNNING_STATES:
+            state = 'running'
+        elif job_state not in [None, 'C']:
+            state = 'queued'
+        elif jobid is not None and state in ['empty', 'initialized']:
+            # the job is gone, and did not leave an OUTCAR
+            state = 'finished-error'
+        table.append((vaspdir, state))
+    return table
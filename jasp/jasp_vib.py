@@ -41,12 +41,13 @@ def get_vibrational_modes(self,
     Note: it seems like it might be much easier to get this out of
     vasprun.xml
     '''
+    outcar = os.path.join(self.directory, 'OUTCAR')
     atoms = self.get_atoms()
 
     if hasattr(atoms, 'constraints') and self.int_params['ibrion'] == 5:
         # count how many modes to get.
         NMODES = 0
-        f = open('OUTCAR')
+        f = open(outcar)
         for line in f:
             if ('f' in line and 'THz' in line and 'cm-1' in line):
                 NMODES += 1
@@ -61,12 +62,9 @@ def get_vibrational_modes(self,
     always come first. if nwrite=3, then there are sqrt(mass) weighted
     vectors that follow this section
     '''
-    f = open('OUTCAR', 'r')
-    while True:
-        line = f.readline()
-        if line.startswith(' Eigenvectors and eigenvalues'
-                           ' of the dynamical matrix'):
-            break
+    f = open(outcar, 'r')
+    f.seek(get_outcar_offsets('eigenvectors', outcar)[0])
+    f.readline()   # the Eigenvectors and eigenvalues line
     f.readline()   # skip ------
     f.readline()   # skip two blank lines
     f.readline()
@@ -154,18 +152,15 @@ def get_vibrational_frequencies(self):
     You should have run the calculation already. This function does not
     run a calculation.
     '''
-
+    outcar = os.path.join(self.directory, 'OUTCAR')
     atoms = self.get_atoms()
     N = len(atoms)
 
     frequencies = []
 
-    f = open('OUTCAR', 'r')
-    while True:
-        line = f.readline()
-        if line.startswith(' Eigenvectors and eigenvalues'
-                           ' of the dynamical matrix'):
-            break
+    f = open(outcar, 'r')
+    f.seek(get_outcar_offsets('eigenvectors', outcar)[0])
+    f.readline()  # the Eigenvectors and eigenvalues line
     f.readline()  # skip ------
     f.readline()  # skip two blank lines
     f.readline()
@@ -200,31 +195,26 @@ def get_infrared_intensities(self):
     2011-03-25, ICIQ Tarragona, Spain (www.iciq.es)
     http://homepage.univie.ac.at/david.karhanek/downloads.html#Entry02
     '''
-    atoms = read('POSCAR', format='vasp')
+    outcar = os.path.join(self.directory, 'OUTCAR')
+    atoms = read(os.path.join(self.directory, 'POSCAR'), format='vasp')
     NIONS = len(atoms)
     BORN_NROWS = NIONS*4 + 1
 
-    with open('OUTCAR', 'r') as f:
-        alltext = f.read()
-        f.seek(0)
-        alllines = f.readlines()
-        f.close()
-
-    if 'BORN' not in alltext:
+    born_offsets = get_outcar_offsets('born_charges', outcar)
+    if not born_offsets:
         raise Exception('Born effective charges missing. '
                         'Did you use IBRION=7 or 8?')
 
-    if 'Eigenvectors after division by SQRT(mass)' not in alltext:
+    eig_offsets = get_outcar_offsets('sqrt_mass_eigenvectors', outcar)
+    if not eig_offsets:
         raise Exception('You must rerun with NWRITE=3 to get '
                         'sqrt(mass) weighted eigenvectors')
 
     # get the Born charges
-    for i, line in enumerate(alllines):
-        if 'BORN EFFECTIVE CHARGES' in line:
-            break
+    alllines = read_outcar_lines(born_offsets[0], 3 + 4 * NIONS, outcar)
 
     BORN_MATRICES = []
-    i += 2  # skip a line
+    i = 2  # skip a line
     for j in range(NIONS):
         BM = []
         i += 1  # skips the ion count line
@@ -244,9 +234,8 @@ def get_infrared_intensities(self):
     # tell.
 
     # the next code in the shell script just copies code to eigenvectors.txt
-    for i, line in enumerate(alllines):
-        if 'Eigenvectors after division by SQRT(mass)' in line:
-            break
+    alllines = list(iter_outcar_lines(eig_offsets[0], outcar))
+    i = 0
 
     EIG_NVIBS = 0
     for line in alllines[i:]:
@@ -22,7 +22,7 @@ import os
 
 # default settings
 
-JASPRC = {'scheduler':'PBS', #other option is 'SGE'
+JASPRC = {'scheduler':'PBS', #other options are 'SGE', 'Slurm' and 'local'
           'vasp.executable.serial':
           '/opt/kitchingroup/vasp-5.3.5/bin/vasp-vtst-serial-beef',
           'vasp.executable.parallel':
@@ -37,7 +37,32 @@ JASPRC = {'scheduler':'PBS', #other option is 'SGE'
           'queue.jobname': 'None',
           'multiprocessing.cores_per_process': 'None',
           'vdw_kernel.bindat': '/opt/kitchingroup/vasp-5.3.5/vdw_kernel.bindat',
-          'restart_unconverged': True
+          'restart_unconverged': True,
+          'restart.lazy': False,  # read results only when they are used
+          'cache.results': True,  # cache read results in .jasp-cache
+          'cache.db': 'None',  # path to a shared sqlite results cache
+          'cache.db.size': 1000000000,  # bytes before old entries are evicted
+          'cache.db.timeout': 30,  # seconds to wait for a locked database
+          'cache.db.touch': 3600,  # seconds before a hit updates its access time
+          'potcar.index': '~/.jasp-potcars.json',  # see jasppotcars
+          'queue.status.ttl': 30,  # seconds to reuse a snapshot of the queue
+          'queue.slurm.options': '',  # extra options for sbatch
+          'local.workers': 'None',  # jobs the local scheduler runs at once
+          'run.cores': 'None',  # cores to run calculations on in mode='run'
+          'run.cores_per_job': 1,  # cores for each calculation in mode='run'
+          'status.threads': 8,  # threads jasp.status reads directories with
+          'memory.table': '~/.jasp-memory.jsonl',  # calibrates the memory model
+          'memory.safety': 1.2,  # factor on the estimated memory
+          'memory.probe': False,  # run vasp to get the memory instead
+          'walltime.history': '~/.jasp-walltime.jsonl',  # finished runs
+          'walltime.min_records': 5,  # runs before the walltime is predicted
+          'walltime.safety': 2.0,  # factor on the predicted walltime
+          'parallel.auto': False,  # choose KPAR, NCORE and NSIM at submission
+          'parallel.npar': False,  # choose NPAR instead of NCORE, for VASP 4
+          'recovery.auto': False,  # fix failed jobs in runjasp.py and resubmit
+          'recovery.max_attempts': 3,  # resubmissions per directory
+          'discover.threads': 16,  # threads that list directories
+          'index.db': '~/.jasp-index.sqlite',  # see jaspindex
           }
 
 
@@ -0,0 +1,265 @@
+'''Estimate the memory of a vasp calculation without running vasp.
+
+get_required_memory used to run vasp for up to 20 s to read the memory
+estimate vasp prints at the top of the OUTCAR. Instead we predict it
+from the same quantities vasp uses:
+
+base           a constant per core
+wavefunctions  NKPTS * NBANDS * plane waves * ISPIN / cores
+grids          NGXF * NGYF * NGZF * ISPIN
+projectors     NIONS * plane waves / cores, or NIONS with LREAL
+
+Before a calculation is run these are estimated from the cell, ENCUT,
+PREC, k-points and POTCARs. The memory per term starts from rough
+default coefficients, and is calibrated on a table of finished
+calculations (JASPRC['memory.table']), where the quantities and the
+memory vasp reported are read from the OUTCAR. Calculations are added
+to the table when get_required_memory finds an OUTCAR, or with
+add_memory_record. The table is a table of records.py, so processes
+adding records at the same time do not lose each other's.
+
+>>> add_memory_record('some/calc/OUTCAR')
+>>> estimate_memory(calc)  # kB per core
+'''
+
+import os
+import re
+import numpy as np
+from jasprc import JASPRC
+from POTCAR import get_potcar_info
+from records import append_record, read_records
+
+import logging
+log = logging.getLogger('Jasp')
+
+MEMORY_TERMS = ['base', 'wavefunctions', 'grids', 'projectors']
+
+# kB per unit of each term, before calibration
+MEMORY_COEFFICIENTS = np.array([30000., 0.032, 0.16, 0.3])
+
+# hbar^2 / 2m_e in eV A^2
+HBAR2_2M = 3.80998
+
+# size of the coarse FFT grid in units of the diameter of the cutoff
+# sphere, and of the fine grid in units of the coarse grid
+GRID_FACTORS = {'low': 1.5, 'medium': 1.5, 'normal': 1.5, 'single': 1.5,
+                'accurate': 2.0, 'high': 2.0}
+FINE_GRID_FACTOR = 2
+
+# (pattern, key, type) of the quantities in the OUTCAR header
+OUTCAR_PARAMETERS = [(r'NKPTS\s*=\s*(\d+)', 'nkpts', int),
+                     (r'NBANDS\s*=\s*(\d+)', 'nbands', int),
+                     (r'NIONS\s*=\s*(\d+)', 'nions', int),
+                     (r'NGXF\s*=\s*(\d+)\s*NGYF\s*=\s*(\d+)\s*NGZF\s*=\s*(\d+)',
+                      'ngf', None),
+                     (r'ISPIN\s*=\s*(\d+)', 'ispin', int),
+                     (r'LREAL\s*=\s*(\w)', 'lreal', None),
+                     (r'maximum number of plane-waves:\s*(\d+)', 'npw', int),
+                     (r'running on\s+(\d+)', 'ncores', int)]
+
+_memory_line = re.compile(r'total amount of memory used by VASP.*?'
+                          r'([0-9.]+)\s*kBytes')
+
+# fname: (mtime, coefficients)
+_memory_model_cache = {}
+
+
+def read_memory_parameters(fname='OUTCAR'):
+    '''Return the memory and the quantities it depends on from fname.
+
+    Only the header of the OUTCAR, up to the line with the memory vasp
+    needs, is read. Returns a dictionary with memory in kB, or None if
+    the memory line is not there.
+    '''
+    params = {'ncores': 1}
+    with open(fname) as f:
+        for line in f:
+            m = _memory_line.search(line)
+            if m:
+                params['memory'] = float(m.group(1))
+                break
+            for pattern, key, type_ in OUTCAR_PARAMETERS:
+                if key in params and key != 'ncores':
+                    continue
+                m = re.search(pattern, line)
+                if m is None:
+                    continue
+                if key == 'ngf':
+                    params[key] = int(np.prod([int(x) for x in m.groups()]))
+                elif key == 'lreal':
+                    params[key] = m.group(1) in ['T', 'A']
+                else:
+                    params[key] = type_(m.group(1))
+        else:
+            return None
+    return params
+
+
+def memory_terms(params):
+    '''Return the array of MEMORY_TERMS for the quantities in params.'''
+    ncores = float(params.get('ncores', 1))
+    ispin = params.get('ispin', 1)
+    if params.get('lreal', False):
+        projectors = params['nions']
+    else:
+        projectors = params['nions'] * params['npw'] / ncores
+    return np.array([1.0,
+                     (params['nkpts'] * params['nbands'] * params['npw']
+                      * ispin / ncores),
+                     params['ngf'] * ispin,
+                     projectors])
+
+
+def get_memory_table_file():
+    '''Return the path of the memory table, or None if there is none.'''
+    fname = JASPRC.get('memory.table', 'None')
+    if fname in [None, 'None']:
+        return None
+    return os.path.expanduser(fname)
+
+
+def read_memory_table():
+    '''Return {directory: parameters} of the memory table.'''
+    fname = get_memory_table_file()
+    if fname is None:
+        return {}
+    return read_records(fname)
+
+
+def add_memory_record(fname='OUTCAR'):
+    '''Add the memory and quantities in the OUTCAR fname to the table.
+
+    Returns the parameters, or None if fname has no memory line. An
+    OUTCAR without all the quantities of the model is not added.
+    '''
+    table_file = get_memory_table_file()
+    params = read_memory_parameters(fname)
+    if (params is None or table_file is None
+        or not all(key in params for key in ['nkpts', 'nbands', 'nions',
+                                             'ngf', 'npw'])):
+        return params
+
+    append_record(table_file, os.path.dirname(os.path.abspath(fname)),
+                  params)
+    return params
+
+
+def fit_memory_model(records):
+    '''Return the kB per unit of each of MEMORY_TERMS for records.
+
+    records is a list of parameter dictionaries with the memory. With
+    enough records each term is scaled by a least squares fit, with
+    fewer all terms are scaled by one factor, and with none the default
+    MEMORY_COEFFICIENTS are returned.
+    '''
+    if not records:
+        return MEMORY_COEFFICIENTS
+
+    X = np.array([memory_terms(r) * MEMORY_COEFFICIENTS for r in records])
+    y = np.array([r['memory'] for r in records])
+
+    if len(records) >= 2 * len(MEMORY_TERMS):
+        scale = np.linalg.lstsq(X, y, rcond=-1)[0]
+        if (scale > 0).all():
+            return MEMORY_COEFFICIENTS * scale
+
+    return MEMORY_COEFFICIENTS * np.median(y / X.sum(axis=1))
+
+
+def get_memory_model():
+    '''Return the coefficients calibrated on the memory table.
+
+    The fit is cached until the table changes.
+    '''
+    fname = get_memory_table_file()
+    if fname is None or not os.path.exists(fname):
+        return MEMORY_COEFFICIENTS
+    mtime = os.stat(fname).st_mtime
+    cached = _memory_model_cache.get(fname)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, fit_memory_model(read_memory_table().values()))
+        _memory_model_cache[fname] = cached
+    return cached[1]
+
+
+def _fft_size(n):
+    '''Return the smallest n' >= n with only the factors 2, 3, 5 and 7.'''
+    n = int(np.ceil(n))
+    while True:
+        m = n
+        for p in [2, 3, 5, 7]:
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return n
+        n += 1
+
+
+def estimate_memory_parameters(calc, ncores=None):
+    '''Return the quantities vasp would print for calc, before it runs.
+
+    ncores defaults to JASPRC['queue.nodes'] * JASPRC['queue.ppn'].
+    '''
+    atoms = calc.get_atoms()
+    calc.get_pseudopotentials()  # sets ppp_list and symbol_count
+    infos = [get_potcar_info(ppp) for ppp in calc.ppp_list]
+    nelect = sum(info['ZVAL'] * count
+                 for info, (symbol, count) in zip(infos, calc.symbol_count))
+
+    encut = calc.float_params.get('encut')
+    if encut is None:
+        encut = max(info['ENMAX'] for info in infos)
+    gcut = np.sqrt(encut / HBAR2_2M)
+
+    prec = (calc.string_params.get('prec') or 'normal').lower()
+    factor = GRID_FACTORS.get(prec, 1.5)
+    lengths = np.sqrt((atoms.get_cell() ** 2).sum(axis=1))
+    ngf = np.prod([FINE_GRID_FACTOR * _fft_size(factor * gcut * a / np.pi)
+                   for a in lengths])
+
+    # plane waves inside the cutoff sphere
+    npw = int(np.ceil(atoms.get_volume() * gcut ** 3 / (6 * np.pi ** 2)))
+
+    nions = len(atoms)
+    nbands = calc.int_params.get('nbands')
+    if nbands is None:
+        # the vasp default
+        nbands = int(max(np.ceil(nelect / 2. + nions / 2.),
+                         np.ceil(0.6 * nelect)))
+
+    ibzkpt = os.path.join(calc.directory, 'IBZKPT')
+    if os.path.exists(ibzkpt):
+        with open(ibzkpt) as f:
+            f.readline()
+            nkpts = int(f.readline().split()[0])
+    else:
+        kpts = calc.input_params.get('kpts')
+        if kpts is None:
+            nkpts = 1
+        elif np.array(kpts).ndim == 1:
+            # symmetry is unknown, so only count time reversal
+            nkpts = (int(np.prod(kpts)) + 1) // 2
+        else:
+            nkpts = len(kpts)
+
+    if ncores is None:
+        ncores = int(JASPRC['queue.nodes']) * int(JASPRC['queue.ppn'])
+
+    lreal = calc.special_params.get('lreal')
+    return {'nkpts': nkpts,
+            'nbands': nbands,
+            'nions': nions,
+            'encut': encut,
+            'ngf': int(ngf),
+            'npw': npw,
+            'ispin': calc.int_params.get('ispin') or 1,
+            'lreal': lreal not in [None, False],
+            'ncores': ncores}
+
+
+def estimate_memory(calc, ncores=None):
+    '''Return the estimated memory per core of calc in kB.'''
+    params = estimate_memory_parameters(calc, ncores)
+    memory = np.dot(get_memory_model(), memory_terms(params))
+    log.debug('estimated memory {0:1.0f} kB for {1}'.format(memory, params))
+    return memory
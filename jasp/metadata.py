@@ -34,8 +34,10 @@ def create_metadata(self, fname='METADATA'):
     '''Create the METADATA file.
 
     we do not overwrite metadata files with this command. you should
-    delete the file and recreate it.
+    delete the file and recreate it. fname is relative to the directory
+    of the calculator.
     '''
+    fname = os.path.join(self.directory, fname)
     if os.path.exists(fname):
         return None
 
@@ -100,7 +102,7 @@ def write_metadata(self, fname='METADATA'):
     :param str fname: filename to write metadata to. default=METADATA
     :returns: None
     """
-
+    fname = os.path.join(self.directory, fname)
     f = open(fname, 'w')
     f.write(json.dumps(self.metadata))
     f.close()
@@ -113,6 +115,7 @@ def read_metadata(self, fname='METADATA'):
     Sets metadata attribute on calculator, which is a dictionary of
     information.
     '''
+    fname = os.path.join(self.directory, fname)
     if not os.path.exists(fname):
         self.metadata = {}
         return
@@ -0,0 +1,284 @@
+'''Module to index the sections of an OUTCAR file.
+
+The OUTCAR of a relaxation or MD run can be hundreds of MB, and many
+of the getters in jasp only need one block of it. Rather than having
+each getter read the whole file and scan it, we scan the file once,
+record the byte offset of every line that starts a known section, and
+let the getters seek straight to the block they need.
+
+>>> offsets = get_outcar_offsets('elapsed_time')
+>>> lines = read_outcar_lines(offsets[-1], 1)
+
+The index is cached in memory, and in a small sidecar file
+(.jasp-outcar.idx) next to the OUTCAR so that other processes do not
+need to scan the file again. Both are keyed on the inode, size and
+modification time of the OUTCAR, so the index is rebuilt automatically
+when the OUTCAR changes.
+'''
+
+import json
+import mmap
+import os
+import re
+import thread
+
+# section name: regular expression matching the first line of the
+# section. The expressions are searched on the bytes of the OUTCAR in
+# multiline mode, so ^ matches at the start of each line.
+OUTCAR_SECTIONS = {
+    'energy': r'^  free energy    TOTEN  =',
+    'forces': r'TOTAL-FORCE',
+    'born_charges': r'BORN EFFECTIVE CHARGES',
+    'dielectric_tensor': r'^ MACROSCOPIC STATIC DIELECTRIC TENSOR',
+    'piezoelectric_tensor': r'^ PIEZOELECTRIC TENSOR',
+    'elastic_moduli': r'^ TOTAL ELASTIC MODULI',
+    'beefens': r'BEEFens',
+    'nearest_neighbor_table': r'nearest neighbor table',
+    'occupations': r'^ total charge ',
+    'eigenvectors': r'^ Eigenvectors and eigenvalues of the dynamical matrix',
+    'sqrt_mass_eigenvectors': r'Eigenvectors after division by SQRT\(mass\)',
+    'elapsed_time': r'Elapsed time \(sec\)'}
+
+_section_regexps = dict((key, re.compile(pattern, re.M))
+                        for key, pattern in OUTCAR_SECTIONS.items())
+
+_scanner = re.compile('|'.join('(?:{0})'.format(pattern)
+                               for pattern in OUTCAR_SECTIONS.values()),
+                      re.M)
+
+# (error kind, regular expression) for the lines checkerr_vasp reports.
+# adapted from atat code
+OUTCAR_ERRORS = [
+    ('segfault', r'forrtl: severe'),
+    ('highest band occupied',
+     r'highest band is occupied at some k-points!'),
+    ('warning', r'rrrr'),  # I think this is from Warning spelled out
+                           # in ascii art
+    ('cnorm', r'cnorm'),
+    ('failed', r'failed'),
+    ('non-integer', r'non-integer'),
+    ('bands changed', r'The number of bands has been changed from the '
+                      r'values supplied')]
+
+_error_regexps = [(kind, re.compile(pattern))
+                  for kind, pattern in OUTCAR_ERRORS]
+
+_error_scanner = re.compile('|'.join('(?:{0})'.format(pattern)
+                                     for kind, pattern in OUTCAR_ERRORS))
+
+# name of the file the index is stored in, in the OUTCAR directory
+OUTCAR_INDEX_FILE = '.jasp-outcar.idx'
+
+# abspath: (fingerprint, index)
+_outcar_index_cache = {}
+
+
+def outcar_fingerprint(fname='OUTCAR'):
+    '''Return (inode, size, mtime) of fname.
+
+    This is used to decide if data derived from fname is still valid.
+    '''
+    st = os.stat(fname)
+    return (st.st_ino, st.st_size, st.st_mtime)
+
+
+def _iter_matching_lines(fname, scanner, count_lines=False):
+    '''Yield (lineno, offset, line) for each line of fname scanner matches.
+
+    The whole file is searched in one pass over an mmap of it. Each
+    line is yielded once, even if scanner matches it more than once.
+    lineno starts at 1, and is None unless count_lines is True.
+    '''
+    with open(fname, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # mmap cannot map an empty file
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            last_line = -1
+            lineno, counted = 1, 0
+            for match in scanner.finditer(mm):
+                start = mm.rfind('\n', 0, match.start()) + 1
+                if start == last_line:
+                    # more than one match on this line
+                    continue
+                last_line = start
+
+                end = mm.find('\n', match.end())
+                if end == -1:
+                    end = len(mm)
+
+                if count_lines:
+                    lineno += mm[counted:start].count('\n')
+                    counted = start
+                    yield lineno, start, mm[start:end]
+                else:
+                    yield None, start, mm[start:end]
+        finally:
+            mm.close()
+
+
+def index_outcar(fname='OUTCAR'):
+    '''Scan fname once and return a dictionary of section offsets.
+
+    The keys are the keys of OUTCAR_SECTIONS, and each value is a list
+    of the byte offsets of the lines starting that section, in the
+    order they appear in the file.
+    '''
+    index = dict((key, []) for key in OUTCAR_SECTIONS)
+
+    for lineno, offset, line in _iter_matching_lines(fname, _scanner):
+        for key, regexp in _section_regexps.items():
+            if regexp.search(line):
+                index[key].append(offset)
+
+    return index
+
+
+def scan_outcar_errors(fname='OUTCAR'):
+    '''Scan fname once for the lines in OUTCAR_ERRORS.
+
+    Returns a list of (kind, lineno, offset, line) in the order they
+    appear in the file. A line with more than one kind of error is
+    reported once for each kind.
+    '''
+    errors = []
+    for lineno, offset, line in _iter_matching_lines(fname, _error_scanner,
+                                                     count_lines=True):
+        for kind, regexp in _error_regexps:
+            if regexp.search(line):
+                errors.append((kind, lineno, offset, line))
+    return errors
+
+
+def read_outcar_index_file(fname='OUTCAR'):
+    '''Return the index stored in the sidecar file of fname.
+
+    Returns None if there is no sidecar file, or if it does not match
+    the current fname or OUTCAR_SECTIONS.
+    '''
+    idxfile = os.path.join(os.path.dirname(fname), OUTCAR_INDEX_FILE)
+    try:
+        with open(idxfile) as f:
+            d = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if (d.get('fingerprint') != list(outcar_fingerprint(fname))
+        or d.get('sections') != OUTCAR_SECTIONS):
+        return None
+
+    return d['index']
+
+
+def write_outcar_index_file(index, fname='OUTCAR'):
+    '''Store index in the sidecar file of fname.
+
+    The directory may not be writable, e.g. on a read-only project
+    share. Then we silently do not store the index.
+    '''
+    idxfile = os.path.join(os.path.dirname(fname), OUTCAR_INDEX_FILE)
+    d = {'fingerprint': list(outcar_fingerprint(fname)),
+         'sections': OUTCAR_SECTIONS,
+         'index': index}
+
+    # write to a temporary file and rename it so other processes and
+    # threads never read a partially written index.
+    tmpfile = '{0}.{1}.{2}'.format(idxfile, os.getpid(), thread.get_ident())
+    try:
+        with open(tmpfile, 'w') as f:
+            json.dump(d, f)
+        os.rename(tmpfile, idxfile)
+    except (IOError, OSError):
+        if os.path.exists(tmpfile):
+            os.unlink(tmpfile)
+
+
+def get_outcar_index(fname='OUTCAR'):
+    '''Return the section index of fname.
+
+    The index is read from memory, or the sidecar file, and is only
+    computed if fname has changed since it was last indexed.
+    '''
+    key = os.path.abspath(fname)
+    fingerprint = outcar_fingerprint(fname)
+
+    cached = _outcar_index_cache.get(key)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+
+    index = read_outcar_index_file(fname)
+    if index is None:
+        index = index_outcar(fname)
+        write_outcar_index_file(index, fname)
+
+    _outcar_index_cache[key] = (fingerprint, index)
+    return index
+
+
+def get_outcar_offsets(section, fname='OUTCAR'):
+    '''Return the list of byte offsets where section starts in fname.'''
+    return get_outcar_index(fname)[section]
+
+
+def iter_outcar_lines(offset, fname='OUTCAR'):
+    '''Yield the lines of fname starting at the byte offset.'''
+    with open(fname, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            yield line
+
+
+def read_outcar_lines(offset, nlines, fname='OUTCAR'):
+    '''Return a list of nlines lines of fname starting at offset.
+
+    Fewer lines are returned if the end of the file is reached.
+    '''
+    lines = []
+    with open(fname, 'rb') as f:
+        f.seek(offset)
+        for i in range(nlines):
+            line = f.readline()
+            if line == '':
+                break
+            lines.append(line)
+    return lines
+
+
+def read_outcar_lines_before(offset, nlines, fname='OUTCAR',
+                             blocksize=4096):
+    '''Return a list of the nlines lines of fname that precede offset.
+
+    offset should be the start of a line, e.g. from the index.
+    '''
+    if nlines <= 0:
+        return []
+
+    blocks = []
+    count = 0
+    with open(fname, 'rb') as f:
+        start = offset
+        # read backwards a block at a time until we have enough lines,
+        # or the file start
+        while start > 0 and count <= nlines:
+            end = start
+            start = max(0, start - blocksize)
+            f.seek(start)
+            blocks.append(f.read(end - start))
+            count += blocks[-1].count('\n')
+
+    lines = ''.join(reversed(blocks)).splitlines(True)
+    if start > 0:
+        # the first line is probably incomplete
+        lines = lines[1:]
+    return lines[-nlines:]
+
+
+def read_outcar_tail(nlines, fname='OUTCAR', blocksize=4096):
+    '''Return a list of the last nlines lines of fname.
+
+    The file is read backwards from the end in blocks, so this costs
+    about the same for any size of file.
+    '''
+    size = os.path.getsize(fname)
+    return read_outcar_lines_before(size, nlines, fname, blocksize)
@@ -0,0 +1,271 @@
+'''Choose the VASP parallelization tags for the cores a job runs on.
+
+Jobs used to run mpirun -np NPROCS with the VASP defaults, where every
+core works on every band of every k-point (NCORE=1, KPAR=1). That scales
+poorly past a few cores. Before a job is submitted, set_parallelization
+chooses
+
+KPAR   k-point groups. A divisor of the cores, at most the number of
+       irreducible k-points, and one that divides them evenly if it can
+NCORE  cores working on one band, about the square root of the cores in
+       a k-point group, and never more than the cores on a node
+NSIM   bands optimized at once by RMM-DIIS (ALGO = Fast or VeryFast)
+
+VASP rounds NBANDS up to a multiple of the number of band groups (the
+cores in a k-point group / NCORE). If you set NBANDS, only NCOREs with
+a number of band groups that divides NBANDS are used, so VASP does not
+change the bands and vasp_changed_bands has nothing to warn about.
+
+The choice is refined with the time per electronic step of similar
+calculations in the walltime history (see walltime.py). When similar
+calculations on the same cores ran with different KPAR and NCORE, the
+fastest setting is used.
+
+The tags are chosen for the cores the calculation runs on. That is the
+whole job, except with JASPRC['multiprocessing.cores_per_process'] on
+one node, and for the directories of a task farm, which run on
+cores_per_task cores each.
+
+This is off by default. Set JASPRC['parallel.auto'] = True to use it.
+The tags jasp chose are recorded in .jasp-parallel in the calculation
+directory, so they are chosen again when the calculation is submitted
+on other cores. Tags you set yourself, in the script or in an INCAR
+jasp did not write them to, are never changed.
+
+NPAR is the number of band groups, cores in a k-point group / NCORE,
+so it is the same choice as NCORE. VASP 4 knows neither NCORE nor
+KPAR. With JASPRC['parallel.npar'] = True jasp writes NPAR instead of
+NCORE, and uses one k-point group. A NPAR you set yourself is kept,
+like the other tags.
+'''
+
+import json
+import os
+import numpy as np
+from jasprc import JASPRC
+from memory import estimate_memory_parameters
+from walltime import read_walltime_history
+
+import logging
+log = logging.getLogger('Jasp')
+
+PARALLEL_TAGS = ['npar', 'ncore', 'kpar', 'nsim']
+
+# the tags set_parallelization chose, in the calculation directory
+PARALLEL_FILE = '.jasp-parallel'
+
+# calculations are similar if nkpts, nbands and nions are within this
+# factor of each other
+SIMILAR_FACTOR = 1.5
+
+
+def divisors(n):
+    '''Return the divisors of n in increasing order.'''
+    return [i for i in range(1, n + 1) if n % i == 0]
+
+
+def choose_kpar(nkpts, ncores):
+    '''Return the number of k-point groups for nkpts on ncores.
+
+    The most groups that keep the k-points balanced and leave at least
+    four cores in a group.
+    '''
+    best = 1
+    for kpar in divisors(ncores):
+        if kpar > nkpts or ncores // kpar < min(4, ncores):
+            break
+        # fraction of the k-point passes that are not idle
+        balance = float(nkpts) / (kpar * -(-nkpts // kpar))
+        if balance >= 0.8:
+            best = kpar
+    return best
+
+
+def choose_ncore(cores, ppn, nbands=None):
+    '''Return NCORE for a k-point group of cores.
+
+    ppn is the number of cores on a node. If nbands is given, the
+    number of band groups cores / NCORE must divide it.
+    '''
+    candidates = [ncore for ncore in divisors(cores)
+                  if ncore <= ppn
+                  and (nbands is None or nbands % (cores // ncore) == 0)]
+    if not candidates:
+        # one band group always divides the bands
+        return cores
+    return min(candidates,
+               key=lambda ncore: (abs(np.log(ncore) - np.log(cores) / 2),
+                                  ppn % ncore))
+
+
+def choose_nsim(nbands, npar, algo='normal'):
+    '''Return NSIM, or None if the algorithm does not use RMM-DIIS.'''
+    if algo.lower() not in ['fast', 'veryfast', 'very_fast']:
+        return None
+    bands = -(-nbands // npar)  # per band group
+    if bands >= 16:
+        return 4
+    elif bands >= 4:
+        return 2
+    return 1
+
+
+def is_valid(kpar, ncore, nkpts, ncores, ppn, nbands=None):
+    '''Return True if kpar and ncore can be used for the problem.'''
+    if kpar > nkpts or ncores % kpar:
+        return False
+    cores = ncores // kpar
+    if cores % ncore or ncore > ppn:
+        return False
+    return nbands is None or nbands % (cores // ncore) == 0
+
+
+def measured_parallelization(params, ncores, records=None):
+    '''Return the fastest (kpar, ncore) of similar calculations, or None.
+
+    params has the nkpts, nbands and nions of the calculation. records
+    defaults to the walltime history. The time per electronic step is
+    compared per unit of nkpts * nbands * nions, and only if similar
+    calculations ran with at least two settings.
+    '''
+    if records is None:
+        records = read_walltime_history().values()
+
+    times = {}
+    for r in records:
+        if r.get('ncores') != ncores or 'loop' not in r:
+            continue
+        if not all(1. / SIMILAR_FACTOR <= float(r[key]) / params[key]
+                   <= SIMILAR_FACTOR
+                   for key in ['nkpts', 'nbands', 'nions']):
+            continue
+        size = r['nkpts'] * r['nbands'] * r['nions']
+        setting = (r.get('kpar', 1), r.get('ncore', 1))
+        times.setdefault(setting, []).append(r['loop'] / size)
+
+    if len(times) < 2:
+        return None
+    return min(times, key=lambda setting: np.median(times[setting]))
+
+
+def choose_parallelization(nkpts, nbands, ncores, ppn, algo='normal',
+                           nbands_fixed=False, nions=1, records=None,
+                           npar=False):
+    '''Return {tag: value} of the parallelization tags for a problem.
+
+    nbands_fixed means NBANDS is set, so VASP must not round it. With
+    npar the bands are split with NPAR, and the k-points are not.
+    '''
+    ppn = min(ppn, ncores)
+    fixed = nbands if nbands_fixed else None
+
+    if npar:
+        ncore = choose_ncore(ncores, ppn, fixed)
+        tags = {'npar': ncores // ncore}
+        nsim = choose_nsim(nbands, ncores // ncore, algo)
+        if nsim is not None:
+            tags['nsim'] = nsim
+        return tags
+
+    kpar = choose_kpar(nkpts, ncores)
+    ncore = choose_ncore(ncores // kpar, ppn, fixed)
+
+    try:
+        measured = measured_parallelization({'nkpts': nkpts,
+                                             'nbands': nbands,
+                                             'nions': nions}, ncores, records)
+    except Exception as e:
+        log.warning('cannot use the walltime history: {0}'.format(e))
+        measured = None
+    if measured is not None and is_valid(measured[0], measured[1], nkpts,
+                                         ncores, ppn, fixed):
+        log.debug('using the measured kpar, ncore {0}'.format(measured))
+        kpar, ncore = measured
+
+    tags = {'kpar': kpar, 'ncore': ncore}
+    nsim = choose_nsim(nbands, ncores // kpar // ncore, algo)
+    if nsim is not None:
+        tags['nsim'] = nsim
+    return tags
+
+
+def get_job_cores():
+    '''Return the cores a calculation submitted with JASPRC runs on.
+
+    This is JASPRC['queue.nodes'] * JASPRC['queue.ppn'], unless the job
+    is on one node and JASPRC['multiprocessing.cores_per_process'] is
+    set. Then vasp runs on that many cores, see Vasp.run.
+    '''
+    nodes = int(JASPRC['queue.nodes'])
+    cores_per_process = JASPRC['multiprocessing.cores_per_process']
+    if nodes > 1 or cores_per_process in [None, 'None']:
+        return nodes * int(JASPRC['queue.ppn'])
+    return int(cores_per_process)
+
+
+def read_parallelization(directory='.'):
+    '''Return the tags set_parallelization chose in directory.'''
+    fname = os.path.join(directory, PARALLEL_FILE)
+    if not os.path.exists(fname):
+        return {}
+    try:
+        with open(fname) as f:
+            return json.load(f)['tags']
+    except (IOError, ValueError, KeyError) as e:
+        log.warning('cannot read {0}: {1}'.format(fname, e))
+        return {}
+
+
+def get_user_parallelization(calc):
+    '''Return the parallelization tags of calc the user set.
+
+    Tags in the arguments of jasp are the user's. Tags from the INCAR
+    are the user's unless set_parallelization chose them.
+    '''
+    chosen = read_parallelization(calc.directory)
+    kwargs = getattr(calc, 'kwargs', None) or {}
+    user = {}
+    for tag in PARALLEL_TAGS:
+        value = calc.int_params.get(tag)
+        if value is None:
+            continue
+        if tag in kwargs or chosen.get(tag) != value:
+            user[tag] = value
+    return user
+
+
+def set_parallelization(calc, ncores=None, ppn=None):
+    '''Set the parallelization tags of calc for ncores, and write the INCAR.
+
+    ncores defaults to get_job_cores(), and ppn to JASPRC['queue.ppn'].
+    Returns the tags set.
+    '''
+    if not JASPRC.get('parallel.auto', False):
+        return {}
+    if ncores is None:
+        ncores = get_job_cores()
+    if ppn is None:
+        ppn = int(JASPRC['queue.ppn'])
+    if (ncores <= 1
+        or calc.int_params.get('images') is not None
+        or get_user_parallelization(calc)):
+        return {}
+
+    try:
+        params = estimate_memory_parameters(calc, ncores)
+    except Exception as e:
+        log.warning('cannot choose the parallelization: {0}'.format(e))
+        return {}
+    algo = calc.string_params.get('algo') or 'normal'
+    tags = choose_parallelization(params['nkpts'], params['nbands'],
+                                  ncores, ppn, algo,
+                                  calc.int_params.get('nbands') is not None,
+                                  params['nions'],
+                                  npar=JASPRC.get('parallel.npar', False))
+    log.debug('parallelization for {0} cores: {1}'.format(ncores, tags))
+    # tags chosen for other cores that are not used now
+    calc.set(**dict((tag, tags.get(tag)) for tag in PARALLEL_TAGS))
+    calc.write_incar(calc.get_atoms())
+    with open(os.path.join(calc.directory, PARALLEL_FILE), 'w') as f:
+        json.dump({'ncores': ncores, 'tags': tags}, f)
+    return tags
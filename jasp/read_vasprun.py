@@ -24,7 +24,7 @@ def read_forces(self, atoms=None, all=False):
     except ValueError:
         log.debug('ValueError in read_forces. Trying vasprun.xml.')
 
-    with open('vasprun.xml', 'rt') as f:
+    with open(os.path.join(self.directory, 'vasprun.xml'), 'rt') as f:
         try:
             tree = ElementTree.parse(f)
         except xml.parsers.expat.ExpatError:
@@ -74,7 +74,7 @@ def read_stress(self):
     except ValueError:
         log.debug('ValueError in read_stress. trying vasprun.xml')
 
-    with open('vasprun.xml', 'rt') as f:
+    with open(os.path.join(self.directory, 'vasprun.xml'), 'rt') as f:
         try:
             tree = ElementTree.parse(f)
         except xml.parsers.expat.ExpatError:
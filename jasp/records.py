@@ -0,0 +1,59 @@
+'''Tables of records shared by all processes, e.g. the walltime history.
+
+Many jobs finish at the same time, and each adds a record. A json file
+that every job reads, updates and writes back loses the records of the
+jobs that wrote it in between. Instead a table is a file with one json
+line [key, record] per record, and records are only ever appended. A
+later record replaces an earlier one with the same key. Appends are one
+write to a file opened with O_APPEND, under a lock, so they do not mix,
+and a line cut off by a killed job is ended before the next one.
+
+>>> append_record('~/.jasp-walltime.jsonl', '/some/calc', {'elapsed': 12.})
+>>> read_records('~/.jasp-walltime.jsonl')
+{u'/some/calc': {u'elapsed': 12.0}}
+'''
+
+import fcntl
+import json
+import os
+
+import logging
+log = logging.getLogger('Jasp')
+
+
+def append_record(fname, key, record):
+    '''Append record with key to the table fname.'''
+    line = json.dumps([key, record]) + '\n'
+    fd = os.open(os.path.expanduser(fname),
+                 os.O_RDWR | os.O_APPEND | os.O_CREAT, 0644)
+    try:
+        fcntl.lockf(fd, fcntl.LOCK_EX)
+        if os.fstat(fd).st_size > 0:
+            os.lseek(fd, -1, os.SEEK_END)
+            if os.read(fd, 1) != '\n':
+                line = '\n' + line
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def read_records(fname):
+    '''Return {key: record} of the table fname.
+
+    Lines that cannot be read, e.g. one cut off when a job was killed,
+    are skipped.
+    '''
+    fname = os.path.expanduser(fname)
+    if not os.path.exists(fname):
+        return {}
+    records = {}
+    with open(fname) as f:
+        for i, line in enumerate(f):
+            try:
+                key, record = json.loads(line)
+            except (ValueError, TypeError):
+                log.warning('cannot read line {0} of {1}'.format(i + 1,
+                                                                 fname))
+                continue
+            records[key] = record
+    return records
@@ -0,0 +1,331 @@
+'''Fix common vasp failures and resubmit the calculation.
+
+A failed job used to wait until someone ran the script again, read the
+exception and changed the script. When a job finishes, the errors are
+diagnosed and mapped to a fix:
+
+zbrent                 the line minimization failed. IBRION 2 -> 1, or
+                       1 -> 2 with a smaller POTIM
+highest band occupied  NBANDS is increased by 20%, rounded up to a
+                       multiple of the band groups so vasp keeps it
+scf                    the electronic loop did not converge. ALGO Fast
+                       -> Normal, then damped mixing, then ALGO = All
+unfinished             vasp stopped before the end, e.g. at the
+                       walltime. restart from the CONTCAR
+
+A relaxation that ran out of NSW steps is diagnosed as ionic, but not
+fixed here. jasp continues it when the script is run again, see
+JASPRC['restart_unconverged'].
+
+The output of the failed run is moved to recovery.N/, the CONTCAR
+becomes the POSCAR, the INCAR is updated and the calculation is
+submitted again. This happens in runjasp.py when vasp exits, at most
+JASPRC['recovery.max_attempts'] times per directory, and only if
+JASPRC['recovery.auto'] is True. The attempts are recorded in
+.jasp-recovery. Reading a calculation never changes it.
+
+The changed tags are kept when the script is run again with the
+values they replaced, so the script does not undo the fix.
+'''
+
+import glob
+import json
+import os
+import pipes
+import shutil
+import numpy as np
+from jasprc import JASPRC
+from outcar import read_outcar_tail, scan_outcar_errors
+from jasp_status import read_incar_tags, read_oszicar_convergence
+from memory import read_memory_parameters
+from scheduler import *
+
+import logging
+log = logging.getLogger('Jasp')
+
+RECOVERY_FILE = '.jasp-recovery'
+
+# files of the failed run that are moved, and copied, to recovery.N
+RECOVERY_MOVED = ['OUTCAR', 'OSZICAR', 'vasprun.xml', 'vasp.out',
+                  '.jasp-outcar.idx']
+RECOVERY_COPIED = ['INCAR', 'POSCAR', 'CONTCAR', 'KPOINTS']
+
+
+def read_job_output(jobid=None, directory='.'):
+    '''Return the lines of the scheduler output of jobid, and vasp.out.'''
+    fnames = ['vasp.out']
+    if jobid is not None:
+        fnames += [f for f in os.listdir(directory)
+                   if '.o{0}'.format(jobid.split('.')[0]) in f]
+    lines = []
+    for fname in fnames:
+        fname = os.path.join(directory, fname)
+        if os.path.exists(fname):
+            lines += read_outcar_tail(50, fname)
+    return lines
+
+
+def diagnose(jobid=None, directory='.'):
+    '''Return the errors of the calculation in directory.
+
+    The errors are the kinds in RECOVERY_RULES, plus crashed for a run
+    that stopped with an error we have no fix for. An empty list means
+    the calculation finished and converged.
+    '''
+    incar = os.path.join(directory, 'INCAR')
+    outcar = os.path.join(directory, 'OUTCAR')
+    oszicar = os.path.join(directory, 'OSZICAR')
+    if not os.path.exists(incar):
+        return []
+    tags = read_incar_tags(incar)
+
+    errors = []
+    if any('ZBRENT: fatal error' in line
+           for line in read_job_output(jobid, directory)):
+        errors.append('zbrent')
+
+    if not os.path.exists(outcar):
+        return errors or ['crashed']
+
+    kinds = set(kind for kind, i, offset, line in scan_outcar_errors(outcar))
+    if 'highest band occupied' in kinds:
+        errors.append('highest band occupied')
+
+    lines = read_outcar_tail(20, outcar)
+    if not lines or 'Voluntary context switches' not in lines[-1]:
+        if errors:
+            return errors
+        if 'segfault' in kinds:
+            return ['crashed']
+        return ['unfinished']
+
+    if os.path.exists(oszicar):
+        nelm = int(tags.get('NELM', 60))
+        nsw = int(tags.get('NSW', 0))
+        ibrion = int(tags.get('IBRION', -1 if nsw in [0, 1] else 0))
+        if not read_oszicar_convergence(oszicar, nelm=nelm):
+            errors.append('scf')
+        elif not read_oszicar_convergence(oszicar, nelm=nelm, nsw=nsw,
+                                          ibrion=ibrion):
+            errors.append('ionic')
+    return errors
+
+
+def fix_zbrent(tags, directory='.'):
+    ibrion = int(tags.get('IBRION', 0))
+    if ibrion == 1:
+        potim = float(tags.get('POTIM', 0.5))
+        return {'IBRION': 2, 'POTIM': round(potim / 2, 3)}
+    return {'IBRION': 1}
+
+
+def fix_nbands(tags, directory='.'):
+    params = read_memory_parameters(os.path.join(directory, 'OUTCAR')) or {}
+    nbands = params.get('nbands', int(tags.get('NBANDS', 0)))
+    if not nbands:
+        return None
+    # vasp rounds NBANDS up to a multiple of the band groups
+    ncores = params.get('ncores', 1)
+    kpar = int(tags.get('KPAR', 1))
+    if 'NPAR' in tags:
+        npar = int(tags['NPAR'])
+    else:
+        npar = max(1, ncores // kpar // int(tags.get('NCORE', 1)))
+    nbands = int(np.ceil(1.2 * nbands))
+    return {'NBANDS': npar * -(-nbands // npar)}
+
+
+def fix_scf(tags, directory='.'):
+    algo = tags.get('ALGO', 'Normal').lower()
+    if algo in ['fast', 'veryfast', 'very_fast']:
+        return {'ALGO': 'Normal'}
+    elif 'AMIX' not in tags:
+        return {'AMIX': 0.1, 'BMIX': 0.01,
+                'NELM': max(100, int(tags.get('NELM', 60)))}
+    elif algo != 'all':
+        return {'ALGO': 'All'}
+    return None
+
+
+def fix_restart(tags, directory='.'):
+    return {}
+
+
+# error: function of the INCAR tags and the directory that returns the
+# tags to change, or None if it has nothing left to try. Errors are fixed in this order.
+RECOVERY_RULES = [('zbrent', fix_zbrent),
+                  ('highest band occupied', fix_nbands),
+                  ('scf', fix_scf),
+                  ('unfinished', fix_restart)]
+
+
+def read_recovery_history(directory='.'):
+    '''Return the record of the recovery attempts in directory.'''
+    fname = os.path.join(directory, RECOVERY_FILE)
+    if not os.path.exists(fname):
+        return {'attempts': [], 'overrides': {}}
+    with open(fname) as f:
+        return json.load(f)
+
+
+def write_recovery_history(history, directory='.'):
+    with open(os.path.join(directory, RECOVERY_FILE), 'w') as f:
+        json.dump(history, f, indent=1)
+
+
+def update_incar(changes, fname='INCAR'):
+    '''Set the tags in changes in the INCAR fname.
+
+    Lines with the tags are replaced. This assumes one tag per line,
+    like ase writes.
+    '''
+    changes = dict((key.upper(), val) for key, val in changes.items())
+    lines = []
+    with open(fname) as f:
+        for line in f:
+            key = line.split('=')[0].strip().upper() if '=' in line else None
+            if key not in changes:
+                lines.append(line)
+    for key in sorted(changes):
+        val = changes[key]
+        if isinstance(val, bool):
+            val = '.TRUE.' if val else '.FALSE.'
+        lines.append(' {0} = {1}\n'.format(key, val))
+    with open(fname, 'w') as f:
+        f.writelines(lines)
+
+
+def can_resubmit():
+    '''Return True if a calculation can be submitted from here.
+
+    Scripts that only read calculations set JASPRC['mode'] = None.
+    '''
+    if JASPRC['mode'] == 'queue':
+        return True
+    return (JASPRC['mode'] == 'run'
+            and (detect_scheduler() is not None
+                 or get_run_pool() is not None))
+
+
+def resubmit(directory='.'):
+    '''Submit the calculation in directory, and return the jobid.
+
+    The job runs with JASPRC['queue.walltime'], not a predicted one.
+    '''
+    directory = os.path.abspath(directory)
+    pool = get_run_pool()
+    if (detect_scheduler() is None and JASPRC['mode'] == 'run'
+        and pool is not None):
+        jobid = pool.submit(run_pool_script(directory), directory,
+                            cwd=directory)
+    else:
+        script = job_script('cd {0}\nrunjasp.py\n#end'.format(
+            pipes.quote(directory)))
+        jobid = get_scheduler().submit(script, directory)
+        add_job_to_snapshot(jobid)
+    with open(os.path.join(directory, 'jobid'), 'w') as f:
+        f.write(jobid)
+    return jobid
+
+
+def archive_outputs(directory='.'):
+    '''Move the output of the failed run to recovery.N, and return it.
+
+    The name of recovery.N is relative to directory.
+    '''
+    n = len(glob.glob(os.path.join(directory, 'recovery.*'))) + 1
+    archive = 'recovery.{0}'.format(n)
+    os.mkdir(os.path.join(directory, archive))
+    for fname in RECOVERY_MOVED:
+        src = os.path.join(directory, fname)
+        if os.path.exists(src):
+            os.rename(src, os.path.join(directory, archive, fname))
+    for fname in RECOVERY_COPIED:
+        src = os.path.join(directory, fname)
+        if os.path.exists(src):
+            shutil.copy(src, os.path.join(directory, archive))
+    return archive
+
+
+def recover(jobid=None, directory='.'):
+    '''Fix the failed calculation in directory and resubmit it.
+
+    Returns the new jobid, or None if the calculation is ok, there is
+    no fix for its errors, or JASPRC['recovery.max_attempts'] were
+    already made.
+    '''
+    if not JASPRC.get('recovery.auto', False) or not can_resubmit():
+        return None
+    incar = os.path.join(directory, 'INCAR')
+    if not os.path.exists(incar):
+        return None
+    tags = read_incar_tags(incar)
+    if 'IMAGES' in tags:
+        # NEB output is in the image directories
+        return None
+
+    # jasp continues unconverged relaxations
+    errors = [e for e in diagnose(jobid, directory) if e != 'ionic']
+    if not errors:
+        return None
+
+    where = os.path.abspath(directory)
+    history = read_recovery_history(directory)
+    if len(history['attempts']) >= int(JASPRC['recovery.max_attempts']):
+        log.warning('{0}: not recovering from {1}. {2} attempts were '
+                    'made'.format(where, errors,
+                                  len(history['attempts'])))
+        return None
+
+    rules = dict(RECOVERY_RULES)
+    for error in errors:
+        if error in rules:
+            changes = rules[error](tags, directory)
+            if changes is not None:
+                break
+    else:
+        log.warning('{0}: no fix for {1}'.format(where, errors))
+        return None
+
+    archive = archive_outputs(directory)
+    contcar = os.path.join(directory, 'CONTCAR')
+    if os.path.exists(contcar) and os.path.getsize(contcar) > 0:
+        shutil.copy(contcar, os.path.join(directory, 'POSCAR'))
+    update_incar(changes, incar)
+
+    for key, val in changes.items():
+        old = history['overrides'].get(key, [tags.get(key)])[0]
+        history['overrides'][key] = [old, val]
+
+    newjob = resubmit(directory)
+    history['attempts'].append({'errors': errors, 'fix': error,
+                                'changes': changes, 'jobid': jobid,
+                                'newjob': newjob, 'archive': archive})
+    write_recovery_history(history, directory)
+    log.info('{0}: fixed {1} with {2}, resubmitted as {3}'.format(
+        where, error, changes, newjob))
+    return newjob
+
+
+def _same(val, incar_val):
+    '''Return True if val is the INCAR string incar_val.'''
+    try:
+        return float(val) == float(incar_val)
+    except (TypeError, ValueError):
+        return str(val).lower() == str(incar_val).lower()
+
+
+def apply_recovery_overrides(calc, kwargs, directory='.'):
+    '''Keep the tags recover changed over the same values in kwargs.
+
+    If the script still sets a tag to the value recover replaced, the
+    fixed value is used. Setting it to anything else wins.
+    '''
+    if not os.path.exists(os.path.join(directory, RECOVERY_FILE)):
+        return
+    overrides = read_recovery_history(directory)['overrides']
+    for key, (old, new) in overrides.items():
+        key = key.lower()
+        if key in kwargs and old is not None and _same(kwargs[key], old):
+            log.debug('keeping {0} = {1} from recovery'.format(key, new))
+            calc.set(**{key: new})
@@ -0,0 +1,988 @@
+'''Scheduler backends, and the status of the jobs in the queue.
+
+Everything jasp needs from a batch system is in a Scheduler class:
+
+submit(script, jobname)           submit a job, return its jobid
+submit_array(script, jobname, n)  submit a job array of n tasks
+status()                          {jobid: state} of all jobs
+cancel(jobid)                     delete a job
+in_job()                          True if we are running inside a job
+get_nodes()                       one hostname per core of this job
+
+JASPRC['scheduler'] selects the backend: 'PBS', 'SGE', 'Slurm' or
+'local'. The local scheduler runs jobs on this machine in a pool of
+JASPRC['local.workers'] threads, which is useful for testing, and for
+measuring how fast jasp submits jobs. Other batch systems can be added
+with register_scheduler.
+
+>>> scheduler = get_scheduler()
+>>> jobid = scheduler.submit(script, 'some/dir')
+
+Both take after, a list of jobids the job waits for. The job only
+runs if they all finished without error (afterok), except with SGE,
+where -hold_jid starts the job when they end, whether they failed or
+not. Workflow steps check their parents when they start, see
+workflow.py.
+They also take walltime, the walltime of this job. The default is
+JASPRC['queue.walltime'].
+
+Calculations submitted inside a job_array block are submitted together
+as one array job when the block ends, see job_array.
+
+In JASPRC['mode'] = 'run', calculations run one after the other. If
+JASPRC['run.cores'] is set they run in the background in a local pool
+instead, see get_run_pool, wait and as_completed.
+
+job_in_queue is called several times for every directory jasp visits,
+and used to run qselect and qstat each time. When you loop over
+thousands of directories, that is thousands of scheduler commands.
+Instead, we ask the scheduler for the state of all jobs with one
+command, and keep that snapshot for JASPRC['queue.status.ttl']
+seconds. All job_in_queue calls in that window are answered from the
+snapshot. Jobs we submit are added to the snapshot, so they are seen
+as queued right away.
+
+>>> get_job_state('1234.gilgamesh')  # e.g. 'Q', 'R', 'C' or None
+'''
+
+import atexit
+import commands
+import getpass
+import itertools
+import multiprocessing
+import os
+import pipes
+import Queue
+import re
+import signal
+import tempfile
+import threading
+import time
+from subprocess import Popen, PIPE, STDOUT
+from jasprc import JASPRC
+
+import logging
+log = logging.getLogger('Jasp')
+
+
+def parse_pbs_qstat(output):
+    '''Return {jobid: state} from the output of qstat -f.
+
+    The output has a block for each job like this:
+
+    Job Id: 1234.gilgamesh
+        Job_Name = some/dir
+        job_state = R
+    '''
+    jobs = {}
+    jobid = None
+    for line in output.split('\n'):
+        if line.startswith('Job Id:'):
+            jobid = line.split(':', 1)[1].strip()
+        elif jobid is not None and line.strip().startswith('job_state ='):
+            jobs[jobid] = line.split('=', 1)[1].strip()
+    return jobs
+
+
+def parse_sge_qstat(output):
+    '''Return {jobid: state} from the output of qstat.
+
+    The first two lines are a header, then there is a line for each job
+    with the jobid in the first column and the state in the fifth.
+    '''
+    jobs = {}
+    for line in output.split('\n')[2:]:
+        fields = line.split()
+        if len(fields) > 4:
+            jobs[fields[0]] = fields[4]
+    return jobs
+
+
+def parse_slurm_squeue(output):
+    '''Return {jobid: state} from the output of squeue -h -r -o "%i %t".
+
+    Array tasks are listed as jobid_task. The jobid of the array gets
+    the state of its first task, so a submitted array can be found
+    with the jobid sbatch printed.
+    '''
+    jobs = {}
+    for line in output.split('\n'):
+        fields = line.split()
+        if len(fields) < 2:
+            continue
+        jobs[fields[0]] = fields[1]
+        if '_' in fields[0]:
+            jobs.setdefault(fields[0].split('_')[0], fields[1])
+    return jobs
+
+
+class Scheduler(object):
+    '''Base class of the scheduler backends.
+
+    Subclasses set name, and the environment variable with the task
+    index of array jobs, and implement the methods below.
+    '''
+    name = None
+
+    # environment variable with the index of an array task, and the
+    # index of the first task
+    array_index_variable = None
+    array_first_index = 0
+
+    # if False, get_queue_snapshot asks for the status every time
+    cache_status = True
+
+    def submit(self, script, jobname, after=None, walltime=None):
+        '''Submit script as a job named jobname and return the jobid.
+
+        The job does not start until the jobs in after finished ok.
+        walltime defaults to JASPRC['queue.walltime'].
+        '''
+        return self.submit_array(script, jobname, None, after, walltime)
+
+    def submit_array(self, script, jobname, ntasks, after=None,
+                     walltime=None):
+        '''Submit script as an array of ntasks jobs and return the jobid.
+
+        If ntasks is None a normal job is submitted.
+        '''
+        raise NotImplementedError
+
+    def array_task_jobid(self, jobid, index):
+        '''Return the jobid of task index (from 0) of the array jobid.
+
+        This is the jobid the task has in status().
+        '''
+        return jobid
+
+    def status(self):
+        '''Return {jobid: state} for all the jobs in the queue.'''
+        raise NotImplementedError
+
+    def cancel(self, jobid):
+        raise NotImplementedError
+
+    def in_job(self):
+        '''Return True if we are running inside a job of this scheduler.'''
+        raise NotImplementedError
+
+    def get_nodes(self):
+        '''Return a list with a hostname for each core of this job.'''
+        raise NotImplementedError
+
+    def request_nodes(self, nodes):
+        '''Ask for nodes nodes in the next job we submit.'''
+        JASPRC['queue.nodes'] = nodes
+
+    def _call(self, cmdlist, script=None):
+        '''Run cmdlist with script on stdin and return the output.'''
+        log.debug('{0}'.format(' '.join(cmdlist)))
+        p = Popen(cmdlist, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        out, err = p.communicate(script)
+
+        if out == '' or err != '':
+            raise Exception('something went wrong in {0}:\n\n{1}'.format(
+                cmdlist[0], err))
+        return out
+
+    def _query(self, cmd, parser):
+        '''Run cmd and return parser(output).
+
+        If the command fails we log a warning and return an empty
+        dictionary, i.e. no jobs are in the queue.
+        '''
+        log.debug('querying the queue with {0}'.format(cmd))
+        status, output = commands.getstatusoutput(cmd)
+        if status != 0:
+            log.warning('{0} failed:\n{1}'.format(cmd, output))
+            return {}
+        return parser(output)
+
+
+class PBSScheduler(Scheduler):
+    '''PBS/Torque.'''
+    name = 'PBS'
+    array_index_variable = 'PBS_ARRAYID'
+
+    def submit_array(self, script, jobname, ntasks, after=None,
+                     walltime=None):
+        log.debug('{0} will be the jobname.'.format(jobname))
+        log.debug('-l nodes={0}:ppn={1}'.format(JASPRC['queue.nodes'],
+                                                JASPRC['queue.ppn']))
+
+        cmdlist = ['{0}'.format(JASPRC['queue.command'])]
+        cmdlist += [option for option in JASPRC['queue.options'].split()]
+        cmdlist += ['-N', '{0}'.format(jobname),
+                    '-l walltime={0}'.format(walltime
+                                             or JASPRC['queue.walltime']),
+                    '-l nodes={0}:ppn={1}'.format(JASPRC['queue.nodes'],
+                                                  JASPRC['queue.ppn']),
+                    '-l mem={0}'.format(JASPRC['queue.mem'])]
+        if ntasks is not None:
+            cmdlist += ['-t', '0-{0}'.format(ntasks - 1)]
+        if after:
+            # a whole array needs afterokarray
+            depend = []
+            jobs = [j for j in after if '[]' not in j]
+            arrays = [j for j in after if '[]' in j]
+            if jobs:
+                depend.append(':'.join(['afterok'] + jobs))
+            if arrays:
+                depend.append(':'.join(['afterokarray'] + arrays))
+            cmdlist += ['-W', 'depend={0}'.format(','.join(depend))]
+
+        return self._call(cmdlist, script).strip()
+
+    def array_task_jobid(self, jobid, index):
+        # 1234[].gilgamesh -> 1234[3].gilgamesh
+        return jobid.replace('[]', '[{0}]'.format(index))
+
+    def status(self):
+        # only our jobs. qstat -f has no -u, so qselect lists them
+        cmd = 'qselect -u {0}'.format(pipes.quote(getpass.getuser()))
+        log.debug('querying the queue with {0}'.format(cmd))
+        status, output = commands.getstatusoutput(cmd)
+        if status != 0:
+            log.warning('{0} failed:\n{1}'.format(cmd, output))
+            return {}
+        jobids = output.split()
+        if not jobids:
+            return {}
+        # -t lists each task of job arrays. A job that ended since
+        # qselect makes qstat fail, but the others are still listed.
+        cmd = 'qstat -f -t {0} 2>/dev/null'.format(
+            ' '.join(pipes.quote(jobid) for jobid in jobids))
+        status, output = commands.getstatusoutput(cmd)
+        return parse_pbs_qstat(output)
+
+    def cancel(self, jobid):
+        commands.getoutput('qdel {0}'.format(jobid))
+
+    def in_job(self):
+        return 'PBS_O_WORKDIR' in os.environ or 'PBS_NODEFILE' in os.environ
+
+    def get_nodes(self):
+        if 'PBS_NODEFILE' not in os.environ:
+            return []
+        with open(os.environ['PBS_NODEFILE']) as f:
+            return [line.strip() for line in f if line.strip()]
+
+
+class SGEScheduler(Scheduler):
+    '''Sun/Open Grid Engine.'''
+    name = 'SGE'
+    array_index_variable = 'SGE_TASK_ID'
+    array_first_index = 1
+
+    def submit_array(self, script, jobname, ntasks, after=None,
+                     walltime=None):
+        jobname = jobname.replace('/', '|')  # SGE does not allow '/' in job names
+        log.debug('{0} will be the jobname.'.format(jobname))
+        # a file of our own, so threads do not submit each other's script
+        fd, qscript = tempfile.mkstemp(prefix='qscript-')
+        with os.fdopen(fd, 'w') as f:
+            f.write(script)
+        log.debug('-pe {0} {1}'.format(JASPRC['queue.pe'],
+                                       JASPRC['queue.nprocs']))
+        log.debug('-q {0}'.format(JASPRC['queue.q']))
+
+        cmdlist = ['{0}'.format(JASPRC['queue.command'])]
+        cmdlist += [option for option in JASPRC['queue.options'].split()]
+        cmdlist += ['-N', '{0}'.format(jobname),
+                    '-q {0}'.format(JASPRC['queue.q']),
+                    '-pe {0} {1}'.format(JASPRC['queue.pe'], JASPRC['queue.nprocs']),
+                    '-l', 'h_rt={0}'.format(walltime or JASPRC['queue.walltime'])
+                    #'-l mem_free={0}'.format(JASPRC['queue.mem'])
+                     ]
+        if ntasks is not None:
+            cmdlist += ['-t', '1-{0}'.format(ntasks)]
+        if after:
+            # SGE waits for the jobs to end, whether they failed or not.
+            # Workflow.run_step checks that the parents are done.
+            cmdlist += ['-hold_jid', ','.join(after)]
+        cmdlist += [qscript]
+
+        try:
+            out = self._call(cmdlist, script)
+        finally:
+            os.unlink(qscript)
+        # Your job 1234 ("name") has been submitted, or
+        # Your job-array 1234.1-5:1 ("name") has been submitted
+        return out.split()[2].split('.')[0]
+
+    def status(self):
+        return self._query('qstat', parse_sge_qstat)
+
+    def cancel(self, jobid):
+        commands.getoutput('qdel {0}'.format(jobid))
+
+    def in_job(self):
+        return 'PE_HOSTFILE' in os.environ
+
+    def get_nodes(self):
+        # each line is: hostname slots queue processor-range
+        nodes = []
+        with open(os.environ['PE_HOSTFILE']) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 1:
+                    nodes += [fields[0]] * int(fields[1])
+        return nodes
+
+    def request_nodes(self, nodes):
+        # SGE asks for processors in a parallel environment
+        JASPRC['queue.nprocs'] = nodes
+
+
+class SlurmScheduler(Scheduler):
+    '''Slurm. Options for sbatch are in JASPRC['queue.slurm.options'].'''
+    name = 'Slurm'
+    array_index_variable = 'SLURM_ARRAY_TASK_ID'
+
+    def submit_array(self, script, jobname, ntasks, after=None,
+                     walltime=None):
+        log.debug('{0} will be the jobname.'.format(jobname))
+        # slurm wants 2G, not 2GB
+        mem = str(JASPRC['queue.mem']).upper().rstrip('B')
+
+        cmdlist = ['sbatch']
+        cmdlist += JASPRC.get('queue.slurm.options', '').split()
+        cmdlist += ['--job-name={0}'.format(jobname),
+                    '--time={0}'.format(walltime or JASPRC['queue.walltime']),
+                    '--nodes={0}'.format(JASPRC['queue.nodes']),
+                    '--ntasks-per-node={0}'.format(JASPRC['queue.ppn']),
+                    '--mem={0}'.format(mem)]
+        if ntasks is not None:
+            cmdlist += ['--array=0-{0}'.format(ntasks - 1)]
+        if after:
+            cmdlist += ['--dependency=afterok:{0}'.format(':'.join(after)),
+                        '--kill-on-invalid-dep=yes']
+
+        # Submitted batch job 1234
+        return self._call(cmdlist, script).split()[-1]
+
+    def array_task_jobid(self, jobid, index):
+        return '{0}_{1}'.format(jobid, index)
+
+    def status(self):
+        return self._query('squeue -h -r -o "%i %t"', parse_slurm_squeue)
+
+    def cancel(self, jobid):
+        commands.getoutput('scancel {0}'.format(jobid))
+
+    def in_job(self):
+        return 'SLURM_JOB_ID' in os.environ
+
+    def get_nodes(self):
+        hosts = commands.getoutput('scontrol show hostnames {0}'.format(
+            os.environ['SLURM_JOB_NODELIST'])).split()
+
+        # SLURM_TASKS_PER_NODE looks like 16(x2),8
+        tasks = []
+        for field in os.environ.get('SLURM_TASKS_PER_NODE', '').split(','):
+            if '(x' in field:
+                n, repeat = field.rstrip(')').split('(x')
+                tasks += [int(n)] * int(repeat)
+            elif field:
+                tasks.append(int(field))
+
+        nodes = []
+        for i, host in enumerate(hosts):
+            nodes += [host] * (tasks[i] if i < len(tasks) else 1)
+        return nodes
+
+
+class LocalScheduler(Scheduler):
+    '''Run jobs on this machine in a pool of worker threads.
+
+    Each worker runs one job at a time in a shell, so there are at most
+    JASPRC['local.workers'] jobs running. The jobs only exist in this
+    process. Job ids are local.1, local.2, ...
+
+    A job with dependencies is held (state 'H') until they are done,
+    and cancelled if one of them failed or was cancelled.
+    '''
+    name = 'local'
+    array_index_variable = 'JASP_ARRAY_ID'
+    cache_status = False
+
+    def __init__(self, workers=None, prefix='local'):
+        if workers is None:
+            workers = JASPRC.get('local.workers', 'None')
+            if workers in [None, 'None']:
+                workers = multiprocessing.cpu_count()
+        self.workers = int(workers)
+        self.prefix = prefix
+
+        # jobid: dictionary with the state, exitcode, output...
+        self.jobs = {}
+        self.pending = Queue.Queue()
+        # jobids of held jobs, in the order they were submitted
+        self.held = []
+        self.lock = threading.Lock()
+        # notified when a job is done
+        self.finished = threading.Condition(self.lock)
+        self.counter = itertools.count(1)
+        self.threads = []
+
+    def _start_workers(self):
+        while len(self.threads) < self.workers:
+            t = threading.Thread(target=self._work)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def _work(self):
+        while True:
+            jobid = self.pending.get()
+            job = self.jobs[jobid]
+            with self.lock:
+                if job['state'] != 'Q':  # cancelled while queued
+                    continue
+                job['state'] = 'R'
+                job['start'] = time.time()
+                env = dict(os.environ)
+                env.update(job['env'])
+                # each job gets its own process group, so cancel can
+                # kill everything the job started
+                job['process'] = Popen(['/bin/sh'], stdin=PIPE, stdout=PIPE,
+                                       stderr=STDOUT, cwd=job['cwd'],
+                                       env=env, preexec_fn=os.setsid)
+            out, err = job['process'].communicate(job['script'])
+            with self.lock:
+                job['output'] = out
+                job['exitcode'] = job['process'].returncode
+                job['end'] = time.time()
+                job['state'] = 'C'
+                del job['process']
+                job['done'].set()
+                self._release()
+                self.finished.notify_all()
+
+    def _enqueue(self, script, jobname, env, after, cwd=None):
+        jobid = '{0}.{1}'.format(self.prefix, self.counter.next())
+        env = dict({'JASP_LOCAL_NPROCS': str(int(JASPRC['queue.nodes'])
+                                             * int(JASPRC['queue.ppn']))},
+                   JASP_LOCAL_JOBID=jobid, **env)
+        self.jobs[jobid] = {'jobname': jobname,
+                            'script': script,
+                            'cwd': cwd or os.getcwd(),
+                            'env': env,
+                            'state': 'Q',
+                            'exitcode': None,
+                            'submitted': time.time(),
+                            'done': threading.Event()}
+        if after:
+            with self.lock:
+                self.jobs[jobid]['after'] = after
+                self.jobs[jobid]['state'] = 'H'
+                self.held.append(jobid)
+                self._release()
+        else:
+            self.pending.put(jobid)
+        return jobid
+
+    def _release(self):
+        '''Queue the held jobs whose dependencies finished ok.
+
+        Held jobs with a failed dependency are cancelled. Call this
+        with the lock held.
+        '''
+        changed = True
+        while changed:
+            changed = False
+            for jobid in self.held[:]:
+                job = self.jobs[jobid]
+                after = [self.jobs[task] for task in job['after']]
+                if any(dep['state'] == 'C' and dep['exitcode'] != 0
+                       for dep in after):
+                    job['state'] = 'C'
+                    job['done'].set()
+                elif all(dep['state'] == 'C' for dep in after):
+                    job['state'] = 'Q'
+                    self.pending.put(jobid)
+                else:
+                    continue
+                self.held.remove(jobid)
+                changed = True
+
+    def submit(self, script, jobname, after=None, walltime=None, cwd=None):
+        '''Like Scheduler.submit. The job starts in cwd (default the
+        current directory).'''
+        return self.submit_array(script, jobname, None, after, walltime, cwd)
+
+    def submit_array(self, script, jobname, ntasks, after=None,
+                     walltime=None, cwd=None):
+        self._start_workers()
+        # wait for each task of arrays in after
+        tasks = []
+        for jobid in after or []:
+            if jobid not in self.jobs:
+                # e.g. of an earlier script. Like a job that left the
+                # queue, it is done.
+                log.debug('{0} is not a job of {1}, so it is done'.format(
+                    jobid, self.prefix))
+                continue
+            tasks += self.jobs[jobid].get('tasks', [jobid])
+
+        if ntasks is None:
+            return self._enqueue(script, jobname, {}, tasks, cwd)
+
+        # the array is one jobid, with one job per task
+        jobid = '{0}.{1}'.format(self.prefix, self.counter.next())
+        self.jobs[jobid] = {'jobname': jobname,
+                            'tasks': [self._enqueue(script, jobname,
+                                                    {'JASP_ARRAY_ID': str(i)},
+                                                    tasks, cwd)
+                                      for i in range(ntasks)]}
+        return jobid
+
+    def array_task_jobid(self, jobid, index):
+        return self.jobs[jobid]['tasks'][index]
+
+    def _state(self, jobid):
+        job = self.jobs[jobid]
+        if 'tasks' not in job:
+            return job['state']
+        # an array is running until all its tasks are done
+        states = [self.jobs[task]['state'] for task in job['tasks']]
+        for state in ['R', 'Q', 'H']:
+            if state in states:
+                return state
+        return 'C'
+
+    def status(self):
+        with self.lock:
+            return dict((jobid, self._state(jobid)) for jobid in self.jobs)
+
+    def cancel(self, jobid):
+        with self.lock:
+            job = self.jobs[jobid]
+            for task in job.get('tasks', [jobid]):
+                job = self.jobs[task]
+                if job['state'] in ['Q', 'H']:
+                    job['state'] = 'C'
+                    job['done'].set()
+                    if task in self.held:
+                        self.held.remove(task)
+                    self._release()
+                    self.finished.notify_all()
+                elif job['state'] == 'R':
+                    try:
+                        os.killpg(job['process'].pid, signal.SIGTERM)
+                    except OSError:
+                        pass  # it just finished
+
+    def wait(self, jobids=None, timeout=None):
+        '''Wait until jobids (default all jobs) are done.
+
+        Returns True if they are done, False if timeout seconds passed.
+        '''
+        if jobids is None:
+            jobids = self.jobs.keys()
+        elif isinstance(jobids, str):
+            jobids = [jobids]
+
+        tasks = []
+        for jobid in jobids:
+            tasks += self.jobs[jobid].get('tasks', [jobid])
+
+        if timeout is not None:
+            end = time.time() + timeout
+        for task in tasks:
+            if timeout is None:
+                # a timeout lets the main thread see KeyboardInterrupt
+                while not self.jobs[task]['done'].wait(3600):
+                    pass
+            elif not self.jobs[task]['done'].wait(max(0, end - time.time())):
+                return False
+        return True
+
+    def as_completed(self, jobids=None, timeout=None):
+        '''Yield jobids (default all jobs) as they are done.
+
+        Raises an Exception if they are not all done in timeout seconds.
+        '''
+        if jobids is None:
+            jobids = self.jobs.keys()
+        elif isinstance(jobids, str):
+            jobids = [jobids]
+
+        if timeout is not None:
+            end = time.time() + timeout
+        pending = list(jobids)
+        while pending:
+            with self.lock:
+                done = [jobid for jobid in pending
+                        if self._state(jobid) == 'C']
+                if not done:
+                    if timeout is None:
+                        wait = 1.0  # so we see KeyboardInterrupt
+                    else:
+                        wait = end - time.time()
+                        if wait <= 0:
+                            raise Exception('{0} jobs are not done after '
+                                            '{1} s'.format(len(pending),
+                                                           timeout))
+                    self.finished.wait(min(wait, 1.0))
+            for jobid in done:
+                pending.remove(jobid)
+                yield jobid
+
+    def in_job(self):
+        return 'JASP_LOCAL_JOBID' in os.environ
+
+    def get_nodes(self):
+        return ['localhost'] * int(os.environ.get('JASP_LOCAL_NPROCS', 1))
+
+
+# lower case name: Scheduler class
+SCHEDULERS = {}
+
+# lower case name: Scheduler instance
+_schedulers = {}
+
+
+def register_scheduler(cls):
+    '''Make the Scheduler subclass cls available as JASPRC['scheduler'].'''
+    SCHEDULERS[cls.name.lower()] = cls
+    _schedulers.pop(cls.name.lower(), None)
+    return cls
+
+for _cls in [PBSScheduler, SGEScheduler, SlurmScheduler, LocalScheduler]:
+    register_scheduler(_cls)
+
+
+def get_scheduler(name=None):
+    '''Return the backend for name (default JASPRC['scheduler']).
+
+    There is one instance of each backend per process.
+    '''
+    if name is None:
+        name = JASPRC['scheduler']
+    key = name.lower()
+    if key not in SCHEDULERS:
+        raise Exception('Unknown scheduler {0}. Known schedulers are '
+                        '{1}'.format(name, SCHEDULERS.keys()))
+    if key not in _schedulers:
+        _schedulers[key] = SCHEDULERS[key]()
+    return _schedulers[key]
+
+
+def detect_scheduler():
+    '''Return the backend of the job we are running in, or None.
+
+    JASPRC['scheduler'] is checked first.
+    '''
+    names = [JASPRC['scheduler'].lower()]
+    names += [name for name in sorted(SCHEDULERS) if name not in names]
+    for name in names:
+        if name in SCHEDULERS:
+            scheduler = get_scheduler(name)
+            if scheduler.in_job():
+                return scheduler
+    return None
+
+
+def job_script(body):
+    '''Return a job script that runs the shell commands in body.'''
+    script = '#!/bin/{0}\n'.format(JASPRC.get('queue.shell', 'bash'))
+    if JASPRC.get('module', 'None') != 'None':
+        script += 'module load {0}\n'.format(JASPRC['module'])
+    return script + body
+
+
+# the job_array blocks we are in
+_job_arrays = []
+
+
+class job_array:
+    '''Context manager to submit calculations as one job array.
+
+    Calculations that would be submitted in the block are collected,
+    and submitted as one array job at the end of the block, with one
+    task per vasp directory. Each directory gets a jobid file with the
+    jobid of its task, so jasp sees it as queued like any other job.
+    The array asks for the walltime of its longest calculation.
+
+    Example:
+    with job_array():
+        for encut in [300, 350, 400, 450]:
+            with jasp('encut-{0}'.format(encut), encut=encut,
+                      atoms=atoms) as calc:
+                try:
+                    calc.calculate()
+                except (VaspSubmitted, VaspQueued):
+                    pass
+    '''
+
+    def __init__(self, jobname='jasp-array'):
+        self.jobname = jobname
+        self.directories = []
+        self.elapsed = {}
+        self.jobid = None
+
+    def add(self, vaspdir, elapsed=None):
+        '''Add vaspdir to the array, unless it is already there.
+
+        elapsed is the predicted time of the calculation in seconds on
+        get_ncores() cores, or None if it is not known.
+        '''
+        vaspdir = os.path.abspath(vaspdir)
+        if vaspdir not in self.directories:
+            self.directories.append(vaspdir)
+        self.elapsed[vaspdir] = elapsed
+
+    def get_ncores(self):
+        '''Return the cores each calculation runs on.
+
+        None means all the cores of the job, since each task of an
+        array is a job of its own.
+        '''
+        return None
+
+    def get_elapsed(self):
+        '''Return the predicted time of the job in seconds, or None.
+
+        Each task of an array runs one calculation.
+        '''
+        elapsed = [self.elapsed.get(vaspdir) for vaspdir in self.directories]
+        if not elapsed or None in elapsed:
+            return None
+        return max(elapsed)
+
+    def get_walltime(self):
+        '''Return the walltime string to submit the job with.'''
+        from walltime import request_walltime
+        return request_walltime(self.get_elapsed())
+
+    def __enter__(self):
+        _job_arrays.append(self)
+        return self
+
+    def __exit__(self, *args):
+        _job_arrays.remove(self)
+        if self.directories:
+            self.submit()
+        return False  # allows body exceptions to propagate out.
+
+    def submit(self):
+        '''Submit the directories as a job array and write the jobid files.'''
+        scheduler = get_scheduler()
+
+        # the task index selects the directory to run in
+        body = 'case $(( ${{{0}}} - {1} )) in\n'.format(
+            scheduler.array_index_variable, scheduler.array_first_index)
+        for i, vaspdir in enumerate(self.directories):
+            body += '{0}) cd {1} ;;\n'.format(i, pipes.quote(vaspdir))
+        body += 'esac\nrunjasp.py   # this is the vasp command\n#end'
+
+        self.jobid = scheduler.submit_array(job_script(body), self.jobname,
+                                            len(self.directories),
+                                            walltime=self.get_walltime())
+        log.debug('submitted {0} directories as {1}'.format(
+            len(self.directories), self.jobid))
+
+        for i, vaspdir in enumerate(self.directories):
+            jobid = scheduler.array_task_jobid(self.jobid, i)
+            with open(os.path.join(vaspdir, 'jobid'), 'w') as f:
+                f.write(jobid)
+            add_job_to_snapshot(jobid)
+        return self.jobid
+
+
+def current_job_array():
+    '''Return the job_array of the block we are in, or None.'''
+    if _job_arrays:
+        return _job_arrays[-1]
+    return None
+
+
+# the pools that run calculations in mode='run', see get_run_pool. The
+# last one is used for new calculations.
+_run_pools = []
+
+# the jobids of the run pools are run.1, run1.1, ...
+RUN_POOL_PREFIX = 'run'
+_run_pool_jobid = re.compile(r'{0}\d*\.\d+$'.format(RUN_POOL_PREFIX))
+
+
+def get_run_pool():
+    '''Return the pool that runs calculations in JASPRC['mode'] = 'run'.
+
+    Returns None unless JASPRC['run.cores'] is set. Then calculations
+    are run JASPRC['run.cores'] // JASPRC['run.cores_per_job'] at a
+    time, in the background, instead of one after the other. The
+    script waits for them before it exits.
+    '''
+    cores = JASPRC.get('run.cores', 'None')
+    if cores in [None, 'None']:
+        return None
+
+    cores_per_job = int(JASPRC.get('run.cores_per_job', 1))
+    workers = max(1, int(cores) // cores_per_job)
+    if not _run_pools or _run_pools[-1].workers != workers:
+        # earlier pools keep running their jobs
+        pool = LocalScheduler(workers=workers,
+                              prefix='{0}{1}'.format(RUN_POOL_PREFIX,
+                                                     len(_run_pools) or ''))
+        atexit.register(pool.wait)
+        _run_pools.append(pool)
+    return _run_pools[-1]
+
+
+def run_pool_script(directory='.'):
+    '''Return the script to run vasp in directory.'''
+    cores = int(JASPRC.get('run.cores_per_job', 1))
+    if cores == 1:
+        vaspcmd = JASPRC['vasp.executable.serial']
+    else:
+        vaspcmd = 'mpirun -np {0} {1}'.format(
+            cores, JASPRC['vasp.executable.parallel'])
+    return 'cd {0}\n{1} > vasp.out 2>&1\n'.format(
+        pipes.quote(os.path.abspath(directory)), vaspcmd)
+
+
+class RunHandle(object):
+    '''Handle of a calculation in the run pool.
+
+    calc.calculate() returns one in JASPRC['mode'] = 'run' when
+    JASPRC['run.cores'] is set.
+    '''
+    def __init__(self, pool, jobid, vaspdir):
+        self.pool = pool
+        self.jobid = jobid
+        self.vaspdir = vaspdir
+
+    def __repr__(self):
+        return '<RunHandle {0} {1}>'.format(self.jobid, self.vaspdir)
+
+    def done(self):
+        return self.pool.jobs[self.jobid]['state'] == 'C'
+
+    def wait(self, timeout=None):
+        '''Wait for the calculation and return the exit code of vasp.'''
+        self.pool.wait(self.jobid, timeout)
+        return self.exitcode
+
+    @property
+    def exitcode(self):
+        return self.pool.jobs[self.jobid]['exitcode']
+
+
+def wait(handles=None, timeout=None):
+    '''Wait until the RunHandles handles (default all) are done.
+
+    Returns True if they are done, False if timeout seconds passed.
+    '''
+    if handles is None:
+        handles = [RunHandle(pool, jobid, None)
+                   for pool in _run_pools for jobid in pool.jobs]
+
+    if timeout is not None:
+        end = time.time() + timeout
+    for handle in handles:
+        if timeout is None:
+            handle.pool.wait(handle.jobid)
+        elif not handle.pool.wait(handle.jobid, max(0, end - time.time())):
+            return False
+    return True
+
+
+def as_completed(handles, timeout=None):
+    '''Yield the RunHandles in handles as they are done.'''
+    handles = list(handles)
+    pools = set(handle.pool for handle in handles)
+    if len(pools) > 1:
+        raise Exception('as_completed needs handles from one pool')
+    if not handles:
+        return
+    by_jobid = dict((handle.jobid, handle) for handle in handles)
+    for jobid in pools.pop().as_completed(by_jobid.keys(), timeout):
+        yield by_jobid[jobid]
+
+
+# the last snapshot of the queue
+_queue_snapshot = {'time': None,
+                   'scheduler': None,
+                   'jobs': {}}
+
+
+def query_queue(scheduler=None):
+    '''Ask the scheduler for the state of all jobs.
+
+    Returns {jobid: state}.
+    '''
+    return get_scheduler(scheduler).status()
+
+
+def get_queue_snapshot(ttl=None):
+    '''Return {jobid: state} for all jobs in the queue.
+
+    The scheduler is only queried if the last snapshot is older than
+    ttl seconds (default JASPRC['queue.status.ttl']), or was taken for
+    another scheduler.
+    '''
+    if ttl is None:
+        ttl = float(JASPRC.get('queue.status.ttl', 30))
+    if not get_scheduler().cache_status:
+        ttl = 0
+
+    now = time.time()
+    if (_queue_snapshot['time'] is None
+        or now - _queue_snapshot['time'] >= ttl
+        or _queue_snapshot['scheduler'] != JASPRC['scheduler']):
+        _queue_snapshot['jobs'] = query_queue()
+        _queue_snapshot['time'] = now
+        _queue_snapshot['scheduler'] = JASPRC['scheduler']
+
+    return _queue_snapshot['jobs']
+
+
+def clear_queue_snapshot():
+    '''Forget the snapshot, so the next query asks the scheduler.'''
+    _queue_snapshot['time'] = None
+    _queue_snapshot['jobs'] = {}
+
+
+def add_job_to_snapshot(jobid, state='Q'):
+    '''Record a job we just submitted in the snapshot.'''
+    if _queue_snapshot['time'] is not None:
+        _queue_snapshot['jobs'][jobid] = state
+
+
+def is_run_pool_jobid(jobid):
+    '''Return True if jobid was run by a run pool, maybe of another script.
+
+    Those jobs are never in the queue.
+    '''
+    return _run_pool_jobid.match(jobid) is not None
+
+
+def get_job_states(jobids=None):
+    '''Return {jobid: state} for the queue and the local run pools.
+
+    The queue is not queried if all of jobids are jobs of run pools.
+    '''
+    if jobids is None or not all(is_run_pool_jobid(jobid)
+                                 for jobid in jobids):
+        jobs = dict(get_queue_snapshot())
+    else:
+        jobs = {}
+    for pool in _run_pools:
+        jobs.update(pool.status())
+    return jobs
+
+
+def get_job_state(jobid):
+    '''Return the state of jobid in the queue, or None if it is not there.
+
+    A job of a run pool that is gone, e.g. of a script that ended, is
+    done, and the queue is not asked about it.
+    '''
+    for pool in _run_pools:
+        if jobid in pool.jobs:
+            return pool.status()[jobid]
+    if is_run_pool_jobid(jobid):
+        return None
+    return get_queue_snapshot().get(jobid)
@@ -0,0 +1,127 @@
+'''Summaries of many calculations for jaspsum.
+
+Summarizing a project one directory after the other spends most of the
+time waiting on the file system. iter_summaries summarizes directories
+in a pool of processes, and yields the summaries in the order of the
+directories as soon as each one and all before it are done.
+
+For very many directories summary_row gives one line per calculation
+(path, state, energy, fmax, elapsed) from the tails of the output
+files and the OUTCAR index, without building a calculator.
+
+>>> for s in iter_summaries(dirs, summary_row, processes=8):
+...     print s
+'''
+
+import os
+import numpy as np
+from multiprocessing import Pool
+from outcar import get_outcar_offsets, read_outcar_lines, read_outcar_tail
+from jasp_status import scan_directory
+from jasp_index import read_oszicar_energy, read_poscar_formula
+
+import logging
+log = logging.getLogger('Jasp')
+
+TABLE_HEADER = '{0:15s} {1:>14s} {2:>9s} {3:>10s}  {4}'.format(
+    'state', 'energy (eV)', 'fmax', 'elapsed', 'path')
+
+
+def summarize(vaspdir, fmt='text'):
+    '''Return the summary of the calculation in vaspdir as a string.
+
+    fmt is text, python, json, pretty-json or xml. Errors are returned
+    as the summary, so one bad directory does not stop the others.
+    '''
+    from jasp import jasp
+    try:
+        with jasp(vaspdir) as calc:
+            if fmt == 'python':
+                return repr(calc)
+            elif fmt == 'json':
+                return calc.json
+            elif fmt == 'pretty-json':
+                return calc.pretty_json
+            elif fmt == 'xml':
+                return calc.xml
+            return str(calc)
+    except Exception as e:
+        return '{0}: {1}: {2}'.format(vaspdir, e.__class__.__name__, e)
+
+
+def read_elapsed_time(fname='OUTCAR'):
+    '''Return the elapsed time in seconds at the end of fname, or None.'''
+    for line in read_outcar_tail(8, fname):
+        if 'Elapsed time (sec):' in line:
+            return float(line.split(':')[1])
+    return None
+
+
+def read_fmax(fname='OUTCAR', natoms=None):
+    '''Return the largest force on an atom in the last ionic step.
+
+    Constraints are not taken into account. Returns None if there are
+    no forces in fname.
+    '''
+    offsets = get_outcar_offsets('forces', fname)
+    if not offsets or not natoms:
+        return None
+    # the header, a line of dashes, then one line per atom
+    lines = read_outcar_lines(offsets[-1], natoms + 2, fname)[2:]
+    forces = np.array([[float(x) for x in line.split()[3:6]]
+                       for line in lines])
+    return np.sqrt((forces ** 2).sum(axis=1)).max()
+
+
+def summary_row(vaspdir):
+    '''Return a line with the state, energy, fmax and elapsed time.
+
+    The queue is not asked, so a calculation in the queue shows the
+    state of its files.
+    '''
+    state, jobid = scan_directory(vaspdir)
+    energy = fmax = elapsed = None
+    try:
+        energy = read_oszicar_energy(os.path.join(vaspdir, 'OSZICAR'))
+    except (OSError, IOError, IndexError, ValueError):
+        pass
+
+    outcar = os.path.join(vaspdir, 'OUTCAR')
+    if os.path.exists(outcar):
+        try:
+            natoms = read_poscar_formula(os.path.join(vaspdir, 'POSCAR'))[1]
+            fmax = read_fmax(outcar, natoms)
+        except (IOError, IndexError, ValueError):
+            pass
+        elapsed = read_elapsed_time(outcar)
+
+    def fmt(value, spec):
+        return '-' if value is None else spec.format(value)
+
+    return '{0:15s} {1:>14s} {2:>9s} {3:>10s}  {4}'.format(
+        state, fmt(energy, '{0:.4f}'), fmt(fmax, '{0:.3f}'),
+        fmt(elapsed, '{0:.0f}'), vaspdir)
+
+
+def iter_summaries(dirs, func=summarize, processes=1):
+    '''Yield func(d) for each d in dirs, in order, as they are done.
+
+    With processes > 1 the directories are summarized in a pool of
+    processes, so func must be picklable, e.g. a module function or a
+    functools.partial of one.
+    '''
+    if processes <= 1:
+        for d in dirs:
+            yield func(d)
+        return
+
+    pool = Pool(processes)
+    try:
+        # imap keeps the order, and yields each result when it and all
+        # results before it are ready
+        for result in pool.imap(func, dirs):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,229 @@
+'''Run many small calculations in one allocation.
+
+Small calculations finish in minutes but may wait in the queue for
+hours. A task farm is one job that runs a list of vasp directories on
+the cores of its allocation. Each directory runs on
+JASPRC['multiprocessing.cores_per_process'] cores. As many directories
+run at the same time as there are free cores, and a new directory
+starts whenever one finishes.
+
+Inside a job, run the farm with the jaspfarm command:
+
+jaspfarm dir1 dir2 dir3 ...
+
+or submit calculations as a farm with a task_farm block, which works
+like job_array:
+
+with task_farm():
+    for d in dirs:
+        with jasp(d, ...) as calc:
+            try:
+                calc.calculate()
+            except (VaspSubmitted, VaspQueued):
+                pass
+
+Each directory runs runjasp.py, like a job of its own, so the walltime
+is recorded and failures are recovered as usual. The hosts of a task
+are in a file in a temporary directory, JASP_FARM_HOSTS in the
+environment of runjasp.py. The exit code, hosts and timing of each
+directory are written to taskfarm.json in the directory the farm runs
+in.
+'''
+
+import json
+import os
+import pipes
+import shutil
+import socket
+import tempfile
+import time
+from collections import Counter
+from subprocess import Popen
+from jasprc import JASPRC
+from scheduler import *
+
+import logging
+log = logging.getLogger('Jasp')
+
+
+def _take_slots(free, n):
+    '''Remove n slots from the list free and return them.
+
+    If possible all n slots are on the same host.
+    '''
+    counts = Counter(free)
+    for host, count in counts.most_common():
+        if count >= n:
+            slots = [host] * n
+            break
+    else:
+        slots = free[:n]
+
+    for host in slots:
+        free.remove(host)
+    return slots
+
+
+def get_task_command(slots, hostfile):
+    '''Return the command to run vasp on the hosts in slots.
+
+    A task on one core of this host runs the serial vasp. Other tasks
+    run the parallel vasp with mpirun on hostfile, the machinefile with
+    the hosts in slots.
+    '''
+    local = [socket.gethostname(), 'localhost']
+    if len(slots) == 1 and slots[0] in local + [socket.getfqdn()]:
+        return JASPRC['vasp.executable.serial']
+
+    return 'mpirun -np {0} -machinefile {1} {2}'.format(
+        len(slots), pipes.quote(hostfile), JASPRC['vasp.executable.parallel'])
+
+
+def get_cores_per_task(cores_per_task=None):
+    '''Return cores_per_task, or the default number of cores per task.
+
+    The default is JASPRC['multiprocessing.cores_per_process'], or 1 if
+    that is not set.
+    '''
+    if cores_per_task is None:
+        cores_per_task = JASPRC.get('multiprocessing.cores_per_process',
+                                    'None')
+        if cores_per_task in [None, 'None']:
+            cores_per_task = 1
+    return int(cores_per_task)
+
+
+def run_task_farm(vaspdirs, cores_per_task=None, nodes=None,
+                  logfile='taskfarm.json', poll=1.0):
+    '''Run runjasp.py in each of vaspdirs, as many at a time as cores allow.
+
+    cores_per_task defaults to JASPRC['multiprocessing.cores_per_process'],
+    or 1 if that is not set. nodes is a list with a hostname for each
+    core, and defaults to the nodes of the job we are in.
+
+    The output of vasp goes to vasp.out in each directory. Returns a
+    dictionary {vaspdir: result}, where result has the exitcode, hosts,
+    start and end time and walltime of the task. It is also written to
+    logfile, unless logfile is None.
+    '''
+    cores_per_task = get_cores_per_task(cores_per_task)
+
+    if nodes is None:
+        scheduler = detect_scheduler()
+        if scheduler is None or not scheduler.get_nodes():
+            nodes = ['localhost']
+        else:
+            nodes = scheduler.get_nodes()
+
+    if cores_per_task > len(nodes):
+        raise Exception('{0} cores per task, but only {1} cores in '
+                        'this job'.format(cores_per_task, len(nodes)))
+
+    free = list(nodes)
+    pending = [os.path.abspath(d) for d in vaspdirs]
+    running = []  # (process, vaspdir, slots)
+    results = {}
+    hostdir = tempfile.mkdtemp(prefix='jaspfarm-')
+
+    log.info('task farm of {0} directories on {1} cores'.format(
+        len(pending), len(nodes)))
+
+    try:
+        while pending or running:
+            changed = False
+            # start tasks until the cores are busy
+            while pending and len(free) >= cores_per_task:
+                changed = True
+                vaspdir = pending.pop(0)
+                slots = _take_slots(free, cores_per_task)
+                hostfile = os.path.join(hostdir,
+                                        'hosts-{0}'.format(len(results)))
+                with open(hostfile, 'w') as f:
+                    f.write('\n'.join(slots) + '\n')
+                env = dict(os.environ, JASP_FARM_HOSTS=hostfile)
+                log.debug('{0}: runjasp.py on {1}'.format(vaspdir, slots))
+                with open(os.path.join(vaspdir, 'vasp.out'), 'w') as out:
+                    p = Popen(['runjasp.py'], cwd=vaspdir, env=env,
+                              stdout=out, stderr=out)
+                results[vaspdir] = {'hosts': slots,
+                                    'start': time.time()}
+                running.append((p, vaspdir, slots))
+
+            time.sleep(poll)
+
+            for task in running[:]:
+                p, vaspdir, slots = task
+                if p.poll() is None:
+                    continue
+                running.remove(task)
+                changed = True
+                free += slots
+                result = results[vaspdir]
+                result['end'] = time.time()
+                result['walltime'] = result['end'] - result['start']
+                result['exitcode'] = p.returncode
+                log.info('{0} finished with exit code {1} in {2:1.0f} '
+                         's'.format(vaspdir, p.returncode,
+                                    result['walltime']))
+
+            if changed and logfile is not None:
+                with open(logfile, 'w') as f:
+                    json.dump(results, f, indent=2, sort_keys=True)
+    finally:
+        shutil.rmtree(hostdir)
+
+    return results
+
+
+class task_farm(job_array):
+    '''Context manager to submit calculations as one task farm job.
+
+    Calculations that would be submitted in the block are collected,
+    and submitted as one job that runs jaspfarm on all of them. The
+    job asks for the resources in JASPRC as usual, so set queue.nodes
+    and queue.ppn for the whole farm. Each directory gets a jobid file
+    with the jobid of the farm.
+    '''
+
+    def __init__(self, jobname='jasp-farm', cores_per_task=None):
+        job_array.__init__(self, jobname)
+        self.cores_per_task = cores_per_task
+
+    def get_ncores(self):
+        '''Each directory runs on cores_per_task cores.'''
+        return get_cores_per_task(self.cores_per_task)
+
+    def get_elapsed(self):
+        '''Return the predicted time of the farm in seconds, or None.
+
+        The farm runs as many calculations at a time as there are tasks
+        that fit on its cores. A new one starts whenever one finishes,
+        so it is done at most the longest calculation after the work
+        per task slot.
+        '''
+        elapsed = [self.elapsed.get(vaspdir) for vaspdir in self.directories]
+        if not elapsed or None in elapsed:
+            return None
+        cores = int(JASPRC['queue.nodes']) * int(JASPRC['queue.ppn'])
+        slots = max(1, cores // self.get_ncores())
+        return sum(elapsed) / slots + max(elapsed)
+
+    def submit(self):
+        '''Submit the farm and write the jobid files.'''
+        cmd = 'jaspfarm'
+        if self.cores_per_task is not None:
+            cmd += ' -n {0}'.format(self.cores_per_task)
+        cmd += ''.join(' \\\n    {0}'.format(pipes.quote(vaspdir))
+                       for vaspdir in self.directories)
+
+        body = 'cd {0}\n{1}\n#end'.format(pipes.quote(os.getcwd()), cmd)
+        self.jobid = get_scheduler().submit(job_script(body), self.jobname,
+                                            walltime=self.get_walltime())
+        log.debug('submitted {0} directories as {1}'.format(
+            len(self.directories), self.jobid))
+
+        for vaspdir in self.directories:
+            with open(os.path.join(vaspdir, 'jobid'), 'w') as f:
+                f.write(self.jobid)
+        add_job_to_snapshot(self.jobid)
+        return self.jobid
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+from jasp import *
+from nose import *
+import shutil
+
+import jasp as jaspmod
+jaspdir = os.path.join(os.path.dirname(jaspmod.__file__))
+
+
+def setup_func():
+    "set up test fixtures"
+    os.chdir(os.path.join(jaspdir, 'tests'))
+    if os.path.isdir('Fe-bcc-U'):
+        shutil.rmtree('Fe-bcc-U')
+    shutil.copytree('ref/Fe-bcc-U', 'Fe-bcc-U')
+
+
+def teardown_func():
+    "tear down test fixtures"
+    os.chdir(os.path.join(jaspdir, 'tests'))
+    shutil.rmtree('Fe-bcc-U')
+
+
+@with_setup(setup_func, teardown_func)
+def test_cache():
+    '''results are cached in the directory, and the cache is not used
+    when the OUTCAR changes.'''
+    os.chdir(os.path.join(jaspdir, 'tests'))
+    with jasp('Fe-bcc-U') as calc:
+        energy = calc.read_energy()
+        fingerprint = output_fingerprint()
+        assert read_cache('read_energy', fingerprint) == (True, energy)
+        assert os.path.isdir(CACHE_DIR)
+
+        # a cached value is returned without reading the OUTCAR
+        write_cache('read_energy', fingerprint, [1.0, 2.0])
+        assert calc.read_energy() == [1.0, 2.0]
+
+        os.utime('OUTCAR', (0, 0))
+        assert calc.read_energy() == energy
+        assert len(os.listdir(CACHE_DIR)) == len(set(
+            f.split('-')[0] for f in os.listdir(CACHE_DIR)))
+
+
+def test_cache_db():
+    '''the least recently used entries are evicted from the database.'''
+    import tempfile
+    tmpdir = tempfile.mkdtemp()
+    JASPRC['cache.db'] = os.path.join(tmpdir, 'cache.db')
+    try:
+        fingerprint = [(1, 2, 3.0), None]
+        write_cache_db('read_energy', fingerprint, [1.0, 2.0], 'a')
+        assert read_cache_db('read_energy', fingerprint, 'a') == (True,
+                                                                  [1.0, 2.0])
+        assert read_cache_db('read_energy', [None, None], 'a') == (False,
+                                                                   None)
+
+        from jasp.cache import _pack
+        size = len(_pack(np.zeros((10, 3))))
+        JASPRC['cache.db.size'] = 2 * size
+        write_cache_db('read_forces', fingerprint, np.zeros((10, 3)), 'b')
+        write_cache_db('read_forces', fingerprint, np.ones((10, 3)), 'c')
+        # 'a' is the least recently used, so it is evicted first
+        assert not read_cache_db('read_energy', fingerprint, 'a')[0]
+        found, forces = read_cache_db('read_forces', fingerprint, 'c')
+        assert found and (forces == 1).all()
+
+        # a hit only updates an access time older than cache.db.touch
+        con = get_cache_db()
+        def accessed():
+            return con.execute('''SELECT accessed FROM results
+                                  WHERE vaspdir = ?''',
+                               (os.path.abspath('c'),)).fetchone()[0]
+        with con:
+            con.execute('UPDATE results SET accessed = 1000')
+        read_cache_db('read_forces', fingerprint, 'c')
+        assert accessed() > 1000
+        touched = accessed()
+        read_cache_db('read_forces', fingerprint, 'c')
+        assert accessed() == touched
+        JASPRC['cache.db.touch'] = 0
+        time.sleep(0.01)
+        read_cache_db('read_forces', fingerprint, 'c')
+        assert accessed() > touched
+    finally:
+        JASPRC['cache.db.touch'] = 3600
+        JASPRC['cache.db'] = 'None'
+        JASPRC['cache.db.size'] = 1000000000
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+from jasp import *
+from jasp.utils import get_jasp_dirs
+from nose import *
+import shutil
+import tempfile
+
+BANNER = (' General timing and accounting informations for this job:\n'
+          ' ========================================================\n')
+
+
+def touch(*path):
+    fname = os.path.join(tmpdir, *path)
+    if not os.path.isdir(os.path.dirname(fname)):
+        os.makedirs(os.path.dirname(fname))
+    with open(fname, 'w') as f:
+        f.write(BANNER if path[-1] == 'OUTCAR' else '')
+
+
+def setup():
+    global tmpdir
+    tmpdir = tempfile.mkdtemp()
+    for d in ['a', 'b/c', 'b/d/e', '.hidden/f']:
+        for fname in ['POSCAR', 'INCAR', 'KPOINTS', 'POTCAR']:
+            touch(d, fname)
+    touch('a', 'OUTCAR')
+    # NEB
+    for fname in ['INCAR', 'KPOINTS', 'POTCAR', '00/POSCAR', '01/POSCAR']:
+        touch('neb', fname)
+    # not a calculation
+    touch('b', 'INCAR')
+    os.symlink(os.path.join(tmpdir, 'a'), os.path.join(tmpdir, 'link'))
+
+
+def teardown():
+    shutil.rmtree(tmpdir)
+
+
+def test_isavaspdir():
+    assert isavaspdir(os.path.join(tmpdir, 'a'))
+    assert isavaspdir(os.path.join(tmpdir, 'neb'))
+    assert not isavaspdir(os.path.join(tmpdir, 'b'))
+    assert not isavaspdir(os.path.join(tmpdir, 'neb', '00'))
+
+
+def test_walk():
+    '''all calculations are found, in any order.'''
+    found = sorted(os.path.relpath(d, tmpdir)
+                   for d in iter_calculation_dirs(tmpdir, threads=3))
+    assert found == ['a', 'b/c', 'b/d/e', 'neb'], found
+
+    found = list(iter_calculation_dirs([os.path.join(tmpdir, 'b')],
+                                       finished=True))
+    assert found == []
+    assert get_jasp_dirs(tmpdir) == [os.path.join(tmpdir, 'a')]
+
+
+def test_stream():
+    '''the walk can be stopped after the first directory.'''
+    walker = iter_calculation_dirs(tmpdir)
+    first = next(walker)
+    walker.close()
+    assert isavaspdir(first)
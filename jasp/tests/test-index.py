@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+from jasp import *
+from nose import *
+import shutil
+import tempfile
+
+POSCAR = '''C O
+ 1.0
+ 6.0 0.0 0.0
+ 0.0 6.0 0.0
+ 0.0 0.0 6.0
+ 1 2
+Cartesian
+ 0.0 0.0 0.0
+ 1.1 0.0 0.0
+ 2.2 0.0 0.0
+'''
+
+OSZICAR = '''DAV:   1     0.1E+02    0.1E+02   -0.3E+03    16   0.6E+02
+   1 F= -.10E+02 E0= -.12E+02  d E =-.10E+02
+'''
+
+
+def make_calc(name, energy=True):
+    d = os.path.join(tmpdir, 'tree', name)
+    os.makedirs(d)
+    files = {'POSCAR': POSCAR, 'INCAR': 'NSW = 0\n', 'KPOINTS': '',
+             'POTCAR': '', 'METADATA': json.dumps({'uuid': name})}
+    if energy:
+        files['OSZICAR'] = OSZICAR
+    for fname, content in files.items():
+        with open(os.path.join(d, fname), 'w') as f:
+            f.write(content)
+    return d
+
+
+def setup():
+    global tmpdir, db
+    tmpdir = tempfile.mkdtemp()
+    db = os.path.join(tmpdir, 'index.sqlite')
+    make_calc('a')
+    make_calc('b/c', energy=False)
+    os.makedirs(os.path.join(tmpdir, 'tree', 'empty'))
+
+
+def teardown():
+    shutil.rmtree(tmpdir)
+
+
+def test_formula():
+    fname = os.path.join(tmpdir, 'tree', 'a', 'POSCAR')
+    assert read_poscar_formula(fname) == ('CO2', 3)
+
+
+def test_refresh():
+    '''only calculations that changed are read again.'''
+    tree = os.path.join(tmpdir, 'tree')
+    assert refresh_index(tree, db=db) == 2
+    rows = list_calculations(tree, db=db)
+    assert [row['vaspdir'] for row in rows] == [os.path.join(tree, 'a'),
+                                                os.path.join(tree, 'b/c')]
+    assert rows[0]['uuid'] == 'a'
+    assert rows[0]['formula'] == 'CO2'
+    assert rows[0]['natoms'] == 3
+    assert rows[0]['energy'] == -12
+    assert rows[0]['state'] == 'initialized'
+    assert rows[1]['energy'] is None
+
+    # nothing changed
+    assert refresh_index(tree, db=db) == 0
+
+    # an output changed, a calculation was added and one removed
+    with open(os.path.join(tree, 'b/c', 'OSZICAR'), 'w') as f:
+        f.write(OSZICAR)
+    make_calc('empty/d')
+    shutil.rmtree(os.path.join(tree, 'a'))
+    assert refresh_index(tree, db=db) == 2
+    rows = list_calculations(tree, db=db)
+    assert [row['vaspdir'] for row in rows] == [os.path.join(tree, 'b/c'),
+                                                os.path.join(tree, 'empty/d')]
+    assert rows[0]['energy'] == -12
+
+    assert list_calculations(os.path.join(tree, 'b'), db=db)[0]['uuid'] == 'b/c'
+    assert len(list_calculations(tree, state='finished-ok', db=db)) == 0
+    # a directory with the root as a prefix is not under it
+    assert list_calculations(tree + '-other', db=db) == []
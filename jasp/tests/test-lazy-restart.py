@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+from jasp import *
+from nose import *
+import shutil
+
+import jasp as jaspmod
+jaspdir = os.path.join(os.path.dirname(jaspmod.__file__))
+
+
+def setup_func():
+    "set up test fixtures"
+    os.chdir(os.path.join(jaspdir, 'tests'))
+    if os.path.isdir('Fe-bcc-U'):
+        shutil.rmtree('Fe-bcc-U')
+    shutil.copytree('ref/Fe-bcc-U', 'Fe-bcc-U')
+
+
+def teardown_func():
+    "tear down test fixtures"
+    os.chdir(os.path.join(jaspdir, 'tests'))
+    shutil.rmtree('Fe-bcc-U')
+    JASPRC['restart.lazy'] = False
+
+
+@with_setup(setup_func, teardown_func)
+def test():
+    '''the lazy restart should give the same results as the normal one,
+    and only read them when they are used.'''
+    os.chdir(os.path.join(jaspdir, 'tests'))
+    JASPRC['restart.lazy'] = False
+    with jasp('Fe-bcc-U') as calc:
+        atoms = calc.get_atoms()
+        energy = atoms.get_potential_energy()
+        forces = atoms.get_forces()
+        read = [calc.version, calc.niter, calc.sigma, calc.nelect]
+        old = dict((name, getattr(calc, name).copy()) for name in
+                   ['old_float_params', 'old_int_params',
+                    'old_string_params'])
+
+    JASPRC['restart.lazy'] = True
+    with jasp('Fe-bcc-U') as calc:
+        assert 'energy_zero' not in calc.__dict__
+        assert 'forces' not in calc.__dict__
+        atoms = calc.get_atoms()
+        assert atoms.get_potential_energy() == energy
+        assert 'forces' not in calc.__dict__
+        assert (atoms.get_forces() == forces).all()
+
+        assert 'nelect' not in calc.__dict__
+        assert [calc.version, calc.niter, calc.sigma, calc.nelect] == read
+        # nbands is read lazily, and is not in the int_params until then
+        old['old_int_params'].pop('nbands')
+        calc.old_int_params.pop('nbands')
+        for name, value in old.items():
+            assert getattr(calc, name) == value, name
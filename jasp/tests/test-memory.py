@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+from jasp import *
+from nose import *
+from ase import Atoms
+import shutil
+import tempfile
+
+OUTCAR = ''' running on    4 total cores
+ Dimension of arrays:
+   k-points           NKPTS =     10   k-points in BZ     NKDIM =     10   number of bands    NBANDS=     24
+   number of dos      NEDOS =    301   number of ions     NIONS =      4
+   total plane-waves  NPLWV =  13824
+   dimension x,y,z NGX =    24 NGY =   24 NGZ =   24
+   dimension x,y,z NGXF=    48 NGYF=   48 NGZF=   48
+   ISPIN  =      2    spin polarized calculation?
+   LREAL  =      F    real-space projection
+ maximum and minimum number of plane-waves per node :       800      790
+ maximum number of plane-waves:      800
+ total amount of memory used by VASP MPI-rank0    52345. kBytes
+ Maximum memory used (kb):       99999.
+'''
+
+
+def setup():
+    global tmpdir, old
+    tmpdir = tempfile.mkdtemp()
+    with open(os.path.join(tmpdir, 'OUTCAR'), 'w') as f:
+        f.write(OUTCAR)
+    old = JASPRC['memory.table']
+    JASPRC['memory.table'] = os.path.join(tmpdir, 'memory.jsonl')
+
+
+def teardown():
+    JASPRC['memory.table'] = old
+    shutil.rmtree(tmpdir)
+
+
+def test_read():
+    params = read_memory_parameters(os.path.join(tmpdir, 'OUTCAR'))
+    assert params == {'ncores': 4, 'nkpts': 10, 'nbands': 24, 'nions': 4,
+                      'ngf': 48 ** 3, 'ispin': 2, 'lreal': False,
+                      'npw': 800, 'memory': 52345.}, params
+
+    add_memory_record(os.path.join(tmpdir, 'OUTCAR'))
+    assert read_memory_table() == {tmpdir: params}
+
+
+def test_processes():
+    '''processes adding records at once do not lose each other's.'''
+    from multiprocessing import Pool
+    outcars = []
+    for i in range(16):
+        d = os.path.join(tmpdir, 'process-{0}'.format(i))
+        os.makedirs(d)
+        shutil.copy(os.path.join(tmpdir, 'OUTCAR'), d)
+        outcars.append(os.path.join(d, 'OUTCAR'))
+    pool = Pool(8)
+    try:
+        pool.map(add_memory_record, outcars)
+    finally:
+        pool.close()
+    table = read_memory_table()
+    assert all(os.path.dirname(outcar) in table for outcar in outcars)
+
+
+def test_fit():
+    '''the model is calibrated on the recorded calculations.'''
+    records = []
+    for i in range(10):
+        params = {'ncores': 1 + i % 3, 'nkpts': 1 + i, 'nbands': 10 + 5 * i,
+                  'nions': 2 + i, 'ngf': (20 + 4 * i) ** 3,
+                  'ispin': 1 + i % 2, 'lreal': False, 'npw': 100 * (i + 1)}
+        scale = np.array([1.0, 2.0, 0.5, 1.5])
+        params['memory'] = np.dot(MEMORY_COEFFICIENTS * scale,
+                                  memory_terms(params))
+        records.append(params)
+
+    assert np.allclose(fit_memory_model(records),
+                       MEMORY_COEFFICIENTS * scale)
+    # with a few records all terms are scaled together
+    coefficients = fit_memory_model(records[:2])
+    ratio = coefficients / MEMORY_COEFFICIENTS
+    assert np.allclose(ratio, ratio[0])
+    assert np.allclose(fit_memory_model([]), MEMORY_COEFFICIENTS)
+
+
+def test_estimate():
+    '''the quantities are estimated from the inputs, without vasp.'''
+    atoms = Atoms('CO', [[0, 0, 0], [1.1, 0, 0]], cell=(6, 6, 6))
+    with jasp(os.path.join(tmpdir, 'co'),
+              xc='PBE', encut=350, kpts=(4, 4, 4), atoms=atoms) as calc:
+        params = estimate_memory_parameters(calc, ncores=2)
+        memory = estimate_memory(calc, ncores=2)
+
+    assert params['nions'] == 2
+    assert params['nkpts'] == 32
+    # 10 valence electrons
+    assert params['nbands'] == 6
+    # 28 points on the coarse grid for a 6 A cell at 350 eV
+    assert params['ngf'] == 56 ** 3
+    assert 3000 < params['npw'] < 3500
+    assert memory > MEMORY_COEFFICIENTS[0]
+    # nothing was written to the directory
+    assert not os.path.exists(os.path.join(tmpdir, 'co', 'OUTCAR'))
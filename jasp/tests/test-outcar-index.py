@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+from jasp import *
+from nose import *
+import shutil
+import tempfile
+
+import jasp as jaspmod
+jaspdir = os.path.join(os.path.dirname(jaspmod.__file__))
+
+
+def setup():
+    '''copy the OUTCAR, so the index file is not written into ref.'''
+    global tmpdir, outcar
+    tmpdir = tempfile.mkdtemp()
+    outcar = os.path.join(tmpdir, 'OUTCAR')
+    shutil.copy(os.path.join(jaspdir, 'tests', 'ref', 'Fe-bcc-U', 'OUTCAR'),
+                outcar)
+
+
+def teardown():
+    shutil.rmtree(tmpdir)
+
+
+def test_offsets():
+    '''the index should point at the same lines a linear scan finds.'''
+    with open(outcar, 'rb') as f:
+        lines = f.readlines()
+
+    expected = [line for line in lines
+                if line.startswith('  free energy    TOTEN  =')]
+
+    offsets = get_outcar_offsets('energy', outcar)
+    assert len(offsets) == len(expected)
+    found = [read_outcar_lines(offset, 1, outcar)[0] for offset in offsets]
+    assert found == expected
+
+
+def test_lines_before():
+    with open(outcar, 'rb') as f:
+        lines = f.readlines()
+
+    for i, line in enumerate(lines):
+        if line.startswith('  free energy    TOTEN  ='):
+            last = i
+
+    offset = get_outcar_offsets('energy', outcar)[-1]
+    assert read_outcar_lines_before(offset, 10, outcar) == lines[last - 10:last]
+
+
+def test_index_is_cached():
+    index = get_outcar_index(outcar)
+    assert get_outcar_index(outcar) is index
+
+
+def test_index_file():
+    '''a new process should read the index from the sidecar file.'''
+    index = get_outcar_index(outcar)
+    idxfile = os.path.join(os.path.dirname(outcar), OUTCAR_INDEX_FILE)
+    assert os.path.exists(idxfile)
+    assert read_outcar_index_file(outcar) == index
+
+
+def test_tail():
+    with open(outcar, 'rb') as f:
+        lines = f.readlines()
+
+    assert read_outcar_tail(20, outcar) == lines[-20:]
+    # small blocks force several reads backwards
+    assert read_outcar_tail(20, outcar, blocksize=16) == lines[-20:]
+    assert read_outcar_tail(len(lines) + 5, outcar) == lines
+    assert read_outcar_tail(len(lines) + 5, outcar, blocksize=16) == lines
+    assert read_outcar_tail(0, outcar) == []
+    assert read_outcar_lines_before(1000, 0, outcar) == []
+
+
+def test_scan_errors():
+    '''VASP changed the bands in the simple-co calculation.'''
+    co = os.path.join(jaspdir, 'tests', 'molecules', 'simple-co', 'OUTCAR')
+    with open(co, 'rb') as f:
+        lines = f.readlines()
+
+    errors = scan_outcar_errors(co)
+    changed = [e for e in errors if e[0] == 'bands changed']
+    assert len(changed) == 1
+
+    kind, lineno, offset, line = changed[0]
+    assert lines[lineno - 1].rstrip('\n') == line
+    assert read_outcar_lines(offset, 1, co)[0] == lines[lineno - 1]
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+from jasp import *
+from nose import *
+from ase import Atoms
+import shutil
+import tempfile
+
+
+def setup():
+    global tmpdir, old
+    tmpdir = tempfile.mkdtemp()
+    old = JASPRC['parallel.auto']
+    JASPRC['parallel.auto'] = True
+
+
+def teardown():
+    JASPRC['parallel.auto'] = old
+    shutil.rmtree(tmpdir)
+
+
+def test_choose():
+    '''the tags divide the cores, k-points and bands.'''
+    for nkpts, nbands, ncores, ppn in [(10, 48, 16, 16), (1, 100, 32, 16),
+                                       (3, 24, 24, 12), (40, 7, 64, 32)]:
+        tags = choose_parallelization(nkpts, nbands, ncores, ppn, 'fast',
+                                      nbands_fixed=True)
+        kpar, ncore = tags['kpar'], tags['ncore']
+        assert is_valid(kpar, ncore, nkpts, ncores, ppn, nbands), tags
+        assert 'nsim' in tags
+
+    assert choose_parallelization(10, 48, 16, 16) == {'kpar': 4, 'ncore': 2}
+    # one k-point, all cores on the bands
+    assert choose_parallelization(1, 48, 16, 8)['kpar'] == 1
+    # 7 bands can only be in one band group
+    tags = choose_parallelization(1, 7, 16, 16, nbands_fixed=True)
+    assert tags['ncore'] == 16
+    # VASP 4
+    assert choose_parallelization(10, 48, 16, 16, npar=True) == {'npar': 4}
+
+
+def test_measured():
+    '''settings that ran faster on similar calculations are used.'''
+    records = [{'ncores': 16, 'nkpts': 10, 'nbands': 48, 'nions': 8,
+                'kpar': 2, 'ncore': 4, 'loop': 10.0},
+               {'ncores': 16, 'nkpts': 11, 'nbands': 50, 'nions': 8,
+                'kpar': 1, 'ncore': 2, 'loop': 5.0},
+               # not similar
+               {'ncores': 16, 'nkpts': 10, 'nbands': 480, 'nions': 80,
+                'kpar': 4, 'ncore': 1, 'loop': 1.0}]
+    tags = choose_parallelization(10, 48, 16, 16, nions=8, records=records)
+    assert tags == {'kpar': 1, 'ncore': 2}
+    assert measured_parallelization({'nkpts': 10, 'nbands': 48, 'nions': 8},
+                                    16, records[:1]) is None
+
+
+def test_bad_history():
+    '''a history that cannot be read falls back to the rules.'''
+    old = JASPRC['walltime.history']
+    JASPRC['walltime.history'] = os.path.join(tmpdir, 'bad.json')
+    try:
+        with open(JASPRC['walltime.history'], 'w') as f:
+            f.write('{"/some/dir": {"nkpts": 10,')
+        assert read_walltime_history() == {}
+        assert choose_parallelization(10, 48, 16, 16) == {'kpar': 4,
+                                                          'ncore': 2}
+
+        # records without the quantities are not used either
+        with open(JASPRC['walltime.history'], 'w') as f:
+            f.write('{"/some/dir": {"ncores": 16, "loop": 1.0}}')
+        assert choose_parallelization(10, 48, 16, 16) == {'kpar': 4,
+                                                          'ncore': 2}
+    finally:
+        JASPRC['walltime.history'] = old
+
+
+def test_set():
+    '''the tags are written to the INCAR, unless they are set.'''
+    atoms = Atoms('CO', [[0, 0, 0], [1.1, 0, 0]], cell=(6, 6, 6))
+    with jasp(os.path.join(tmpdir, 'co'),
+              xc='PBE', encut=350, kpts=(4, 4, 4), atoms=atoms) as calc:
+        calc.initialize(atoms)
+        tags = set_parallelization(calc, ncores=8, ppn=8)
+        assert tags == {'kpar': 2, 'ncore': 2}
+        incar = read_incar_tags('INCAR')
+        assert incar['KPAR'] == '2' and incar['NCORE'] == '2'
+        assert read_parallelization(calc.directory) == tags
+
+        # the tags jasp chose are chosen again for other cores
+        assert get_user_parallelization(calc) == {}
+        assert set_parallelization(calc, ncores=4, ppn=4) == {'kpar': 1,
+                                                              'ncore': 2}
+        JASPRC['parallel.npar'] = True
+        try:
+            assert set_parallelization(calc, ncores=4, ppn=4) == {'npar': 2}
+        finally:
+            JASPRC['parallel.npar'] = False
+        incar = read_incar_tags(os.path.join(calc.directory, 'INCAR'))
+        assert 'KPAR' not in incar and 'NCORE' not in incar, incar
+
+        # set by the user
+        calc.set(npar=1)
+        assert get_user_parallelization(calc) == {'npar': 1}
+        assert set_parallelization(calc, ncores=8, ppn=8) == {}
+        # serial
+        calc.set(npar=None)
+        assert set_parallelization(calc, ncores=1) == {}
+
+        # off
+        JASPRC['parallel.auto'] = False
+        try:
+            assert set_parallelization(calc, ncores=8, ppn=8) == {}
+        finally:
+            JASPRC['parallel.auto'] = True
+
+        # set in the script, even to the value jasp chose
+        calc.set(npar=2)
+        assert get_user_parallelization(calc) == {}
+        calc.kwargs = {'npar': 2}
+        assert get_user_parallelization(calc) == {'npar': 2}
+
+
+def test_job_cores():
+    '''multiprocessing on one node runs vasp on cores_per_process cores.'''
+    keys = ['queue.nodes', 'queue.ppn', 'multiprocessing.cores_per_process']
+    old = [JASPRC[key] for key in keys]
+    try:
+        JASPRC.update(zip(keys, [1, 16, 'None']))
+        assert get_job_cores() == 16
+        JASPRC['multiprocessing.cores_per_process'] = 4
+        assert get_job_cores() == 4
+        JASPRC['queue.nodes'] = 2
+        assert get_job_cores() == 32
+    finally:
+        JASPRC.update(zip(keys, old))
+
+
+def test_farm():
+    '''calculations in a task farm are set up for cores_per_task.'''
+    keys = ['scheduler', 'mode', 'queue.nodes', 'queue.ppn']
+    old = [JASPRC[key] for key in keys]
+    JASPRC.update(zip(keys, ['local', 'queue', 1, 16]))
+    atoms = Atoms('CO', [[0, 0, 0], [1.1, 0, 0]], cell=(6, 6, 6))
+    try:
+        for cores_per_task in [4, 1]:
+            vaspdir = os.path.join(tmpdir, 'farm-{0}'.format(cores_per_task))
+            with task_farm(cores_per_task=cores_per_task) as farm:
+                with jasp(vaspdir, xc='PBE', encut=350, kpts=(4, 4, 4),
+                          atoms=atoms) as calc:
+                    try:
+                        calc.calculate()
+                    except VaspSubmitted:
+                        pass
+                assert farm.directories == [vaspdir]
+                # we only need the INCAR
+                farm.directories = []
+
+            incar = read_incar_tags(os.path.join(vaspdir, 'INCAR'))
+            if cores_per_task == 1:
+                assert 'KPAR' not in incar and 'NCORE' not in incar
+            else:
+                assert int(incar['KPAR']) * int(incar['NCORE']) <= 4, incar
+    finally:
+        JASPRC.update(zip(keys, old))
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+from jasp import *
+from jasp.POTCAR import _potcar_info_cache
+from nose import *
+import gzip
+import shutil
+import tempfile
+
+PD = '''  PAW_PBE Pd 05Jan2001
+   TITEL  = PAW_PBE Pd 05Jan2001
+   POMASS =  106.420; ZVAL   =   10.000    mass and valenz
+   ENMAX  =  250.925; ENMIN  =  188.194 eV
+ End of Dataset
+'''
+
+# PD compressed with compress(1)
+PD_Z = ('1f9d902040400972e50b14214504920101a38692306e64c08011434140105492'
+        '5029c224600f81040d2254c8d0214489142d0684f2a449902953407c04110386'
+        '0d173424ee00a1c54a908e1e2fd6743111c645106dc2cc990302e2423b61d894'
+        '71a3472588224e5c62090a42460d182e7278dd89b54912275c63e0c0e122460e'
+        '1a20ca58b158c4cdc23766401009434769193a0a00').decode('hex')
+
+
+def setup():
+    global tmpdir
+    tmpdir = tempfile.mkdtemp()
+    with open(os.path.join(tmpdir, 'POTCAR'), 'w') as f:
+        f.write(PD)
+    with open(os.path.join(tmpdir, 'POTCAR.Z'), 'wb') as f:
+        f.write(PD_Z)
+    g = gzip.open(os.path.join(tmpdir, 'POTCAR.gz'), 'wb')
+    g.write(PD)
+    g.close()
+
+
+def teardown():
+    shutil.rmtree(tmpdir)
+
+
+def test_info():
+    info = get_potcar_info(os.path.join(tmpdir, 'POTCAR'))
+    assert info['ZVAL'] == 10.0
+    assert info['ENMAX'] == 250.925
+    assert info['ENMIN'] == 188.194
+    assert info['TITEL'] == 'PAW_PBE Pd 05Jan2001'
+    # git hash-object POTCAR
+    assert info['hash'] == sha1('blob %u\0' % len(PD) + PD).hexdigest()
+
+
+def test_compressed():
+    '''compressed POTCARs are read in-process.'''
+    assert uncompress_Z(PD_Z) == PD
+    for name in ['POTCAR.Z', 'POTCAR.gz']:
+        potcar = os.path.join(tmpdir, name)
+        assert get_ZVAL(potcar) == 10.0
+        assert get_ENMAX(potcar) == 250.925
+
+
+def test_cache():
+    potcar = os.path.join(tmpdir, 'POTCAR')
+    info = get_potcar_info(potcar)
+    assert get_potcar_info(potcar) is info
+
+    # a changed file is read again
+    with open(potcar, 'w') as f:
+        f.write(PD.replace('10.000', '12.000'))
+    os.utime(potcar, (0, 0))
+    assert get_ZVAL(potcar) == 12.0
+    assert _potcar_info_cache[os.path.abspath(potcar)][1]['ZVAL'] == 12.0
+
+
+def test_index():
+    '''POTCARs are found in the index without looking at the library.'''
+    pppath = os.path.join(tmpdir, 'library')
+    for setup, potcar in [('Pd', 'POTCAR'), ('Pd_pv', 'POTCAR.Z')]:
+        os.makedirs(os.path.join(pppath, 'potpaw_PBE', setup))
+        shutil.copy(os.path.join(tmpdir, potcar),
+                    os.path.join(pppath, 'potpaw_PBE', setup, potcar))
+
+    old = os.environ.get('VASP_PP_PATH'), JASPRC['potcar.index']
+    try:
+        os.environ['VASP_PP_PATH'] = pppath
+        JASPRC['potcar.index'] = os.path.join(tmpdir, 'index.json')
+        build_potcar_index()
+
+        pv = os.path.join(pppath, 'potpaw_PBE', 'Pd_pv', 'POTCAR.Z')
+        assert find_potcar('potpaw_PBE/Pd_pv/POTCAR') == pv
+
+        # POTCARs added after the index was built are found
+        os.makedirs(os.path.join(pppath, 'potpaw_PBE', 'Pd_sv'))
+        sv = os.path.join(pppath, 'potpaw_PBE', 'Pd_sv', 'POTCAR')
+        shutil.copy(os.path.join(tmpdir, 'POTCAR'), sv)
+        assert find_potcar('potpaw_PBE/Pd_sv/POTCAR') == sv
+
+        # and POTCARs removed from the library are not
+        shutil.rmtree(os.path.join(pppath, 'potpaw_PBE', 'Pd'))
+        assert find_potcar('potpaw_PBE/Pd/POTCAR') is None
+        assert find_potcar('potpaw_PBE/Pd/POTCAR', [pppath]) is None
+
+        index = get_potcar_index()
+        info = index['paths'][pv]
+        assert info['symbol'] == 'Pd' and info['setup'] == '_pv'
+        assert info['ZVAL'] == 10.0
+
+        # an index for another VASP_PP_PATH is not used
+        os.environ['VASP_PP_PATH'] = tmpdir
+        assert get_potcar_index() is None
+    finally:
+        if old[0] is None:
+            del os.environ['VASP_PP_PATH']
+        else:
+            os.environ['VASP_PP_PATH'] = old[0]
+        JASPRC['potcar.index'] = old[1]
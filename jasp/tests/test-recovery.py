@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+from jasp import *
+from nose import *
+import shutil
+import tempfile
+
+FINISHED = ' Voluntary context switches:         1\n'
+
+OSZICAR = '''       N       E                     dE             d eps       ncg     rms          rms(c)
+DAV:   1     0.1E+02    0.1E+02   -0.3E+03    16   0.6E+02
+DAV:   2    -0.1E+02   -0.2E+02   -0.1E+02    16   0.1E+02
+   1 F= -.10E+02 E0= -.10E+02  d E =-.10E+02
+'''
+
+
+def setup():
+    '''put a fake runjasp.py in the PATH.'''
+    global tmpdir, old_path, old_scheduler, old_mode
+    tmpdir = tempfile.mkdtemp()
+    runjasp = os.path.join(tmpdir, 'runjasp.py')
+    with open(runjasp, 'w') as f:
+        f.write('#!/bin/sh\ntouch resubmitted\n')
+    os.chmod(runjasp, 0755)
+    old_path = os.environ['PATH']
+    os.environ['PATH'] = tmpdir + ':' + old_path
+    old_scheduler = JASPRC['scheduler']
+    JASPRC['scheduler'] = 'local'
+    old_mode = JASPRC['mode']
+    JASPRC['mode'] = 'queue'
+
+
+def teardown():
+    os.environ['PATH'] = old_path
+    JASPRC['scheduler'] = old_scheduler
+    JASPRC['mode'] = old_mode
+    shutil.rmtree(tmpdir)
+    clear_queue_snapshot()
+
+
+def make_calc(name, incar, outcar, oszicar=None, output=None):
+    d = os.path.join(tmpdir, name)
+    os.makedirs(d)
+    files = {'INCAR': incar, 'OUTCAR': outcar, 'POSCAR': 'poscar\n',
+             'CONTCAR': 'contcar\n', 'OSZICAR': oszicar,
+             'vasp.out': output}
+    for fname, content in files.items():
+        if content is not None:
+            with open(os.path.join(d, fname), 'w') as f:
+                f.write(content)
+    return d
+
+
+def test_diagnose():
+    '''errors are found from the output files.'''
+    for name, incar, outcar, oszicar, output, errors in [
+        ('ok', 'NSW = 0\n', FINISHED, OSZICAR, None, []),
+        ('scf', 'NELM = 2\n', FINISHED, OSZICAR, None, ['scf']),
+        ('ionic', 'NSW = 1\nIBRION = 2\n', FINISHED, OSZICAR, None,
+         ['ionic']),
+        ('killed', 'NSW = 0\n', ' running\n', None, None, ['unfinished']),
+        ('zbrent', 'IBRION = 2\n', ' running\n', None,
+         ' ZBRENT: fatal error in bracketing\n', ['zbrent']),
+        ('bands', 'NSW = 0\n',
+         ' highest band is occupied at some k-points!\n' + FINISHED,
+         OSZICAR, None, ['highest band occupied']),
+        ('segfault', 'NSW = 0\n', 'forrtl: severe (174)\n', None, None,
+         ['crashed'])]:
+        with cd(make_calc('diagnose-' + name, incar, outcar, oszicar,
+                          output)):
+            assert diagnose() == errors, (name, diagnose())
+
+
+def test_ionic():
+    '''unconverged relaxations are left to jasp.'''
+    d = make_calc('unconverged', 'NSW = 1\nIBRION = 2\n', FINISHED, OSZICAR)
+    auto = JASPRC['recovery.auto']
+    JASPRC['recovery.auto'] = True
+    try:
+        assert diagnose(directory=d) == ['ionic']
+        assert recover(directory=d) is None
+        assert not os.path.exists(os.path.join(d, 'recovery.1'))
+    finally:
+        JASPRC['recovery.auto'] = auto
+
+
+def test_jasp():
+    '''reading a failed calculation does not change it.'''
+    d = os.path.join(tmpdir, 'Fe-base')
+    shutil.copytree('ref/Fe-base', d)
+    outcar = open(os.path.join(d, 'OUTCAR')).read()
+    with open(os.path.join(d, 'OUTCAR'), 'w') as f:
+        f.write(outcar[:outcar.index('General timing')])
+    with open(os.path.join(d, 'jobid'), 'w') as f:
+        f.write('999')
+    keys = ['recovery.auto', 'mode']
+    vals = [JASPRC[key] for key in keys]
+    JASPRC['recovery.auto'], JASPRC['mode'] = True, None
+    try:
+        try:
+            with jasp(d) as calc:
+                pass
+        except VaspSubmitted:
+            assert False, 'jasp resubmitted the calculation'
+        except Exception:
+            pass
+        assert os.path.exists(os.path.join(d, 'OUTCAR'))
+        assert not os.path.exists(os.path.join(d, 'recovery.1'))
+    finally:
+        JASPRC.update(zip(keys, vals))
+
+
+def test_fixes():
+    '''each error has a ladder of fixes.'''
+    assert fix_scf({'ALGO': 'Fast'}) == {'ALGO': 'Normal'}
+    assert fix_scf({'ALGO': 'Normal'})['AMIX'] == 0.1
+    assert fix_scf({'ALGO': 'Normal', 'AMIX': '0.1'}) == {'ALGO': 'All'}
+    assert fix_scf({'ALGO': 'All', 'AMIX': '0.1'}) is None
+    assert fix_zbrent({'IBRION': '2'}) == {'IBRION': 1}
+    assert fix_zbrent({'IBRION': '1'}) == {'IBRION': 2, 'POTIM': 0.25}
+
+    # 20% more bands, rounded up to the 4 band groups of 16 cores
+    outcar = (' running on   16 total cores\n'
+              '   number of bands    NBANDS=     24\n'
+              ' total amount of memory used by VASP MPI-rank0 1. kBytes\n')
+    with cd(make_calc('nbands', 'NCORE = 2\nKPAR = 2\n', outcar)):
+        assert fix_nbands(read_incar_tags('INCAR')) == {'NBANDS': 32}
+
+
+def test_recover():
+    '''the failed calculation is fixed and submitted again.'''
+    d = make_calc('recover', 'ALGO = Fast\nNELM = 2\n', FINISHED, OSZICAR)
+    keys = ['recovery.max_attempts', 'recovery.auto']
+    vals = [JASPRC[key] for key in keys]
+    JASPRC['recovery.max_attempts'], JASPRC['recovery.auto'] = 1, True
+    try:
+        with cd(d):
+            # scripts that only read calculations do not resubmit them
+            JASPRC['mode'] = None
+            assert recover() is None
+            assert os.path.exists('OUTCAR')
+            JASPRC['mode'] = 'queue'
+
+            jobid = recover()
+            assert jobid is not None
+            assert open('jobid').read() == jobid
+            assert read_incar_tags('INCAR')['ALGO'] == 'Normal'
+            assert open('POSCAR').read() == 'contcar\n'
+            assert os.path.exists('recovery.1/OUTCAR')
+            assert not os.path.exists('OUTCAR')
+            assert get_scheduler().wait([jobid], timeout=60)
+            assert os.path.exists('resubmitted')
+
+            # the budget is used up
+            shutil.copy('recovery.1/OUTCAR', 'OUTCAR')
+            shutil.copy('recovery.1/OSZICAR', 'OSZICAR')
+            assert recover() is None
+
+            # the script does not undo the fix
+            class Calc:
+                def set(self, **kwargs):
+                    self.kwargs = kwargs
+            calc = Calc()
+            apply_recovery_overrides(calc, {'algo': 'fast'})
+            assert calc.kwargs == {'algo': 'Normal'}
+            calc = Calc()
+            apply_recovery_overrides(calc, {'algo': 'all'})
+            assert not hasattr(calc, 'kwargs')
+    finally:
+        JASPRC.update(zip(keys, vals))
+        JASPRC['mode'] = 'queue'
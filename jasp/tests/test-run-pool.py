@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+from jasp import *
+from nose import *
+from ase import Atoms
+import shutil
+import tempfile
+
+
+def setup():
+    '''a fake serial vasp that records when it ran.'''
+    global tmpdir, old
+    tmpdir = tempfile.mkdtemp()
+    vasp = os.path.join(tmpdir, 'vasp')
+    with open(vasp, 'w') as f:
+        f.write('#!/bin/sh\n'
+                'date +%s.%N > started\n'
+                'sleep 0.5\n'
+                'date +%s.%N > finished\n')
+    os.chmod(vasp, 0755)
+    old = dict(JASPRC)
+    JASPRC.update({'vasp.executable.serial': vasp,
+                   'mode': 'run',
+                   'run.cores': 3,
+                   'run.cores_per_job': 1})
+
+
+def teardown():
+    JASPRC.clear()
+    JASPRC.update(old)
+    shutil.rmtree(tmpdir)
+
+
+def test_run_pool():
+    '''calculations in mode run are run concurrently in the pool.'''
+    handles = []
+    for i in range(6):
+        atoms = Atoms('CO', [[0, 0, 0], [1.1 + 0.01 * i, 0, 0]],
+                      cell=(6, 6, 6))
+        with jasp(os.path.join(tmpdir, 'co-{0}'.format(i)),
+                  xc='PBE', atoms=atoms) as calc:
+            handles.append(calc.calculate())
+
+    assert all(isinstance(h, RunHandle) for h in handles)
+    # implicit calculations raise like queued jobs
+    with jasp(os.path.join(tmpdir, 'co-0')) as calc:
+        assert calc.job_in_queue()
+
+    done = list(as_completed(handles, timeout=60))
+    assert sorted(done) == sorted(handles)
+    assert wait(timeout=60)
+    assert [h.exitcode for h in handles] == [0] * 6
+
+    times = [(float(open(os.path.join(h.vaspdir, 'started')).read()),
+              float(open(os.path.join(h.vaspdir, 'finished')).read()))
+             for h in handles]
+    concurrent = [len([1 for s, e in times if s <= start < e])
+                  for start, end in times]
+    assert max(concurrent) == 3
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+from jasp import *
+from nose import *
+import shutil
+import tempfile
+
+QSTAT_F = '''Job Id: 101.gilgamesh
+    Job_Name = dir1
+    job_state = R
+    queue = short
+
+Job Id: 102.gilgamesh
+    Job_Name = dir2
+    job_state = C
+    queue = short
+'''
+
+
+def setup():
+    '''put a fake qselect, qstat and runjasp.py in the PATH.
+
+    qselect lists the jobs in QSTAT_F, qstat counts how often it is run
+    and remembers its arguments, and runjasp.py writes the directory it
+    was run in.
+    '''
+    global tmpdir, old_path
+    tmpdir = tempfile.mkdtemp()
+    with open(os.path.join(tmpdir, 'qstat-output'), 'w') as f:
+        f.write(QSTAT_F)
+    qstat = os.path.join(tmpdir, 'qstat')
+    with open(qstat, 'w') as f:
+        f.write('#!/bin/sh\n'
+                'echo "$@" >> {0}/qstat-calls\n'
+                'cat {0}/qstat-output\n'.format(tmpdir))
+    os.chmod(qstat, 0755)
+    qselect = os.path.join(tmpdir, 'qselect')
+    with open(qselect, 'w') as f:
+        f.write('#!/bin/sh\n'
+                'echo "$@" > {0}/qselect-args\n'
+                'echo 101.gilgamesh\n'
+                'echo 102.gilgamesh\n'.format(tmpdir))
+    os.chmod(qselect, 0755)
+    runjasp = os.path.join(tmpdir, 'runjasp.py')
+    with open(runjasp, 'w') as f:
+        f.write('#!/bin/sh\npwd > ran-here\n')
+    os.chmod(runjasp, 0755)
+    old_path = os.environ['PATH']
+    os.environ['PATH'] = tmpdir + ':' + old_path
+
+
+def teardown():
+    os.environ['PATH'] = old_path
+    shutil.rmtree(tmpdir)
+    clear_queue_snapshot()
+
+
+def qstat_calls():
+    fname = os.path.join(tmpdir, 'qstat-calls')
+    if not os.path.exists(fname):
+        return 0
+    return len(open(fname).readlines())
+
+
+def test_parse():
+    assert parse_pbs_qstat(QSTAT_F) == {'101.gilgamesh': 'R',
+                                        '102.gilgamesh': 'C'}
+    sge = '''job-ID  prior   name       user         state submit/start at     queue                          slots ja-task-ID
+-----------------------------------------------------------------------------------------------------------------
+     17 0.55500 dir1       jkitchin     r     05/30/2014 10:53:57 all.q@compute-0-1.local            8
+     18 0.00000 dir2       jkitchin     qw    05/30/2014 10:54:01                                    8
+'''
+    assert parse_sge_qstat(sge) == {'17': 'r', '18': 'qw'}
+
+    squeue = '''1234_0 R
+1234_1 PD
+1240 R
+'''
+    assert parse_slurm_squeue(squeue) == {'1234_0': 'R', '1234_1': 'PD',
+                                          '1234': 'R', '1240': 'R'}
+
+
+def test_snapshot():
+    '''job_in_queue in many directories runs qstat once.'''
+    clear_queue_snapshot()
+    old = JASPRC['scheduler']
+    JASPRC['scheduler'] = 'PBS'
+    cwd = os.getcwd()
+    try:
+        results = []
+        for jobid in ['101.gilgamesh', '102.gilgamesh', '103.gilgamesh'] * 5:
+            os.chdir(tmpdir)
+            with open('jobid', 'w') as f:
+                f.write(jobid + '\n')
+            results.append(job_in_queue(None))
+        assert results == [True, False, False] * 5
+        assert qstat_calls() == 1
+        # only our own jobs
+        import getpass
+        assert (open(os.path.join(tmpdir, 'qselect-args')).read().split()
+                == ['-u', getpass.getuser()])
+        assert (open(os.path.join(tmpdir, 'qstat-calls')).read().split()
+                == ['-f', '-t', '101.gilgamesh', '102.gilgamesh'])
+
+        # a submitted job is seen without asking the scheduler again
+        add_job_to_snapshot('103.gilgamesh')
+        assert job_in_queue(None)
+        assert qstat_calls() == 1
+
+        # an expired snapshot is refreshed
+        get_queue_snapshot(ttl=0)
+        assert qstat_calls() == 2
+        assert get_job_state('103.gilgamesh') is None
+
+        # a job of a run pool of an earlier script is never in the queue
+        clear_queue_snapshot()
+        with open('jobid', 'w') as f:
+            f.write('run.7\n')
+        assert not job_in_queue(None)
+        assert status([tmpdir]) == [(tmpdir, 'finished-error')]
+        assert qstat_calls() == 2
+    finally:
+        os.chdir(cwd)
+        JASPRC['scheduler'] = old
+
+
+def test_local():
+    '''the local scheduler runs jobs in a pool of workers.'''
+    scheduler = LocalScheduler(workers=4)
+    cwd = os.getcwd()
+    os.chdir(tmpdir)
+    try:
+        jobids = [scheduler.submit('echo job {0} > job-{0}.txt'.format(i),
+                                   'job{0}'.format(i))
+                  for i in range(20)]
+        array = scheduler.submit_array('echo $JASP_ARRAY_ID > array-$JASP_ARRAY_ID.txt',
+                                       'array', 3)
+        assert scheduler.wait(timeout=60)
+
+        status = scheduler.status()
+        assert all(status[jobid] == 'C' for jobid in jobids + [array])
+        assert all(scheduler.jobs[jobid]['exitcode'] == 0 for jobid in jobids)
+        assert open('job-7.txt').read() == 'job 7\n'
+        assert [open('array-{0}.txt'.format(i)).read() for i in range(3)] \
+            == ['0\n', '1\n', '2\n']
+
+        # a queued job is cancelled before it runs
+        block = scheduler.submit_array('sleep 10', 'block', 4)
+        jobid = scheduler.submit('touch cancelled.txt', 'cancelled')
+        scheduler.cancel(jobid)
+        scheduler.cancel(block)
+        assert scheduler.wait(timeout=60)
+        assert not os.path.exists('cancelled.txt')
+    finally:
+        os.chdir(cwd)
+
+
+def test_nodes():
+    fname = os.path.join(tmpdir, 'pe_hostfile')
+    with open(fname, 'w') as f:
+        f.write('node1 2 all.q@node1 UNDEFINED\n'
+                'node2 1 all.q@node2 UNDEFINED\n')
+    os.environ['PE_HOSTFILE'] = fname
+    try:
+        assert SGEScheduler().in_job()
+        assert SGEScheduler().get_nodes() == ['node1', 'node1', 'node2']
+    finally:
+        del os.environ['PE_HOSTFILE']
+    assert not SGEScheduler().in_job()
+
+
+def test_job_array():
+    '''calculations in a job_array block are submitted as one job.'''
+    old = JASPRC['scheduler'], JASPRC['mode']
+    JASPRC['scheduler'], JASPRC['mode'] = 'local', 'queue'
+    cwd = os.getcwd()
+    dirs = [os.path.join(tmpdir, 'array', str(i)) for i in range(5)]
+    try:
+        with job_array() as array:
+            for vaspdir in dirs + dirs[:2]:
+                if not os.path.isdir(vaspdir):
+                    os.makedirs(vaspdir)
+                os.chdir(vaspdir)
+                calc = Vasp()
+                calc.vaspdir = vaspdir
+                try:
+                    calc.run()
+                except VaspSubmitted as e:
+                    assert e.jobid is None
+                finally:
+                    os.chdir(cwd)
+            # nothing is submitted until the end of the block
+            assert array.jobid is None
+
+        scheduler = get_scheduler()
+        assert len(scheduler.jobs[array.jobid]['tasks']) == 5
+        assert scheduler.wait(array.jobid, timeout=60)
+        for i, vaspdir in enumerate(dirs):
+            jobid = open(os.path.join(vaspdir, 'jobid')).read()
+            assert jobid == scheduler.array_task_jobid(array.jobid, i)
+            assert (open(os.path.join(vaspdir, 'ran-here')).read().strip()
+                    == os.path.realpath(vaspdir))
+    finally:
+        os.chdir(cwd)
+        JASPRC['scheduler'], JASPRC['mode'] = old
+        clear_queue_snapshot()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+from jasp import *
+from nose import *
+import shutil
+import tempfile
+
+QSTAT_F = '''Job Id: 1.gilgamesh
+    job_state = Q
+
+Job Id: 2.gilgamesh
+    job_state = R
+
+Job Id: 3.gilgamesh
+    job_state = C
+'''
+
+OUTCAR_END = '''                 Total CPU time used (sec):        1.000
+                           User time (sec):        1.000
+                         System time (sec):        0.000
+                        Elapsed time (sec):        1.000
+
+                  Maximum memory used (kb):       10000.
+                  Average memory used (kb):           0.
+
+                         Minor page faults:         1000
+                         Major page faults:            0
+                Voluntary context switches:          100
+'''
+
+OSZICAR = '''       N       E                     dE             d eps       ncg     rms          rms(c)
+DAV:   1     0.1E+02    0.1E+02   -0.1E+03    16   0.1E+02
+DAV:   {0}    -0.1E+02   -0.1E-05   -0.1E-06    16   0.1E-03
+   {1} F= -.14E+02 E0= -.14E+02  d E =-.14E+02
+'''
+
+
+def write(vaspdir, files):
+    if not os.path.isdir(vaspdir):
+        os.makedirs(vaspdir)
+    for name, contents in files.items():
+        with open(os.path.join(vaspdir, name), 'w') as f:
+            f.write(contents)
+
+
+def setup():
+    global tmpdir, old_path
+    tmpdir = tempfile.mkdtemp()
+    qstat = os.path.join(tmpdir, 'qstat')
+    with open(qstat, 'w') as f:
+        f.write('#!/bin/sh\n'
+                'echo run >> {0}/qstat-calls\n'
+                'cat <<EOF\n{1}EOF\n'.format(tmpdir, QSTAT_F))
+    os.chmod(qstat, 0755)
+    qselect = os.path.join(tmpdir, 'qselect')
+    with open(qselect, 'w') as f:
+        f.write('#!/bin/sh\necho 1.gilgamesh 2.gilgamesh 3.gilgamesh\n')
+    os.chmod(qselect, 0755)
+    old_path = os.environ['PATH']
+    os.environ['PATH'] = tmpdir + ':' + old_path
+
+    finished = {'INCAR': 'ENCUT = 350\n',
+                'OUTCAR': OUTCAR_END,
+                'CONTCAR': 'CO\n',
+                'OSZICAR': OSZICAR.format(12, 1)}
+    dirs = {'empty': {},
+            'initialized': {'INCAR': 'ENCUT = 350\n'},
+            'queued': {'INCAR': 'ENCUT = 350\n', 'jobid': '1.gilgamesh'},
+            'running': dict(finished, jobid='2.gilgamesh'),
+            'finished-ok': dict(finished, jobid='3.gilgamesh'),
+            'finished-error': dict(finished, OUTCAR=OUTCAR_END[:100]),
+            'unconverged': dict(finished, OSZICAR=OSZICAR.format(60, 1)),
+            'unrelaxed': dict(finished,
+                              INCAR='IBRION = 2; NSW = 5 ! relax\n',
+                              OSZICAR=OSZICAR.format(12, 5)),
+            'relaxed': dict(finished,
+                            INCAR='IBRION = 2; NSW = 5 ! relax\n',
+                            OSZICAR=OSZICAR.format(12, 4)),
+            'died': {'INCAR': 'ENCUT = 350\n', 'jobid': '4.gilgamesh'},
+            'neb': {'INCAR': 'IMAGES = 2\nSPRING = -5\n'}}
+    for name, files in dirs.items():
+        write(os.path.join(tmpdir, name), files)
+    write(os.path.join(tmpdir, 'neb', '01'), finished)
+    write(os.path.join(tmpdir, 'neb', '02'), dict(finished, CONTCAR=''))
+
+
+def teardown():
+    os.environ['PATH'] = old_path
+    shutil.rmtree(tmpdir)
+    clear_queue_snapshot()
+
+
+def test_status():
+    '''directories are classified from their files and one qstat.'''
+    clear_queue_snapshot()
+    old = JASPRC['scheduler']
+    JASPRC['scheduler'] = 'PBS'
+    try:
+        names = ['empty', 'initialized', 'queued', 'running', 'finished-ok',
+                 'finished-error', 'unconverged', 'unrelaxed', 'relaxed',
+                 'died', 'neb', 'missing']
+        table = status([os.path.join(tmpdir, name) for name in names])
+    finally:
+        JASPRC['scheduler'] = old
+
+    states = [state for vaspdir, state in table]
+    assert states == ['empty', 'initialized', 'queued', 'running',
+                      'finished-ok', 'finished-error', 'unconverged',
+                      'unconverged', 'finished-ok', 'finished-error',
+                      'finished-error', 'empty'], states
+    assert len(open(os.path.join(tmpdir, 'qstat-calls')).readlines()) == 1
+    assert table.counts()['finished-error'] == 3
+    assert table.select('queued', 'running') == [
+        os.path.join(tmpdir, 'queued'), os.path.join(tmpdir, 'running')]
+    assert str(table).splitlines()[-1].startswith('2 empty, 1 initialized')
+
+
+def test_no_queue():
+    '''the queue is not asked if no directory has a jobid.'''
+    clear_queue_snapshot()
+    calls = os.path.join(tmpdir, 'qstat-calls')
+    if os.path.exists(calls):
+        os.unlink(calls)
+    table = status([os.path.join(tmpdir, 'initialized')])
+    assert table.counts() == {'initialized': 1}
+    assert not os.path.exists(calls)
+
+
+def test_jasp_state():
+    '''Jasp chooses its branch from one snapshot of the directory.'''
+    clear_queue_snapshot()
+    write(os.path.join(tmpdir, 'done'), {'INCAR': '', 'OUTCAR': '',
+                                         'CONTCAR': '', 'vasprun.xml': ''})
+    os.symlink('nowhere', os.path.join(tmpdir, 'done', 'METADATA'))
+    old = JASPRC['scheduler']
+    JASPRC['scheduler'] = 'PBS'
+    try:
+        states = {}
+        for name in ['empty', 'initialized', 'queued', 'running',
+                     'finished-ok', 'died', 'finished-error', 'done']:
+            with cd(os.path.join(tmpdir, name)):
+                files = directory_snapshot()
+                states[name] = jasp_state(files)
+    finally:
+        JASPRC['scheduler'] = old
+
+    assert states == {'empty': 'empty', 'initialized': 'initialized',
+                      'queued': 'queued', 'running': 'queued',
+                      'finished-ok': 'finished', 'died': 'finished',
+                      'finished-error': 'unknown', 'done': 'done'}, states
+    # a broken link does not exist
+    assert sorted(files) == ['CONTCAR', 'INCAR', 'OUTCAR', 'vasprun.xml']
+    assert files['INCAR'].st_size == 0
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+from jasp import *
+from jasp.summary import *
+from nose import *
+import shutil
+import tempfile
+
+POSCAR = '''C O
+ 1.0
+ 6.0 0.0 0.0
+ 0.0 6.0 0.0
+ 0.0 0.0 6.0
+ 1 1
+Cartesian
+ 0.0 0.0 0.0
+ 1.1 0.0 0.0
+'''
+
+OUTCAR = ''' POSITION                                       TOTAL-FORCE (eV/Angst)
+ -----------------------------------------------------------------------------------
+      0.00000      0.00000      0.00000         1.000000      0.000000      0.000000
+      1.10000      0.00000      0.00000        -1.000000      0.000000      0.000000
+ POSITION                                       TOTAL-FORCE (eV/Angst)
+ -----------------------------------------------------------------------------------
+      0.00000      0.00000      0.00000         0.030000      0.040000      0.000000
+      1.10000      0.00000      0.00000        -0.030000     -0.040000      0.000000
+                  Elapsed time (sec):      123.456
+ Voluntary context switches:         1
+'''
+
+OSZICAR = '''DAV:   1     0.1E+02    0.1E+02   -0.3E+03    16   0.6E+02
+   1 F= -.10E+02 E0= -.12E+02  d E =-.10E+02
+'''
+
+
+def setup():
+    global tmpdir, dirs
+    tmpdir = tempfile.mkdtemp()
+    dirs = []
+    for i in range(6):
+        d = os.path.join(tmpdir, str(i))
+        os.makedirs(d)
+        files = {'POSCAR': POSCAR, 'INCAR': 'NSW = 0\n'}
+        if i % 2 == 0:
+            files.update({'OUTCAR': OUTCAR, 'OSZICAR': OSZICAR,
+                          'CONTCAR': POSCAR})
+        for fname, content in files.items():
+            with open(os.path.join(d, fname), 'w') as f:
+                f.write(content)
+        dirs.append(d)
+
+
+def teardown():
+    shutil.rmtree(tmpdir)
+
+
+def test_row():
+    fields = summary_row(dirs[0]).split()
+    assert fields == ['finished-ok', '-12.0000', '0.050', '123', dirs[0]]
+    fields = summary_row(dirs[1]).split()
+    assert fields == ['initialized', '-', '-', '-', dirs[1]]
+
+
+def test_order():
+    '''the summaries of a pool come in the order of the directories.'''
+    serial = list(iter_summaries(dirs, summary_row))
+    parallel = list(iter_summaries(dirs, summary_row, processes=3))
+    assert parallel == serial
+    assert [s.split()[-1] for s in parallel] == dirs
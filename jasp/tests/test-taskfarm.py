@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+from jasp import *
+from jasp.taskfarm import _take_slots
+from nose import *
+import json
+import shutil
+import tempfile
+
+
+def setup():
+    '''a fake runjasp.py in the PATH that records when and where it ran.'''
+    global tmpdir, old_path
+    tmpdir = tempfile.mkdtemp()
+    runjasp = os.path.join(tmpdir, 'runjasp.py')
+    with open(runjasp, 'w') as f:
+        f.write('#!/bin/sh\n'
+                'date +%s.%N > started\n'
+                'echo $JASP_FARM_HOSTS > hostfile\n'
+                'cat $JASP_FARM_HOSTS > hosts\n'
+                'sleep 0.5\n'
+                'date +%s.%N > finished\n'
+                'test ! -e fail\n')
+    os.chmod(runjasp, 0755)
+    old_path = os.environ['PATH']
+    os.environ['PATH'] = tmpdir + ':' + old_path
+
+
+def teardown():
+    os.environ['PATH'] = old_path
+    shutil.rmtree(tmpdir)
+
+
+def test_take_slots():
+    free = ['n1', 'n1', 'n2', 'n2', 'n2']
+    assert _take_slots(free, 3) == ['n2', 'n2', 'n2']
+    assert free == ['n1', 'n1']
+    assert _take_slots(free, 1) == ['n1']
+
+
+def test_task_command():
+    assert (get_task_command(['localhost'], 'hosts')
+            == JASPRC['vasp.executable.serial'])
+    assert (get_task_command(['n1', 'n1'], '/tmp/hosts')
+            == 'mpirun -np 2 -machinefile /tmp/hosts {0}'.format(
+                JASPRC['vasp.executable.parallel']))
+
+
+def test_farm():
+    '''6 directories on 3 cores run 3 at a time.'''
+    dirs = [os.path.join(tmpdir, 'farm', str(i)) for i in range(6)]
+    for d in dirs:
+        os.makedirs(d)
+    open(os.path.join(dirs[4], 'fail'), 'w').close()
+
+    cwd = os.getcwd()
+    os.chdir(tmpdir)
+    try:
+        results = run_task_farm(dirs, nodes=['localhost'] * 3, poll=0.05)
+    finally:
+        os.chdir(cwd)
+
+    assert [results[d]['exitcode'] == 0 for d in dirs] == [True] * 4 + [False, True]
+    assert json.load(open(os.path.join(tmpdir, 'taskfarm.json'))) == results
+
+    times = [(float(open(os.path.join(d, 'started')).read()),
+              float(open(os.path.join(d, 'finished')).read()))
+             for d in dirs]
+    # how many ran at the same time as each one started
+    concurrent = [len([1 for s, e in times if s <= start < e])
+                  for start, end in times]
+    assert max(concurrent) == 3
+
+    # runjasp.py ran in each directory, with its hosts in a file that
+    # is gone when the farm is done
+    for d in dirs:
+        assert open(os.path.join(d, 'hosts')).read() == 'localhost\n'
+        hostfile = open(os.path.join(d, 'hostfile')).read().strip()
+        assert not hostfile.startswith(d)
+        assert not os.path.exists(hostfile)
+    assert not os.path.exists(os.path.join(tmpdir, '.jasp-farm-hosts'))
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+from jasp import *
+from nose import *
+from ase import Atoms
+import shutil
+import tempfile
+
+OUTCAR = ''' running on    4 total cores
+ Dimension of arrays:
+   k-points           NKPTS =     10   k-points in BZ     NKDIM =     10   number of bands    NBANDS=     24
+   number of dos      NEDOS =    301   number of ions     NIONS =      4
+   ENCUT  =  400.0 eV  29.40 Ry    5.42 a0
+   NSW    =     20    number of steps for IOM
+   ISPIN  =      2    spin polarized calculation?
+   NELECT =      32.0000    total number of electrons
+--------------------------------------- Iteration      1(   1)  ---------------------------------------
+   NSW    =     99
+                  Elapsed time (sec):      123.456
+ Voluntary context switches:         1
+'''
+
+
+def setup():
+    global tmpdir, old
+    tmpdir = tempfile.mkdtemp()
+    with open(os.path.join(tmpdir, 'OUTCAR'), 'w') as f:
+        f.write(OUTCAR)
+    with open(os.path.join(tmpdir, 'INCAR'), 'w') as f:
+        f.write('ALGO = Fast\nNSW = 20\n')
+    old = JASPRC['walltime.history']
+    JASPRC['walltime.history'] = os.path.join(tmpdir, 'walltime.jsonl')
+
+
+def teardown():
+    JASPRC['walltime.history'] = old
+    shutil.rmtree(tmpdir)
+
+
+def test_read():
+    params = read_walltime_record(tmpdir)
+    assert params == {'ncores': 4, 'nkpts': 10, 'nbands': 24, 'nions': 4,
+                      'encut': 400., 'nsw': 20, 'ispin': 2,
+                      'algo': 'fast', 'elapsed': 123.456,
+                      'kpar': 1, 'ncore': 1}, params
+
+    assert add_walltime_records([tmpdir, os.path.join(tmpdir, 'none')]) == 1
+    assert read_walltime_history() == {tmpdir: params}
+
+
+def test_threads():
+    '''threads adding records at once leave a complete history.'''
+    from multiprocessing.pool import ThreadPool
+    dirs = []
+    for i in range(16):
+        d = os.path.join(tmpdir, 'thread-{0}'.format(i))
+        os.makedirs(d)
+        for fname in ['OUTCAR', 'INCAR']:
+            shutil.copy(os.path.join(tmpdir, fname), d)
+        dirs.append(d)
+    history_file = JASPRC['walltime.history']
+    JASPRC['walltime.history'] = os.path.join(tmpdir, 'threads.json')
+    pool = ThreadPool(16)
+    try:
+        assert pool.map(add_walltime_records, [[d] for d in dirs]) == [1] * 16
+        history = read_walltime_history()
+    finally:
+        pool.close()
+        JASPRC['walltime.history'] = history_file
+    assert sorted(history) == sorted(dirs)
+
+
+def test_processes():
+    '''jobs finishing at once do not lose each other's records.'''
+    from multiprocessing import Pool
+    dirs = []
+    for i in range(16):
+        d = os.path.join(tmpdir, 'process-{0}'.format(i))
+        os.makedirs(d)
+        for fname in ['OUTCAR', 'INCAR']:
+            shutil.copy(os.path.join(tmpdir, fname), d)
+        dirs.append(d)
+    history_file = JASPRC['walltime.history']
+    JASPRC['walltime.history'] = os.path.join(tmpdir, 'processes.jsonl')
+    pool = Pool(8)
+    try:
+        assert pool.map(add_walltime_records, [[d] for d in dirs]) == [1] * 16
+        history = read_walltime_history()
+    finally:
+        pool.close()
+        JASPRC['walltime.history'] = history_file
+    assert sorted(history) == sorted(dirs)
+
+    # a line cut off by a killed job is skipped
+    fname = os.path.join(tmpdir, 'cut.jsonl')
+    append_record(fname, 'a', {'elapsed': 1.0})
+    with open(fname, 'a') as f:
+        f.write('["b", {"elaps')
+    append_record(fname, 'a', {'elapsed': 2.0})
+    assert read_records(fname) == {'a': {'elapsed': 2.0}}
+
+
+def write_history(records):
+    for i, record in enumerate(records):
+        append_record(JASPRC['walltime.history'], str(i), record)
+
+
+def make_records(n, exponents):
+    records = []
+    for i in range(n):
+        params = {'ncores': 1 + i % 4, 'nkpts': 1 + 3 * i,
+                  'nbands': 10 + 7 * (i % 5), 'nions': 2 + i % 7,
+                  'encut': 300 + 50 * (i % 3), 'ispin': 1 + i % 2,
+                  'nsw': i % 6}
+        params['elapsed'] = np.exp(np.dot(exponents,
+                                          walltime_features(params)) - 4)
+        records.append(params)
+    return records
+
+
+def test_fit():
+    '''the exponents are fitted to the history.'''
+    exponents = np.array([1.0, 2.0, 1.0, 1.0, 1.0, 0.8, -0.9])
+    records = make_records(40, exponents)
+    assert np.allclose(fit_walltime_model(records), [-4] + list(exponents))
+
+    # with a few records only the constant is fitted
+    records = make_records(3, WALLTIME_EXPONENTS)
+    assert np.allclose(fit_walltime_model(records),
+                       [-4] + list(WALLTIME_EXPONENTS))
+    assert fit_walltime_model([]) is None
+
+
+def test_walltime():
+    '''the walltime is predicted once there is enough history.'''
+    atoms = Atoms('CO', [[0, 0, 0], [1.1, 0, 0]], cell=(6, 6, 6))
+    with jasp(os.path.join(tmpdir, 'co'),
+              xc='PBE', encut=350, kpts=(4, 4, 4), atoms=atoms) as calc:
+        # one record is not enough
+        assert get_walltime(calc) == JASPRC['queue.walltime']
+
+        write_history(make_records(10, WALLTIME_EXPONENTS))
+        elapsed = predict_walltime(calc, ncores=1)
+        params = estimate_memory_parameters(calc, ncores=1)
+        assert np.allclose(elapsed,
+                           np.exp(np.dot(WALLTIME_EXPONENTS,
+                                         walltime_features(params)) - 4))
+        walltime = get_walltime(calc)
+        assert (walltime_to_seconds(walltime)
+                >= min(MIN_WALLTIME, 2 * elapsed))
+        assert (walltime_to_seconds(walltime)
+                < walltime_to_seconds(JASPRC['queue.walltime']))
+        # on fewer cores it takes longer
+        assert (walltime_to_seconds(get_walltime(calc, ncores=1))
+                > walltime_to_seconds(get_walltime(calc, ncores=16)))
+
+        # a walltime we cannot read is used as it is
+        old = JASPRC['queue.walltime']
+        try:
+            JASPRC['queue.walltime'] = '1 week'
+            assert get_walltime(calc) == '1 week'
+        finally:
+            JASPRC['queue.walltime'] = old
+
+    assert seconds_to_walltime(3725.2) == '1:02:06'
+    assert walltime_to_seconds('1:00:00:10') == 86410
+    # Slurm
+    assert walltime_to_seconds('7-00:00:00') == 7 * 86400
+    assert walltime_to_seconds('1-12') == 86400 + 12 * 3600
+    assert walltime_to_seconds('2-01:30') == 2 * 86400 + 5400
+
+
+class RecordScheduler(Scheduler):
+    '''remembers the walltime of the jobs it is asked to submit.'''
+    name = 'record'
+    walltimes = []
+
+    def submit_array(self, script, jobname, ntasks, after=None,
+                     walltime=None):
+        self.walltimes.append(walltime)
+        return 'record.{0}'.format(len(self.walltimes))
+
+    def status(self):
+        return {}
+
+    def in_job(self):
+        return False
+
+
+def test_submit():
+    '''the predicted walltime is passed to the scheduler.'''
+    register_scheduler(RecordScheduler)
+    keys = ['scheduler', 'mode', 'queue.walltime']
+    vals = [JASPRC[key] for key in keys]
+    JASPRC['scheduler'], JASPRC['mode'] = 'record', 'queue'
+    write_history(make_records(10, WALLTIME_EXPONENTS))
+    atoms = Atoms('CO', [[0, 0, 0], [1.1, 0, 0]], cell=(6, 6, 6))
+    try:
+        with jasp(os.path.join(tmpdir, 'submit'),
+                  xc='PBE', encut=350, kpts=(4, 4, 4), atoms=atoms) as calc:
+            walltime = get_walltime(calc)
+            assert walltime != JASPRC['queue.walltime']
+            try:
+                calc.run()
+            except VaspSubmitted as e:
+                assert e.jobid == 'record.1'
+        assert RecordScheduler.walltimes == [walltime]
+        assert [JASPRC[key] for key in keys[2:]] == vals[2:]
+
+        # a task farm predicts each calculation on its cores
+        with task_farm(cores_per_task=2) as farm:
+            with jasp(os.path.join(tmpdir, 'farm'), xc='PBE', encut=350,
+                      kpts=(4, 4, 4), atoms=atoms) as calc:
+                try:
+                    calc.run()
+                except VaspSubmitted as e:
+                    assert e.jobid is None
+                elapsed = predict_walltime(calc, ncores=2)
+                assert elapsed != predict_walltime(calc)
+        assert farm.elapsed.values() == [elapsed]
+        assert RecordScheduler.walltimes[-1] == farm.get_walltime()
+    finally:
+        JASPRC.update(zip(keys, vals))
+        SCHEDULERS.pop('record')
+        clear_queue_snapshot()
+
+
+def test_arrays():
+    '''a job array asks for its longest task, a task farm for all tasks.'''
+    keys = ['queue.nodes', 'queue.ppn']
+    vals = [JASPRC[key] for key in keys]
+    JASPRC.update(zip(keys, [1, 4]))
+    try:
+        array = job_array()
+        farm = task_farm(cores_per_task=2)
+        for i, elapsed in enumerate([1000, 2000, 3000]):
+            array.add(os.path.join(tmpdir, str(i)), elapsed)
+            farm.add(os.path.join(tmpdir, str(i)), elapsed)
+        assert array.get_elapsed() == 3000
+        assert array.get_walltime() == '1:40:00'
+        # two tasks at a time
+        assert farm.get_elapsed() == 6000 / 2 + 3000
+        assert farm.get_walltime() == '3:20:00'
+
+        # one unknown time asks for the default
+        farm.add(os.path.join(tmpdir, 'unknown'))
+        assert farm.get_walltime() == JASPRC['queue.walltime']
+    finally:
+        JASPRC.update(zip(keys, vals))
+
+
+class SGERecord(SGEScheduler):
+    '''remembers the qsub command.'''
+    cmdlists = []
+
+    def _call(self, cmdlist, script=None):
+        self.cmdlists.append(cmdlist)
+        return 'Your job 1234 ("name") has been submitted'
+
+
+def test_sge():
+    '''SGE asks for the walltime with h_rt.'''
+    sge = {'queue.pe': 'smp', 'queue.nprocs': 1, 'queue.q': 'all.q'}
+    old = dict((key, JASPRC[key]) for key in sge if key in JASPRC)
+    JASPRC.update(sge)
+    try:
+        assert SGERecord().submit('true', 'job', walltime='1:00:00') == '1234'
+    finally:
+        for key in sge:
+            JASPRC.pop(key)
+        JASPRC.update(old)
+    cmdlist = SGERecord.cmdlists[0]
+    assert cmdlist[cmdlist.index('-l') + 1] == 'h_rt=1:00:00', cmdlist
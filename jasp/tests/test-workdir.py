@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+from jasp import *
+import ase.calculators.vasp as ase_vasp
+from multiprocessing.pool import ThreadPool
+from nose import *
+import json
+import shutil
+import tempfile
+
+import jasp as jaspmod
+jaspdir = os.path.join(os.path.dirname(jaspmod.__file__))
+
+
+def setup():
+    global tmpdir, dirs
+    tmpdir = tempfile.mkdtemp()
+    dirs = []
+    for i in range(8):
+        d = os.path.join(tmpdir, 'Fe-{0}'.format(i))
+        shutil.copytree(os.path.join(jaspdir, 'tests', 'ref', 'Fe-bcc-U'), d)
+        # jasp writes a new one with a new uuid
+        os.unlink(os.path.join(d, 'METADATA'))
+        dirs.append(d)
+
+
+def teardown():
+    shutil.rmtree(tmpdir)
+
+
+def read(d):
+    with jasp(d) as calc:
+        atoms = calc.get_atoms()
+        # the uuid in METADATA is different in each directory
+        with open(os.path.join(calc.directory, 'METADATA')) as f:
+            uuid = json.load(f)['uuid']
+        return (calc.directory, uuid,
+                atoms.get_potential_energy(), atoms.get_forces().tolist())
+
+
+def test_threads():
+    '''calculations read in threads are the ones read one at a time.'''
+    cwd = os.getcwd()
+    serial = [read(d) for d in dirs]
+    assert os.getcwd() == cwd
+    pool = ThreadPool(4)
+    try:
+        threaded = pool.map(read, dirs)
+    finally:
+        pool.close()
+    assert os.getcwd() == cwd
+    assert threaded == serial
+    assert [r[0] for r in threaded] == dirs
+    assert len(set(r[1] for r in threaded)) == len(dirs)
+
+
+def test_directory():
+    '''Jasp reads a directory that is not the working directory.'''
+    cwd = os.getcwd()
+    calc = Jasp(directory=dirs[0])
+    assert os.getcwd() == cwd
+    assert calc.directory == dirs[0]
+    assert calc.get_atoms().get_potential_energy() == read(dirs[0])[2]
+
+
+def test_ase_unchanged():
+    '''the ase readers run with their own globals, not patched ones.'''
+    namespace = directory_globals(vars(ase_vasp), dirs[0])
+    assert namespace['os'].path.isfile('OUTCAR')
+    assert namespace['isfile']('OUTCAR')
+    with namespace['open']('INCAR') as f:
+        assert f.name == os.path.join(dirs[0], 'INCAR')
+
+    pool = ThreadPool(4)
+    try:
+        pool.map(read, dirs)
+    finally:
+        pool.close()
+    assert ase_vasp.os is os
+    assert 'open' not in vars(ase_vasp)
+
+
+def calculate(d):
+    with jasp(d, encut=300) as calc:
+        calc.calculate()
+
+
+def test_run():
+    '''vasp runs in the directory of the calculation in a thread.'''
+    keys = ['mode', 'vasp.executable.serial']
+    vals = [JASPRC[key] for key in keys]
+    JASPRC['mode'], JASPRC['vasp.executable.serial'] = 'run', 'pwd > ran-here'
+    cwd = os.getcwd()
+    pool = ThreadPool(2)
+    try:
+        pool.map(calculate, dirs[-2:])
+    finally:
+        pool.close()
+        JASPRC.update(zip(keys, vals))
+    assert not os.path.exists(os.path.join(cwd, 'ran-here'))
+    for d in dirs[-2:]:
+        with open(os.path.join(d, 'ran-here')) as f:
+            assert f.read().strip() == os.path.realpath(d)
+        with open(os.path.join(d, 'INCAR')) as f:
+            assert 'ENCUT = 300' in f.read()
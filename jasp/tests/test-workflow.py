@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+from jasp import *
+from nose import *
+from nose.tools import raises
+import shutil
+import tempfile
+
+
+def setup():
+    '''put a fake jaspflow in the PATH.
+
+    It runs the step in the directory with the name of the step, and
+    fails if there is a file called fail there. runjasp.py does
+    nothing.
+    '''
+    global tmpdir, old_path, old_scheduler
+    tmpdir = tempfile.mkdtemp()
+    jaspflow = os.path.join(tmpdir, 'jaspflow')
+    with open(jaspflow, 'w') as f:
+        f.write('#!/bin/sh\n'
+                'd=$(dirname $1)/$2\n'
+                'date +%s.%N > $d/started\n'
+                'sleep 0.2\n'
+                'if [ -e $d/fail ]; then exit 1; fi\n'
+                'echo "ENCUT = 350" > $d/INCAR\n'
+                'echo CO > $d/CONTCAR\n'
+                'echo " Voluntary context switches: 1" > $d/OUTCAR\n'
+                'date +%s.%N > $d/finished\n')
+    os.chmod(jaspflow, 0755)
+    runjasp = os.path.join(tmpdir, 'runjasp.py')
+    with open(runjasp, 'w') as f:
+        f.write('#!/bin/sh\n')
+    os.chmod(runjasp, 0755)
+    old_path = os.environ['PATH']
+    os.environ['PATH'] = tmpdir + ':' + old_path
+    old_scheduler = JASPRC['scheduler']
+    JASPRC['scheduler'] = 'local'
+
+
+def teardown():
+    os.environ['PATH'] = old_path
+    JASPRC['scheduler'] = old_scheduler
+    shutil.rmtree(tmpdir)
+    clear_queue_snapshot()
+
+
+def read_time(step, name):
+    return float(open(os.path.join(step.directory, name)).read())
+
+
+def test_dependencies():
+    '''jobs of the local scheduler wait for their dependencies.'''
+    scheduler = LocalScheduler(workers=4)
+    cwd = os.getcwd()
+    os.chdir(tmpdir)
+    try:
+        first = scheduler.submit('sleep 0.2; touch first', 'first')
+        second = scheduler.submit('test -e first && touch second', 'second',
+                                  after=[first])
+        array = scheduler.submit_array('touch array-$JASP_ARRAY_ID', 'array',
+                                       2, after=[second])
+        last = scheduler.submit('touch last', 'last', after=[array])
+        failed = scheduler.submit('exit 1', 'failed')
+        never = scheduler.submit('touch never', 'never', after=[failed])
+        # a job the scheduler does not know is done
+        unknown = scheduler.submit_array('touch unknown-$JASP_ARRAY_ID',
+                                         'unknown', 2, after=['gone.1'])
+        assert scheduler.status()[second] == 'H'
+        assert scheduler.wait(timeout=60)
+
+        assert all(os.path.exists(f) for f in
+                   ['second', 'array-0', 'array-1', 'last', 'unknown-0',
+                    'unknown-1'])
+        assert not os.path.exists('never')
+        assert scheduler.jobs[never]['exitcode'] is None
+    finally:
+        os.chdir(cwd)
+
+
+def test_workflow():
+    '''the whole graph is submitted at once, and runs in order.'''
+    wf = Workflow(os.path.join(tmpdir, 'graph.workflow'))
+    for name, parents in [('a', []), ('b', ['a']), ('c', ['a']),
+                          ('d', ['b', 'c'])]:
+        wf.add(name, os.path.join(tmpdir, name), parents=parents)
+
+    submitted = wf.submit()
+    assert sorted(submitted) == ['a', 'b', 'c', 'd']
+    assert open(os.path.join(tmpdir, 'd', 'jobid')).read() == submitted['d']
+    assert os.path.exists(wf.fname)
+    assert not wf.done()
+
+    assert get_scheduler().wait(submitted.values(), timeout=60)
+    assert wf.done()
+
+    steps = wf.steps
+    for parent, child in [('a', 'b'), ('a', 'c'), ('b', 'd'), ('c', 'd')]:
+        assert (read_time(steps[parent], 'finished')
+                <= read_time(steps[child], 'started'))
+
+    # nothing is submitted again
+    assert wf.submit() == {}
+
+
+def test_failed_step():
+    '''steps after a failed step do not run, and are resubmitted.'''
+    wf = Workflow(os.path.join(tmpdir, 'fail.workflow'))
+    x = wf.add('x', os.path.join(tmpdir, 'x'))
+    y = wf.add('y', os.path.join(tmpdir, 'y'), parents=['x'],
+               clone_from='x')
+    os.makedirs(x.directory)
+    open(os.path.join(x.directory, 'fail'), 'w').close()
+
+    submitted = wf.submit()
+    assert get_scheduler().wait(submitted.values(), timeout=60)
+    assert not os.path.exists(os.path.join(y.directory, 'started'))
+    assert [state for d, state in wf.status()] == ['finished-error'] * 2
+
+    os.unlink(os.path.join(x.directory, 'fail'))
+    submitted = wf.submit()
+    assert sorted(submitted) == ['x', 'y']
+    assert get_scheduler().wait(submitted.values(), timeout=60)
+    assert wf.done()
+
+    # the steps are read back from the workflow file
+    wf = Workflow.load(wf.fname)
+    assert wf.steps['y'].clone_from == 'x'
+    assert wf.steps['y'].parents == ['x']
+
+
+@raises(VaspNotFinished)
+def test_parent_failed():
+    '''a step whose parent failed does not run, e.g. after -hold_jid.'''
+    wf = Workflow(os.path.join(tmpdir, 'hold.workflow'))
+    u = wf.add('u', os.path.join(tmpdir, 'u'))
+    wf.add('v', os.path.join(tmpdir, 'v'), parents=['u'], clone_from='u')
+    os.makedirs(u.directory)
+    with open(os.path.join(u.directory, 'INCAR'), 'w') as f:
+        f.write('ENCUT = 350\n')
+    with open(os.path.join(u.directory, 'OUTCAR'), 'w') as f:
+        f.write('killed in the middle\n')
+    wf.run_step('v')
+
+
+@raises(Exception)
+def test_lambda():
+    '''functions the job calls must be importable.'''
+    wf = Workflow(os.path.join(tmpdir, 'lambda.workflow'))
+    wf.add('a', os.path.join(tmpdir, 'a'))
+    wf.add('b', os.path.join(tmpdir, 'b'), parents=['a'],
+           update=lambda atoms, parents: None)
+
+
+def test_run_step():
+    '''a step is cloned from its parent, updated and submitted.'''
+    from jasp.jasp_eos import scale_volume
+    source = os.path.join(tmpdir, 'Fe-bcc-U')
+    shutil.copytree('ref/Fe-bcc-U', source)
+    wf = Workflow(os.path.join(tmpdir, 'step.workflow'))
+    wf.add('fe', source)
+    step = wf.add('scaled', os.path.join(tmpdir, 'scaled'), parents=['fe'],
+                  clone_from='fe', update=scale_volume,
+                  update_args={'factor': 0.1}, encut=400)
+    with jasp(source) as calc:
+        volume = calc.get_atoms().get_volume()
+
+    old_mode = JASPRC['mode']
+    JASPRC['mode'] = 'queue'
+    try:
+        wf.run_step('scaled')
+    except VaspSubmitted as e:
+        assert get_scheduler().wait([e.jobid], timeout=60)
+    finally:
+        JASPRC['mode'] = old_mode
+
+    for fname in ['INCAR', 'KPOINTS', 'POTCAR', 'METADATA', 'jobid']:
+        assert os.path.exists(os.path.join(step.directory, fname)), fname
+    atoms = read(os.path.join(step.directory, 'POSCAR'))
+    assert abs(atoms.get_volume() - 1.1 * volume) < 1e-6
+    incar = open(os.path.join(step.directory, 'INCAR')).read()
+    assert 'ENCUT = 400' in incar, incar
+    assert 'LDAU = .TRUE.' in incar, incar
+
+
+def test_array():
+    '''steps of an array are submitted as one job array.'''
+    wf = Workflow(os.path.join(tmpdir, 'array.workflow'))
+    wf.add('p', os.path.join(tmpdir, 'p'))
+    sweep = ['sweep-{0}'.format(i) for i in range(3)]
+    for name in sweep:
+        wf.add(name, os.path.join(tmpdir, name), parents=['p'],
+               array='sweep')
+    wf.add('q', os.path.join(tmpdir, 'q'), parents=sweep)
+
+    submitted = wf.submit()
+    scheduler = get_scheduler()
+    arrays = [jobid for jobid, job in scheduler.jobs.items()
+              if job.get('tasks') == [submitted[name] for name in sweep]]
+    assert len(arrays) == 1, submitted
+    assert scheduler.wait(submitted.values(), timeout=60)
+    assert wf.done()
+
+    steps = wf.steps
+    for name in sweep:
+        assert (read_time(steps['p'], 'finished')
+                <= read_time(steps[name], 'started'))
+        assert (read_time(steps[name], 'finished')
+                <= read_time(steps['q'], 'started'))
+
+
+@raises(Exception)
+def test_array_order():
+    '''the steps of an array are added one after the other.'''
+    wf = Workflow(os.path.join(tmpdir, 'order.workflow'))
+    wf.add('a', os.path.join(tmpdir, 'a'), array='x')
+    wf.add('b', os.path.join(tmpdir, 'b'))
+    wf.add('c', os.path.join(tmpdir, 'c'), array='x')
+
+
+def double_volume(atoms, parents):
+    atoms.set_volume(2 * atoms.get_volume())
+
+
+def test_unconverged():
+    '''an unconverged relaxation continues, and is not updated again.'''
+    d = os.path.join(tmpdir, 'relax')
+    shutil.copytree('ref/Fe-bcc-U', d)
+    incar = open(os.path.join(d, 'INCAR')).read()
+    with open(os.path.join(d, 'INCAR'), 'w') as f:
+        f.write(incar + ' NSW = 1\n IBRION = 2\n')
+    outcar = open(os.path.join(d, 'OUTCAR')).read()
+    with open(os.path.join(d, 'OUTCAR'), 'w') as f:
+        f.write(outcar.replace('NSW    =      0', 'NSW    =      1')
+                .replace('IBRION =     -1', 'IBRION =      2'))
+    open(os.path.join(d, '.jasp-step'), 'w').close()
+
+    wf = Workflow(os.path.join(tmpdir, 'relax.workflow'))
+    wf.add('relax', d, update=double_volume, nsw=1, ibrion=2)
+    assert [state for vaspdir, state in wf.status()] == ['unconverged']
+    assert not wf.done()
+    old = JASPRC['restart_unconverged'], JASPRC['mode']
+    try:
+        JASPRC['restart_unconverged'] = False
+        assert wf.done()
+
+        JASPRC['restart_unconverged'], JASPRC['mode'] = True, 'queue'
+        volume = read(os.path.join(d, 'CONTCAR')).get_volume()
+        try:
+            wf.run_step('relax')
+            assert False, 'the relaxation was not continued'
+        except VaspSubmitted as e:
+            assert get_scheduler().wait([e.jobid], timeout=60)
+    finally:
+        JASPRC['restart_unconverged'], JASPRC['mode'] = old
+    atoms = read(os.path.join(d, 'POSCAR'))
+    assert abs(atoms.get_volume() - volume) < 1e-6
@@ -3,23 +3,14 @@ from jasp import *
 
 def vasp_p(directory):
     'returns True if a finished OUTCAR file exists in the current directory, else False'
-    outcar = os.path.join(directory, 'OUTCAR')
-    if os.path.exists(outcar):
-        with open(outcar, 'r') as f:
-            contents = f.read()
-            if 'General timing and accounting informations for this job:' in contents:
-                return True
-    return False
+    return outcar_finished(directory)
 
 def get_jasp_dirs(root):
     '''return a list of absolute directories containing VASP calculations'''
-    directories = []
-    for root, dirs, files in os.walk(root):
-        for d in dirs:
-            # compute absolute path to each directory in the current root
-            absd = os.path.join(root, d)
-            if vasp_p(absd):
-                # we found a vasp directory
-                directories += [absd]
-    return directories
+    root = os.path.abspath(root)
+    return [d for d in iter_calculation_dirs(root,
+                                             classify=lambda path, names:
+                                             'OUTCAR' in names,
+                                             finished=True)
+            if d != root]
     
@@ -0,0 +1,302 @@
+'''Predict the walltime of a calculation from calculations that finished.
+
+Every job used to ask for JASPRC['queue.walltime'], usually a week,
+because nobody knows how long a calculation will take. Long walltime
+requests wait longer in the queue and block backfill. Instead we keep a
+history of finished calculations (JASPRC['walltime.history']) with the
+quantities the cost depends on and the elapsed time vasp reported, and
+fit
+
+elapsed = c * NKPTS^a * NBANDS^b * NIONS^c * ENCUT^d * ISPIN^e
+            * max(1, NSW)^f * cores^g
+
+by least squares on the logarithms. NBANDS already counts the
+electrons, so NELECT is not a feature. With few records the exponents
+are fixed at WALLTIME_EXPONENTS and only c is fitted.
+
+runjasp.py adds each calculation to the history when vasp exits, and
+add_walltime_records adds calculations that ran some other way. The
+history is a table of records.py, so jobs that finish at the same time
+do not lose each other's records. When there are at least
+JASPRC['walltime.min_records'] records, run asks for the predicted
+time times JASPRC['walltime.safety'], but never more than
+JASPRC['queue.walltime']. The time is predicted for the cores each
+calculation runs on, which in a task farm is less than the job has.
+A job array asks for its longest task, and a task farm for the time
+it takes to run all of its tasks, see job_array.get_walltime.
+
+>>> add_walltime_records(glob.glob('*/'))
+>>> predict_walltime(calc)  # seconds
+'''
+
+import os
+import re
+import numpy as np
+from jasprc import JASPRC
+from records import append_record, read_records
+from outcar import read_outcar_tail
+from jasp_status import read_incar_tags
+from memory import estimate_memory_parameters
+
+import logging
+log = logging.getLogger('Jasp')
+
+WALLTIME_FEATURES = ['nkpts', 'nbands', 'nions', 'encut', 'ispin', 'nsw',
+                     'ncores']
+
+# exponents of the features, before calibration
+WALLTIME_EXPONENTS = np.array([1.0, 1.5, 1.0, 1.5, 1.0, 1.0, -1.0])
+
+# the shortest walltime we ask for, in seconds
+MIN_WALLTIME = 600
+
+# (pattern, key, type) of the quantities in the OUTCAR header
+OUTCAR_PARAMETERS = [(r'NKPTS\s*=\s*(\d+)', 'nkpts', int),
+                     (r'NBANDS\s*=\s*(\d+)', 'nbands', int),
+                     (r'NIONS\s*=\s*(\d+)', 'nions', int),
+                     (r'ENCUT\s*=\s*([0-9.]+)', 'encut', float),
+                     (r'ISPIN\s*=\s*(\d+)', 'ispin', int),
+                     (r'NSW\s*=\s*(\d+)', 'nsw', int),
+                     (r'running on\s+(\d+)', 'ncores', int)]
+
+_elapsed_line = re.compile(r'Elapsed time \(sec\):\s*([0-9.]+)')
+
+# fname: (mtime, {algo: (number of records, coefficients)}, records)
+_walltime_model_cache = {}
+
+
+def read_walltime_record(vaspdir='.'):
+    '''Return the elapsed time and the quantities it depends on.
+
+    Returns a dictionary with elapsed in seconds, or None if vaspdir
+    has no finished OUTCAR. Only the header and the tail of the OUTCAR
+    are read.
+    '''
+    outcar = os.path.join(vaspdir, 'OUTCAR')
+    if not os.path.exists(outcar):
+        return None
+
+    elapsed = None
+    for line in read_outcar_tail(8, outcar):
+        m = _elapsed_line.search(line)
+        if m:
+            elapsed = float(m.group(1))
+    if elapsed is None:
+        return None
+
+    params = {'ncores': 1, 'elapsed': elapsed}
+    with open(outcar) as f:
+        for line in f:
+            if 'Iteration' in line:
+                # the end of the header
+                break
+            for pattern, key, type_ in OUTCAR_PARAMETERS:
+                if key in params and key != 'ncores':
+                    continue
+                m = re.search(pattern, line)
+                if m is not None:
+                    params[key] = type_(m.group(1))
+
+    incar = os.path.join(vaspdir, 'INCAR')
+    tags = read_incar_tags(incar) if os.path.exists(incar) else {}
+    params['algo'] = tags.get('ALGO', 'normal').lower()
+
+    # the parallelization, and the time per electronic step it gave
+    params['kpar'] = int(tags.get('KPAR', 1))
+    if 'NCORE' in tags:
+        params['ncore'] = int(tags['NCORE'])
+    elif 'NPAR' in tags:
+        params['ncore'] = max(1, params['ncores'] // params['kpar']
+                              // int(tags['NPAR']))
+    else:
+        params['ncore'] = 1
+    oszicar = os.path.join(vaspdir, 'OSZICAR')
+    if os.path.exists(oszicar):
+        with open(oszicar) as f:
+            nsteps = sum(1 for line in f
+                         if line.split() and line.split()[0].endswith(':'))
+        if nsteps:
+            params['loop'] = elapsed / nsteps
+    return params
+
+
+def walltime_features(params):
+    '''Return the logarithms of WALLTIME_FEATURES of params.'''
+    values = [params.get(key, 1) for key in WALLTIME_FEATURES]
+    return np.log(np.maximum(1, np.array(values, dtype=float)))
+
+
+def get_walltime_history_file():
+    '''Return the path of the walltime history, or None if there is none.'''
+    fname = JASPRC.get('walltime.history', 'None')
+    if fname in [None, 'None']:
+        return None
+    return os.path.expanduser(fname)
+
+
+def read_walltime_history():
+    '''Return {directory: record} of the walltime history.'''
+    fname = get_walltime_history_file()
+    if fname is None:
+        return {}
+    return read_records(fname)
+
+
+def add_walltime_records(dirs):
+    '''Add the finished calculations in dirs to the walltime history.
+
+    Returns the number of records added.
+    '''
+    history_file = get_walltime_history_file()
+    if history_file is None:
+        return 0
+
+    n = 0
+    for vaspdir in dirs:
+        params = read_walltime_record(vaspdir)
+        if params is not None and all(key in params for key in
+                                      ['nkpts', 'nbands', 'nions', 'encut']):
+            append_record(history_file, os.path.abspath(vaspdir), params)
+            n += 1
+    return n
+
+
+def fit_walltime_model(records):
+    '''Return [log c] + exponents of the WALLTIME_FEATURES for records.
+
+    With enough records the exponents are fitted, with fewer only c is,
+    and with none None is returned.
+    '''
+    records = [r for r in records if r.get('elapsed', 0) > 0]
+    if not records:
+        return None
+
+    X = np.array([walltime_features(r) for r in records])
+    y = np.log([r['elapsed'] for r in records])
+
+    if len(records) >= 3 * (len(WALLTIME_FEATURES) + 1):
+        A = np.hstack([np.ones((len(records), 1)), X])
+        coefficients = np.linalg.lstsq(A, y, rcond=-1)[0]
+        # the time cannot go down with more work
+        if (coefficients[1:-1] >= 0).all():
+            return coefficients
+
+    c = np.median(y - np.dot(X, WALLTIME_EXPONENTS))
+    return np.hstack([[c], WALLTIME_EXPONENTS])
+
+
+def get_walltime_model(algo=None):
+    '''Return (number of records, coefficients) fitted to the history.
+
+    If there are JASPRC['walltime.min_records'] records with algo, only
+    they are used. The fits are cached until the history changes.
+    '''
+    fname = get_walltime_history_file()
+    if fname is None or not os.path.exists(fname):
+        return 0, None
+    mtime = os.stat(fname).st_mtime
+    cached = _walltime_model_cache.get(fname)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, {}, read_walltime_history().values())
+        _walltime_model_cache[fname] = cached
+    models, records = cached[1], cached[2]
+
+    if algo not in models:
+        same = [r for r in records if r.get('algo') == algo]
+        if len(same) < int(JASPRC['walltime.min_records']):
+            same = records
+        models[algo] = (len(same), fit_walltime_model(same))
+    return models[algo]
+
+
+def predict_walltime(calc, ncores=None):
+    '''Return the predicted elapsed time of calc in seconds.
+
+    Returns None if there are fewer than JASPRC['walltime.min_records']
+    records in the history. ncores defaults to JASPRC['queue.nodes'] *
+    JASPRC['queue.ppn'].
+    '''
+    algo = (calc.string_params.get('algo') or 'normal').lower()
+    nrecords, coefficients = get_walltime_model(algo)
+    if coefficients is None or nrecords < int(JASPRC['walltime.min_records']):
+        return None
+
+    params = estimate_memory_parameters(calc, ncores)
+    params['nsw'] = calc.int_params.get('nsw') or 0
+    elapsed = np.exp(coefficients[0] + np.dot(coefficients[1:],
+                                              walltime_features(params)))
+    log.debug('predicted {0:1.0f} s for {1}'.format(elapsed, params))
+    return elapsed
+
+
+def walltime_to_seconds(walltime):
+    '''Return the seconds of a walltime string like [D:]HH:MM:SS.
+
+    The D-HH[:MM[:SS]] format of Slurm is read too. Raises ValueError
+    for anything else.
+    '''
+    walltime = str(walltime).strip()
+    if '-' in walltime:
+        days, hms = walltime.split('-', 1)
+        fields = hms.split(':')
+        if len(fields) > 3:
+            raise ValueError('invalid walltime {0}'.format(walltime))
+        fields += ['0'] * (3 - len(fields))
+        return (int(days) * 86400 + int(fields[0]) * 3600
+                + int(fields[1]) * 60 + int(fields[2]))
+
+    fields = walltime.split(':')
+    if len(fields) > 4:
+        raise ValueError('invalid walltime {0}'.format(walltime))
+    seconds = 0
+    for factor, field in zip([1, 60, 3600, 86400], reversed(fields)):
+        seconds += factor * int(field)
+    return seconds
+
+
+def seconds_to_walltime(seconds):
+    '''Return seconds as a walltime string HH:MM:SS.'''
+    seconds = int(np.ceil(seconds))
+    return '{0:d}:{1:02d}:{2:02d}'.format(seconds // 3600,
+                                          seconds // 60 % 60,
+                                          seconds % 60)
+
+
+def try_predict_walltime(calc, ncores=None):
+    '''Return predict_walltime(calc, ncores), or None if that fails.'''
+    try:
+        return predict_walltime(calc, ncores)
+    except Exception as e:
+        log.warning('walltime prediction failed: {0}'.format(e))
+        return None
+
+
+def request_walltime(elapsed):
+    '''Return the walltime string to ask for a job of elapsed seconds.
+
+    This is elapsed times JASPRC['walltime.safety'], between
+    MIN_WALLTIME and JASPRC['queue.walltime'], or JASPRC['queue.walltime']
+    if elapsed is None.
+    '''
+    walltime = JASPRC['queue.walltime']
+    if elapsed is None:
+        return walltime
+
+    try:
+        limit = walltime_to_seconds(walltime)
+    except ValueError as e:
+        log.warning('cannot read the walltime {0}: {1}'.format(walltime, e))
+        return walltime
+
+    seconds = max(MIN_WALLTIME, elapsed * float(JASPRC['walltime.safety']))
+    if seconds >= limit:
+        return walltime
+    return seconds_to_walltime(seconds)
+
+
+def get_walltime(calc, ncores=None):
+    '''Return the walltime string to submit calc with on ncores cores.
+
+    See request_walltime and predict_walltime.
+    '''
+    return request_walltime(try_predict_walltime(calc, ncores))
@@ -0,0 +1,127 @@
+'''Reading calculations in threads.
+
+The working directory belongs to the process, so two threads that
+change into different calculations read each other's files. Instead,
+calculators know their directory. Jasp sets calc.directory to the
+absolute path of the calculation, and the jasp readers join it to the
+names of the files they open. In a thread other than the main thread,
+jasp does not change directory at all, and vasp runs in calc.directory.
+
+>>> from multiprocessing.pool import ThreadPool
+>>> def energy(d):
+...     with jasp(d) as calc:
+...         return calc.get_potential_energy()
+>>> energies = ThreadPool(16).map(energy, dirs)
+
+The readers of the vasp calculator in ase open bare names like OUTCAR
+and INCAR. Those methods are wrapped with uses_directory, which calls
+them with their own copy of the globals of ase.calculators.vasp, in
+which open and os resolve relative names against calc.directory. The
+ase modules are not changed, so nothing else sees this. calculate and
+restart_load also read and write through ase.io, so jasp replaces them
+instead, see jasp_extensions and jasp_restart.
+
+Open your own files with os.path.join(calc.directory, name) in threads.
+'''
+
+import __builtin__
+import os
+import threading
+import types
+from functools import wraps
+from ase.calculators.vasp import Vasp
+
+import logging
+log = logging.getLogger('Jasp')
+
+# methods of the ase calculator that read or write bare names. Jasp
+# replaces calculate, restart_load, read_outcar, read_kpoints and
+# write_kpoints completely.
+ASE_METHODS = ['clean', 'read_version',
+               'read_number_of_iterations', 'read_electronic_temperature',
+               'read_default_number_of_electrons', 'read_number_of_electrons',
+               'read_stress', 'read_ldau', 'write_incar', 'write_potcar',
+               'write_sort_file', 'read_energy', 'read_forces', 'read_fermi',
+               'read_dipole', 'read_magnetic_moments', 'read_magnetic_moment',
+               'read_nbands', 'read_convergence', 'read_ibz_kpoints',
+               'read_k_point_weights', 'read_eigenvalues',
+               'read_occupation_numbers', 'read_relaxed', 'read_incar',
+               'read_potcar']
+
+# functions of os and os.path that take a file name
+OS_FUNCTIONS = ['stat', 'listdir', 'remove', 'unlink']
+PATH_FUNCTIONS = ['exists', 'isfile', 'isdir', 'islink', 'getsize']
+
+
+def in_main_thread():
+    return isinstance(threading.current_thread(), threading._MainThread)
+
+
+def _resolving(func, directory):
+    '''Return func with a relative first argument joined to directory.'''
+    @wraps(func)
+    def wrapper(path, *args, **kwargs):
+        if isinstance(path, basestring) and not os.path.isabs(path):
+            path = os.path.join(directory, path)
+        return func(path, *args, **kwargs)
+    return wrapper
+
+
+class _Module(object):
+    '''A module with some of its functions replaced.'''
+
+    def __init__(self, module, replaced):
+        self._module = module
+        self.__dict__.update(replaced)
+
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+
+def directory_globals(func_globals, directory):
+    '''Return a copy of func_globals for running in directory.
+
+    open, os, os.path and the functions imported from os.path resolve
+    relative names against directory.
+    '''
+    path = _Module(os.path, dict((name, _resolving(getattr(os.path, name),
+                                                   directory))
+                                 for name in PATH_FUNCTIONS))
+    replaced = dict((name, _resolving(getattr(os, name), directory))
+                    for name in OS_FUNCTIONS)
+    replaced['path'] = path
+
+    namespace = dict(func_globals)
+    namespace['open'] = _resolving(__builtin__.open, directory)
+    if namespace.get('os') is os:
+        namespace['os'] = _Module(os, replaced)
+    for name in PATH_FUNCTIONS:
+        if namespace.get(name) is getattr(os.path, name):
+            namespace[name] = getattr(path, name)
+    return namespace
+
+
+def uses_directory(method):
+    '''Decorator for calculator methods that open bare names.
+
+    The method runs with the names it opens relative to calc.directory.
+    '''
+    func = getattr(method, 'im_func', method)
+
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if self.directory == '.':
+            return func(self, *args, **kwargs)
+        bound = types.FunctionType(func.func_code,
+                                   directory_globals(func.func_globals,
+                                                     self.directory),
+                                   func.func_name, func.func_defaults,
+                                   func.func_closure)
+        return bound(self, *args, **kwargs)
+    return wrapper
+
+# Jasp sets the absolute path of the calculation
+Vasp.directory = '.'
+
+for _name in ASE_METHODS:
+    setattr(Vasp, _name, uses_directory(getattr(Vasp, _name)))
@@ -0,0 +1,305 @@
+'''Workflows of calculations that are submitted all at once.
+
+A multi-step calculation like an equation of state used to make
+progress only when you ran the script again after each step finished.
+A Workflow describes all the steps and how they depend on each other,
+and submits every step at once. Each step waits in the queue for its
+parents to finish (afterok), and sets itself up from their results
+when it starts. The whole pipeline runs without anyone polling it.
+SGE has no afterok, and starts a step when its parents end, so a step
+checks that its parents are done before it runs. If they are not, the
+step fails, and submit resubmits it with its parents.
+
+wf = Workflow('bands.workflow')
+wf.add_calculation('scf', calc)  # an existing calculation
+wf.add('bands', 'bands', parents=['scf'], clone_from='scf',
+       icharg=11, nsw=0, kpts=path)
+wf.submit()
+
+A step is a vasp directory with the keywords for jasp. clone_from is
+the name of a parent to clone before the step runs, or a function of
+the list of parent steps that returns the one to clone, like
+lowest_energy. update is a function update(atoms, parents, **args)
+that changes the atoms before the calculation, e.g. to set the volume
+from an equation of state fitted to the parents. These functions are
+called in the job, so they must be defined in a module that can be
+imported, not in your script.
+
+Steps added with the same array name, one after the other, are
+submitted as one job array, like a job_array block. Steps that wait
+for them wait for the whole array.
+
+The workflow is saved to its file, and each step runs as a job with
+the command jaspflow <file> <step>. Steps that are finished, queued or
+running are not submitted again, so you can call submit again to
+resubmit steps that failed. A relaxation that ran out of NSW steps
+(unconverged) is submitted again, and continues from its CONTCAR. With
+JASPRC['restart_unconverged'] = False it counts as done instead.
+'''
+
+import os
+import pickle
+import pipes
+from jasprc import JASPRC
+from jasp_exceptions import *
+from jasp_status import status, scan_directory
+from scheduler import *
+
+import logging
+log = logging.getLogger('Jasp')
+
+# written to the directory of a step when it is set up
+STARTED_FILE = '.jasp-step'
+
+
+def lowest_energy(parents):
+    '''Return the step in parents with the lowest energy.'''
+    from jasp import jasp
+    energies = []
+    for step in parents:
+        with jasp(step.directory) as calc:
+            energies.append(calc.get_atoms().get_potential_energy())
+    return parents[energies.index(min(energies))]
+
+
+class Step(object):
+    '''A calculation in a Workflow. See Workflow.add.'''
+    array = None  # steps saved before there were arrays
+
+    def __init__(self, name, directory, parents=(), atoms=None,
+                 clone_from=None, update=None, update_args=None,
+                 extra_files=None, parameters=None, array=None):
+        self.name = name
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.parents = list(parents)
+        if atoms is not None:
+            atoms = atoms.copy()  # without the calculator
+        self.atoms = atoms
+        self.clone_from = clone_from
+        self.update = update
+        self.update_args = update_args or {}
+        self.extra_files = extra_files
+        self.parameters = parameters or {}
+        self.array = array
+
+    def __repr__(self):
+        return '<Step {0} {1}>'.format(self.name, self.directory)
+
+
+class Workflow(object):
+    '''A graph of calculations that depend on each other.'''
+
+    def __init__(self, fname='workflow.pkl', jobname=None):
+        self.fname = os.path.abspath(os.path.expanduser(fname))
+        self.jobname = jobname
+        self.steps = {}
+        self.order = []  # parents come before their children
+
+    def add(self, name, directory, parents=(), atoms=None, clone_from=None,
+            update=None, update_args=None, extra_files=None, array=None,
+            **kwargs):
+        '''Add a step named name that runs jasp(directory, **kwargs).
+
+        parents are the names of steps that must finish first. See the
+        module docstring for clone_from, update and array. extra_files
+        are copied with the clone, in addition to the vasp files.
+        Returns the Step.
+        '''
+        if name in self.steps:
+            raise Exception('{0} is already a step'.format(name))
+        for parent in parents:
+            if parent not in self.steps:
+                raise Exception('{0} is not a step. Add parents '
+                                'first.'.format(parent))
+        for func in [clone_from, update]:
+            if (callable(func) and
+                (func.__module__ == '__main__' or func.__name__ == '<lambda>')):
+                raise Exception('{0} is called in the job, so it must be '
+                                'defined in a module you can '
+                                'import'.format(func.__name__))
+        if isinstance(clone_from, str) and clone_from not in parents:
+            raise Exception('clone_from={0} is not a parent'.format(
+                clone_from))
+        if array is not None:
+            if any(self.steps[parent].array == array for parent in parents):
+                raise Exception('steps of array {0} cannot wait for each '
+                                'other'.format(array))
+            arrays = [self.steps[n].array for n in self.order]
+            if array in arrays and arrays[-1] != array:
+                raise Exception('the steps of array {0} must be added one '
+                                'after the other'.format(array))
+
+        step = Step(name, directory, parents, atoms, clone_from, update,
+                    update_args, extra_files, kwargs, array)
+        self.steps[name] = step
+        self.order.append(name)
+        return step
+
+    def add_calculation(self, name, calc):
+        '''Add the calculation of calc as a step without parents.
+
+        It is submitted now if it needs to run, so that other steps
+        can wait for its job.
+        '''
+        try:
+            calc.calculate()
+        except (VaspSubmitted, VaspQueued, VaspRunning):
+            pass
+        return self.add(name, os.path.join(calc.cwd, calc.vaspdir))
+
+    def save(self):
+        with open(self.fname, 'wb') as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(fname):
+        with open(fname, 'rb') as f:
+            return pickle.load(f)
+
+    def status(self):
+        '''Return a StatusTable of the step directories, in order.'''
+        return status([self.steps[name].directory for name in self.order])
+
+    def done_states(self):
+        '''Return the states of steps that are done.'''
+        if JASPRC['restart_unconverged']:
+            return ['finished-ok']
+        return ['finished-ok', 'unconverged']
+
+    def done(self):
+        '''Return True if all steps are done.'''
+        done = self.done_states()
+        return all(state in done for vaspdir, state in self.status())
+
+    def submit(self):
+        '''Submit the steps that are not finished, queued or running.
+
+        Each step waits for the jobs of its parents. Returns {name:
+        jobid} of the steps submitted now.
+        '''
+        self.save()
+        table = self.status()
+        done = self.done_states()
+
+        jobids = {}  # name: jobid to wait for, or None
+        submitted = {}
+        names = []  # steps to submit together
+        for i, (name, (vaspdir, state)) in enumerate(zip(self.order, table)):
+            step = self.steps[name]
+            if state in done:
+                jobids[name] = None
+            elif state in ['queued', 'running']:
+                with open(os.path.join(vaspdir, 'jobid')) as f:
+                    jobids[name] = f.readline().strip()
+            else:
+                names.append(name)
+
+            # an array is submitted with its last step
+            following = self.order[i + 1:i + 2]
+            if (names and (step.array is None or not following
+                           or self.steps[following[0]].array != step.array)):
+                submitted.update(self._submit(names, jobids))
+                names = []
+        return submitted
+
+    def _submit(self, names, jobids):
+        '''Submit the steps names as one job, or one array job.
+
+        jobids has the jobids of their parents. Returns {name: jobid}.
+        '''
+        scheduler = get_scheduler()
+        steps = [self.steps[name] for name in names]
+        after = []
+        for step in steps:
+            after += [jobids[parent] for parent in step.parents
+                      if jobids[parent] is not None
+                      and jobids[parent] not in after]
+
+        workdir = pipes.quote(os.path.dirname(self.fname))
+        if len(steps) == 1:
+            body = 'cd {0}\njaspflow {1} {2}\n#end'.format(
+                workdir, pipes.quote(self.fname), pipes.quote(names[0]))
+            jobid = scheduler.submit(job_script(body),
+                                     self.jobname or steps[0].directory,
+                                     after=after)
+            tasks = [jobid]
+        else:
+            # the task index selects the step
+            body = 'cd {0}\ncase $(( ${{{1}}} - {2} )) in\n'.format(
+                workdir, scheduler.array_index_variable,
+                scheduler.array_first_index)
+            for i, name in enumerate(names):
+                body += '{0}) jaspflow {1} {2} ;;\n'.format(
+                    i, pipes.quote(self.fname), pipes.quote(name))
+            body += 'esac\n#end'
+            jobid = scheduler.submit_array(job_script(body),
+                                           self.jobname or steps[0].array,
+                                           len(steps), after=after)
+            tasks = [scheduler.array_task_jobid(jobid, i)
+                     for i in range(len(steps))]
+        log.debug('submitted {0} as {1} after {2}'.format(names, jobid,
+                                                          after))
+
+        submitted = {}
+        for step, task in zip(steps, tasks):
+            # jasp sees the step as queued until its job is done
+            if not os.path.isdir(step.directory):
+                os.makedirs(step.directory)
+            with open(os.path.join(step.directory, 'jobid'), 'w') as f:
+                f.write(task)
+            add_job_to_snapshot(task)
+            # children wait for the whole array
+            jobids[step.name] = jobid
+            submitted[step.name] = task
+        return submitted
+
+    def run_step(self, name):
+        '''Set up step name from its parents and run it.
+
+        This is what the job of the step runs.
+        '''
+        from jasp import jasp
+        step = self.steps[name]
+        parents = [self.steps[parent] for parent in step.parents]
+
+        # SGE starts the job when the parents end, even if they failed,
+        # and an exit code of 0 does not mean vasp finished
+        done = self.done_states()
+        for parent in parents:
+            state, jobid = scan_directory(parent.directory)
+            if state not in done:
+                raise VaspNotFinished('{0}: parent {1} is {2}'.format(
+                    name, parent.name, state))
+
+        # the jobid is our own job. Without it jasp would think the
+        # calculation is still queued.
+        jobid = os.path.join(step.directory, 'jobid')
+        if os.path.exists(jobid):
+            os.unlink(jobid)
+
+        # a step that ran before, e.g. an unconverged relaxation,
+        # continues from where it stopped, and is not updated again
+        marker = os.path.join(step.directory, STARTED_FILE)
+        started = os.path.exists(marker)
+
+        if (step.clone_from is not None
+            and not os.path.exists(os.path.join(step.directory, 'INCAR'))):
+            if isinstance(step.clone_from, str):
+                source = self.steps[step.clone_from]
+            else:
+                source = step.clone_from(parents)
+            log.debug('{0}: cloning {1}'.format(name, source.directory))
+            with jasp(source.directory) as calc:
+                calc.clone(step.directory, extra_files=step.extra_files)
+
+        kwargs = dict(step.parameters)
+        if step.atoms is not None and not started:
+            kwargs['atoms'] = step.atoms.copy()
+        with jasp(step.directory, **kwargs) as calc:
+            atoms = calc.get_atoms()
+            if step.update is not None and not started:
+                step.update(atoms, parents, **step.update_args)
+            elif started:
+                log.info('{0}: continuing {1}'.format(name, step.directory))
+            open(marker, 'w').close()
+            calc.calculate(atoms)
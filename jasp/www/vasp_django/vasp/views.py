@@ -8,15 +8,13 @@ JASPRC['mode'] = None # do not run calculations
 DATAROOT = '/home/jkitchin/dft-org'
 
 def index(request):
-
-    vaspdirs = []
-
-    for dirpath, dirnames, fnames in os.walk(DATAROOT):
-
-        if '.git' in dirpath:
-            continue
-        if ('INCAR' in fnames):
-            vaspdirs.append(os.path.relpath(dirpath, DATAROOT))
+    # one query of the index. Refresh it outside of the web server,
+    # e.g. from cron:
+    #   */15 * * * * jaspindex refresh /home/jkitchin/dft-org
+    # Only vasp and NEB directories are listed (see
+    # discover.classify_listing), not every directory with an INCAR.
+    vaspdirs = [os.path.relpath(row['vaspdir'], DATAROOT)
+                for row in list_calculations(DATAROOT)]
 
     t = loader.get_template('vasp/index.html')
     c = Context({'vaspdirs': vaspdirs})
@@ -42,10 +42,13 @@ class myapp(object):
 
 
     def contents(self):
-        vaspdirs = []
-        for dirpath, dirnames, filenames in os.walk(ROOT):
-            if 'INCAR' in filenames:
-                vaspdirs.append(os.path.relpath(dirpath,ROOT))
+        # one query of the index. Refresh it outside of the server,
+        # e.g. from cron:
+        #   */15 * * * * jaspindex refresh /home/jkitchin/dft-org
+        # Only vasp and NEB directories are listed (see
+        # discover.classify_listing), not every directory with an INCAR.
+        vaspdirs = [os.path.relpath(row['vaspdir'], ROOT)
+                    for row in list_calculations(ROOT)]
         body = '''<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01 Transitional//EN"> <html><body>'''
         for vd in vaspdirs:
             body += '''<p><a href="/?path={0}">{0}</a></p>'''.format(vd)
@@ -104,27 +107,23 @@ class myapp(object):
 
         if action.startswith('file:'):
             print 'running file:'
-            try:
-                f = action[5:]
-                CWD = os.getcwd()
-                os.chdir(ROOT)
-
-                if os.path.exists(os.path.join(path,f)):
-                    with open(os.path.join(path,f)) as fi:
-                        contents = fi.readlines()
-                        if f == 'POTCAR':
-                            contents = contents[0]
-                        else:
-                            contents = ''.join(contents)
-                else:
-                    contents = 'No file {0} found in {1}'.format(f,os.getcwd())
-
-                resp = Response(body=contents,
-                                content_type='text/plain')
-                return resp
-            finally:
-                print 'changing back'
-                os.chdir(CWD)
+            f = action[5:]
+            fname = os.path.join(ROOT, path, f)
+
+            if os.path.exists(fname):
+                with open(fname) as fi:
+                    contents = fi.readlines()
+                    if f == 'POTCAR':
+                        contents = contents[0]
+                    else:
+                        contents = ''.join(contents)
+            else:
+                contents = 'No file {0} found in {1}'.format(
+                    f, os.path.join(ROOT, path))
+
+            resp = Response(body=contents,
+                            content_type='text/plain')
+            return resp
 
         print 'running %s after file: code' % action
         dir = os.path.join(ROOT, path)
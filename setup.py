@@ -9,7 +9,9 @@ setup(name = 'jasp',
       license='GPL',
       platforms=['linux'],
       packages=['jasp'],
-      scripts=['jasp/bin/runjasp.py','jasp/bin/jaspsum'],      
+      scripts=['jasp/bin/runjasp.py','jasp/bin/jaspsum',
+               'jasp/bin/jasppotcars', 'jasp/bin/jaspfarm',
+               'jasp/bin/jaspflow', 'jasp/bin/jaspindex'],      
       test_suite = 'nose.collector',
       long_description='''extensions to ase.calculators.vasp. jasp uses modern python patterns and tools.''',
       #dependency_links = ['https://wiki.fysik.dtu.dk/ase-files/python-ase-3.7.1.3184.tar.gz#egg=ase'],      
@@ -23,5 +25,6 @@ setup(name = 'jasp',
           #"Django",
           #"pyxser", # https://github.com/dmw/pyxser
           #"apsw" #http://code.google.com/p/apsw/
+          #"scandir", # faster directory listings on python 2
           ],)
 